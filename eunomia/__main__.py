@@ -1,13 +1,38 @@
 import bot
+import eunomialog
+import version
 import configparser
+import functools
 import sys
-import subprocess
 
-def get_pretty_version():
-	git_describe = subprocess.check_output(["git", "describe", "--always"]).decode("UTF-8").replace('\n', '')
-	current_branch = subprocess.check_output(["git", "rev-parse", "--abbrev-ref", "HEAD"]).decode("UTF-8").replace('\n', '')
-	return "eunomia {}-{}".format(current_branch, git_describe)
-	
+# Optional subsystems (metrics, search, archiving, the asyncio runtime, several networks) are only imported
+# when the config enables them, so they cost nothing on startup otherwise.
+
+def read_networks(config):
+	""" Lists the networks to connect to.
+
+		``[irc]`` is the default network, and every ``[irc:<name>]`` section is a network called ``<name>``.
+		A network's ident comes from ``[ident:<name>]``, or ``[ident]`` if it has no section of its own.
+
+		:returns: A list of ``(name, irc section, ident section)``, where the name is ``None`` for the default network.
+	"""
+	default_ident = config["ident"] if config.has_section("ident") else {}
+
+	network_configs = []
+	if config.has_section("irc"):
+		network_configs.append((None, config["irc"], default_ident))
+
+	for section in config.sections():
+		if not section.startswith("irc:"):
+			continue
+
+		name = section[len("irc:"):].strip()
+		ident_section = "ident:{}".format(name)
+		ident_config = config[ident_section] if config.has_section(ident_section) else default_ident
+		network_configs.append((name, config[section], ident_config))
+
+	return network_configs
+
 def main(args=None):
 	config_name = "eunomia.ini"
 
@@ -21,26 +46,133 @@ def main(args=None):
 		# This exception should never be caught, so we don't need to sys.exit()
 		raise Exception("Config file \"{}\" not found or empty! Aborting.".format(config_name))
 
-	irc_config = config["irc"]
-	ident_config = config["ident"]
+	network_configs = read_networks(config)
+	if network_configs == []:
+		raise Exception("Config file \"{}\" has no [irc] or [irc:<name>] section! Aborting.".format(config_name))
+
+	# The runtime is the same for every network. It is read from the first network section.
+	runtime = network_configs[0][1].get("runtime", "blocking")
+	if runtime not in ("blocking", "asyncio"):
+		raise Exception("Runtime \"{}\" not supported.".format(runtime))
+
+	# The [log] section is optional. Without it, logs are written synchronously.
+	log_writer = None
+	log_config = config["log"] if config.has_section("log") else {}
+
+	if runtime == "asyncio":
+		# Logs are always written by an executor, so the event loop never waits for the disk.
+		import asyncio
+		import aiobot
+
+		loop = asyncio.new_event_loop()
+		log_writer = aiobot.ExecutorLogWriter(
+			loop,
+			log_config.get("durability", "flush"),
+			int(log_config.get("batch_size", 64)),
+			float(log_config.get("flush_interval", 0.5)))
+	elif log_config.get("writer", "sync") == "thread":
+		log_writer = eunomialog.LogWriter(
+			log_config.get("durability", "flush"),
+			int(log_config.get("batch_size", 64)),
+			float(log_config.get("flush_interval", 0.5)),
+			int(log_config.get("queue_size", 10000)))
+
+	# The [metrics] section is optional too. Metrics are disabled without it.
+	metrics_registry = None
+	metrics_dump_file = None
+
+	if config.has_section("metrics"):
+		metrics_config = config["metrics"]
+
+		if metrics_config.getboolean("enabled", False):
+			import metrics
+
+			metrics_registry = metrics.Metrics()
+			metrics_dump_file = metrics_config.get("dump_file", "")
+			metrics_dump_interval = metrics_config.getfloat("dump_interval", 60)
+
+	archiver = None
+	if config.has_section("archive") and config["archive"].getboolean("enabled", False):
+		import archive
+
+		archive_config = config["archive"]
+		archiver = archive.Archiver(
+			archive_config.get("compression", "gzip"),
+			archive_config.getint("block_size", 131072),
+			archive_config.getfloat("delay", 60))
+
+	# With more than one network, every bot is built on one shared reactor (see the networks module).
+	reactor = None
+	if len(network_configs) > 1:
+		import networks
+
+		if runtime == "asyncio":
+			reactor = aiobot.SharedAioReactor(loop)
+		else:
+			reactor = networks.SharedReactor()
+
+	# The [version] section is optional. Git is only asked if there is no generated version module (see the version module).
+	use_git = config.has_section("version") and config["version"].getboolean("git", False)
+	pretty_version = version.get_pretty_version(use_git)
+	bots = []
+
+	for (network, irc_config, ident_config) in network_configs:
+		server = irc_config.get("server", "irc.freenode.net")
+		# 'channels' takes a comma separated list. 'channel' (a single channel) is still accepted.
+		channels = irc_config.get("channels", irc_config.get("channel", "#eunomia_default"))
+		channels = [channel.strip() for channel in channels.split(",") if channel.strip()]
+		nick = irc_config.get("nick", "eunomia")
+		port = int(irc_config.get("port", 6667))
+
+		ident_username = ident_config.get("username", nick)
+		ident_pass = ident_config.get("password", "eunomia_default")
+		ident_method = ident_config.get("method", "none")
+
+		ident_packed = (ident_username, ident_pass, ident_method)
+
+		if ident_method == "none":
+			ident_packed = None
+
+		if runtime == "asyncio":
+			bot_inst = aiobot.AioEunomiaBot(channels, nick, server, pretty_version, ident_packed, port, log_writer, metrics_registry, loop, network, reactor)
+		else:
+			bot_inst = bot.EunomiaBot(channels, nick, server, pretty_version, ident_packed, port, log_writer, metrics_registry, network, reactor)
+		bot_inst.connection.buffer_class.errors = "replace"
+
+		if config.has_section("backlog") and config["backlog"].getboolean("warm_restart", False):
+			bot_inst.restore_backlogs()
+
+		if config.has_section("search") and config["search"].getboolean("enabled", False):
+			bot_inst.enable_search()
+
+		if archiver != None:
+			bot_inst.enable_archiving(archiver)
+
+		if config.has_section("flood") and config["flood"].getboolean("enabled", False):
+			flood_config = config["flood"]
+			bot_inst.enable_flood_filter(flood_config.getfloat("window", 10.0),
+				flood_config.getint("repeat_limit", 3),
+				flood_config.getint("nick_limit", 8),
+				flood_config.getint("presence_limit", 10),
+				flood_config.getint("overload_limit", 40))
 
-	server = irc_config.get("server", "irc.freenode.net")
-	channel = irc_config.get("channel", "#eunomia_default")
-	nick = irc_config.get("nick", "eunomia")
-	port = irc_config.getint("port", 6667)
+		if config.has_section("send"):
+			import sendqueue
 
-	ident_username = ident_config.get("username", nick)
-	ident_pass = ident_config.get("password", "eunomia_default")
-	ident_method = ident_config.get("method", "none")
+			send_config = config["send"]
+			bot_inst.send_queue = sendqueue.SendQueue(bot_inst.connection, bot_inst.reactor.scheduler,
+				send_config.getfloat("rate", 0.5),
+				send_config.getint("burst", 5))
 
-	ident_packed = (ident_username, ident_pass, ident_method)
+		bots.append(bot_inst)
 
-	if ident_method == "none":
-		ident_packed = None
+	if metrics_dump_file:
+		bots[0].reactor.scheduler.execute_every(metrics_dump_interval, functools.partial(metrics_registry.dump, metrics_dump_file))
 
-	bot_inst = bot.EunomiaBot(channel, nick, server, get_pretty_version(), ident_packed, port)
-	bot_inst.connection.buffer_class.errors = "replace"
-	bot_inst.start()
+	if reactor != None:
+		networks.serve(bots)
+	else:
+		bots[0].start()
 
 if __name__ == "__main__":
 	main()
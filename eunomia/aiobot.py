@@ -0,0 +1,374 @@
+"""
+.. module:: aiobot
+	:platform: Unix
+	:synopsis: An asyncio runtime for EunomiaBot, built on the irc library's ``client_aio``.
+
+:class:`AioEunomiaBot` is an :class:`bot.EunomiaBot` whose connection is an :class:`irc.client_aio.AioConnection`:
+the socket is read by an asyncio protocol, and the handlers run on the event loop.
+What happens in memory (the backlog, the vote tally) stays on the loop; it takes microseconds.
+Everything that touches the disk is handed to a single-threaded executor, so no handler waits for it:
+
+* channel log lines go through an :class:`ExecutorLogWriter`,
+* legislated proposals go through a :class:`DeferredJournal`,
+* search index writes go through a :class:`DeferredSearchIndex`, after the log lines they point into,
+* searches run in the executor on a connection of their own (see :func:`search.search_log_dir`).
+
+Timers (reconnecting, the metrics dump, ...) use ``reactor.scheduler`` as before, which is a :class:`LoopScheduler`
+here: a thin layer over ``loop.call_later``.
+
+Handlers may be coroutine functions. Their coroutines are run as tasks, so a slow one (e.g. a search)
+never holds up the events after it. The ``on_*`` handlers inherited from :class:`bot.EunomiaBot` stay plain
+functions: they only queue the event's line on the pipeline (see :mod:`pipeline`) and never wait for anything,
+so a task per event would only add its overhead, and a loop iteration of delay before the line is queued.
+Only what waits (a search) is a coroutine.
+
+Several bots (one per network) can share one event loop: build them on one :class:`SharedAioReactor`
+(see :mod:`networks`), and they share the loop, the timers and the executor work.
+
+"""
+
+import asyncio
+import concurrent.futures
+import datetime
+import functools
+import time
+
+import irc.client
+import irc.client_aio
+
+import bot
+import eunomialog
+import logsetup
+import networks
+
+class LoopScheduler:
+	""" Implements the interface of ``irc.schedule.IScheduler`` with ``loop.call_later``, so nothing needs polling.
+
+		:param loop: The event loop.
+		:type loop: asyncio.AbstractEventLoop
+	"""
+	def __init__(self, loop):
+		self.loop = loop
+
+	@staticmethod
+	def to_seconds(period):
+		if isinstance(period, datetime.timedelta):
+			return period.total_seconds()
+		return period
+
+	def execute_after(self, delay, func):
+		return self.loop.call_later(self.to_seconds(delay), func)
+
+	def execute_at(self, when, func):
+		if isinstance(when, datetime.datetime):
+			when = when.timestamp()
+		return self.loop.call_later(max(0, when - time.time()), func)
+
+	def execute_every(self, period, func):
+		period = self.to_seconds(period)
+		repeating = RepeatingHandle()
+
+		def run():
+			repeating.handle = self.loop.call_later(period, run)
+			func()
+
+		repeating.handle = self.loop.call_later(period, run)
+		return repeating
+
+	def run_pending(self):
+		# The loop runs everything when it is due.
+		pass
+
+class RepeatingHandle:
+	""" What :meth:`LoopScheduler.execute_every` returns: every run schedules the next one, and :meth:`cancel`
+		cancels whichever is scheduled now.
+	"""
+	def __init__(self):
+		self.handle = None
+
+	def cancel(self):
+		self.handle.cancel()
+
+class EunomiaAioReactor(irc.client_aio.AioReactor):
+	""" An :class:`irc.client_aio.AioReactor` with a :class:`LoopScheduler`, and support for coroutine handlers.
+	"""
+	def __init__(self, loop):
+		# Event type -> what matching_handlers() returns. Cleared whenever a handler is added or removed.
+		self.merged_handlers = {}
+		super().__init__(loop=loop)
+		self.scheduler = LoopScheduler(loop)
+
+	def add_global_handler(self, event, handler, priority=0):
+		super().add_global_handler(event, handler, priority)
+		self.merged_handlers.clear()
+
+	def remove_global_handler(self, event, handler):
+		removed = super().remove_global_handler(event, handler)
+		self.merged_handlers.clear()
+		return removed
+
+	def matching_handlers(self, connection, event):
+		""" Gets the handlers of an event, in priority order. The list is shared, and must not be changed.
+		"""
+		handlers = self.merged_handlers.get(event.type)
+		if handlers == None:
+			handlers = self.merged_handlers[event.type] = sorted(self.handlers.get("all_events", []) + self.handlers.get(event.type, []))
+		return handlers
+
+	def _handle_event(self, connection, event):
+		with self.mutex:
+			for handler in self.matching_handlers(connection, event):
+				result = handler.callback(connection, event)
+				if asyncio.iscoroutine(result):
+					self.loop.create_task(result)
+				elif result == "NO MORE":
+					return
+
+class SharedAioReactor(networks.RoutingMixin, EunomiaAioReactor):
+	""" An :class:`EunomiaAioReactor` for several networks on one event loop. See :mod:`networks`.
+	"""
+
+class ExecutorLogWriter(eunomialog.LogWriter):
+	""" A :class:`eunomialog.LogWriter` for the event loop: lines are batched on the loop, and batches are written
+		by a single-threaded executor, in order.
+
+		:param loop: The event loop.
+		:type loop: asyncio.AbstractEventLoop
+
+		The other parameters are as for :class:`eunomialog.LogWriter`, except that there is no queue to bound:
+		the executor gets one task per batch.
+	"""
+	def __init__(self, loop, durability="flush", batch_size=64, flush_interval=0.5):
+		if durability not in self.durabilities:
+			raise ValueError("Log durability \"{}\" not supported.".format(durability))
+
+		self.logger = logsetup.get_pipeline().get_logger("LogWriter")
+
+		self.loop = loop
+		self.durability = durability
+		self.batch_size = batch_size
+		self.flush_interval = flush_interval
+
+		self.executor = concurrent.futures.ThreadPoolExecutor(1, "LogWriter")
+		# Only used from the executor's thread. See eunomialog.LogWriter.get_file().
+		self.files = {}
+		# Tasks given to the executor, and the ones it finished (only counted on its thread), for pending().
+		self.submitted = 0
+		self.completed = 0
+
+		self.batch = []
+		# (function, arguments) to run after the batch is written. See defer().
+		self.deferred = []
+		self.flush_handle = None
+		self.closed = False
+
+	def put(self, key, filename, lines):
+		self.batch.append((key, filename, lines))
+
+		if len(self.batch) >= self.batch_size:
+			self.flush()
+		elif self.flush_handle == None:
+			self.flush_handle = self.loop.call_later(self.flush_interval, self.flush)
+
+	def defer(self, function, *args):
+		""" Runs something else that writes to the disk on the executor, right after the current batch is written.
+			Unlike :meth:`submit`, this doesn't cut the batch short.
+		"""
+		self.deferred.append((function, args))
+		if self.flush_handle == None:
+			self.flush_handle = self.loop.call_later(self.flush_interval, self.flush)
+
+	def flush(self):
+		""" Hands the current batch (and what was deferred until after it) to the executor.
+		"""
+		if self.flush_handle != None:
+			self.flush_handle.cancel()
+			self.flush_handle = None
+
+		if self.batch or self.deferred:
+			(batch, self.batch) = (self.batch, [])
+			(deferred, self.deferred) = (self.deferred, [])
+			self.submit_task(self.write_batch_and_run, batch, deferred)
+
+	def write_batch_and_run(self, batch, deferred):
+		if batch:
+			self.write_batch(batch)
+		for (function, args) in deferred:
+			function(*args)
+
+	def pending(self):
+		return len(self.batch) + len(self.deferred) + self.submitted - self.completed
+
+	def submit(self, function, *args):
+		""" Runs something else that writes to the disk on the executor, after everything queued so far.
+		"""
+		self.flush()
+		return self.submit_task(function, *args)
+
+	def submit_task(self, function, *args):
+		self.submitted += 1
+		return self.executor.submit(self.run_task, function, args)
+
+	def run_task(self, function, args):
+		try:
+			return function(*args)
+		finally:
+			self.completed += 1
+
+	def close(self):
+		""" Writes everything that is pending, and closes the files. Blocks until that's done.
+
+			Safe to call more than once.
+		"""
+		if self.closed:
+			return
+		self.closed = True
+
+		self.flush()
+		self.submit_task(self.close_files)
+		self.executor.shutdown(wait=True)
+
+	def close_files(self):
+		for (filename, logfile) in self.files.values():
+			logfile.close()
+		self.files = {}
+
+class DeferredJournal:
+	""" Stands in for a :class:`journal.ProposalJournal`, appending to it on an :class:`ExecutorLogWriter`'s executor.
+
+		:param proposal_journal: The journal.
+		:param writer: The writer whose executor appends the records.
+		:type proposal_journal: journal.ProposalJournal
+		:type writer: ExecutorLogWriter
+	"""
+	def __init__(self, proposal_journal, writer):
+		self.proposal_journal = proposal_journal
+		self.writer = writer
+		# Appends happen in order on one thread, so the numbers can be handed out in advance.
+		self.next_number = len(proposal_journal)
+
+	def append(self, record):
+		number = self.next_number
+		self.next_number += 1
+		self.writer.submit(self.proposal_journal.append, record)
+		return number
+
+	def __getattr__(self, name):
+		return getattr(self.proposal_journal, name)
+
+class DeferredSearchIndex:
+	""" Stands in for a :class:`search.SearchIndex`, running its writes on an :class:`ExecutorLogWriter`'s executor,
+		after the log lines they point into.
+
+		The index has to be opened on the executor's thread too, since SQLite connections stay on the thread that
+		opened them (see :meth:`AioEunomiaBot.open_search_index`).
+
+		:param search_index: The index.
+		:param writer: The writer whose executor writes to it.
+		:type search_index: search.SearchIndex
+		:type writer: ExecutorLogWriter
+	"""
+	def __init__(self, search_index, writer):
+		self.search_index = search_index
+		self.writer = writer
+		self.log_dir = search_index.log_dir
+
+	def add(self, date, offset, end, item):
+		self.writer.defer(self.search_index.add, date, offset, end, item)
+
+	def commit(self):
+		""" Commits what was added so far.
+
+			:returns: A :class:`concurrent.futures.Future` that is done once it is committed.
+		"""
+		return self.writer.submit(self.search_index.commit)
+
+	def close(self):
+		self.writer.submit(self.search_index.close)
+
+class AioEunomiaBot(bot.EunomiaBot):
+	""" :class:`bot.EunomiaBot` on an asyncio event loop. See the module description.
+
+		:param loop: The event loop. Defaults to the reactor's, if there is one, or a new one.
+		:type loop: asyncio.AbstractEventLoop
+
+		The other parameters are as for :class:`bot.EunomiaBot`, except that ``log_writer`` has to be an
+		:class:`ExecutorLogWriter` on the same loop. Without one, one with the default settings is used.
+	"""
+	def __init__(self, channels, nickname, server, pretty_version, ident_packed=None, port=6667, log_writer=None, metrics=None, loop=None, network=None, reactor=None, clock=None):
+		if reactor != None:
+			loop = reactor.loop
+		elif loop == None:
+			loop = asyncio.new_event_loop()
+		self.loop = loop
+
+		if reactor == None:
+			# Read by irc.client.SimpleIRCClient.__init__, which takes no arguments.
+			self.reactor_class = functools.partial(EunomiaAioReactor, loop)
+
+		if log_writer == None:
+			log_writer = ExecutorLogWriter(loop)
+
+		super().__init__(channels, nickname, server, pretty_version, ident_packed, port, log_writer, metrics, network, reactor, clock)
+
+		for state in self.channel_states.values():
+			self.defer_journal(state)
+
+	def open_search_index(self, log_dir):
+		""" :meth:`bot.EunomiaBot.open_search_index`, on the executor's thread, which does every write to the index.
+		"""
+		(search_index, indexed) = self.log_writer.submit(bot.EunomiaBot.open_search_index, self, log_dir).result()
+		return (DeferredSearchIndex(search_index, self.log_writer), indexed)
+
+	def defer_journal(self, state):
+		state.proposal_journal = DeferredJournal(state.proposal_journal, self.log_writer)
+		state.legislator.proposal_journal = state.proposal_journal
+
+	def connect(self, *args, **kwargs):
+		""" Starts connecting. Called by ``irc.bot.SingleServerIRCBot`` (on start, and to reconnect).
+		"""
+		self.loop.create_task(self.connect_or_retry(self.connection.connect(*args, **kwargs)))
+
+	async def connect_or_retry(self, connecting):
+		try:
+			await connecting
+		except OSError:
+			self.logger.warning("Could not connect to %s.", self.connection.server)
+			# Makes irc.bot's reconnect strategy try again later, as with the blocking runtime.
+			self.connection._handle_event(irc.client.Event("disconnect", self.connection.server, "", [""]))
+
+	def start(self):
+		""" Connects, and runs the event loop forever.
+		"""
+		self._connect()
+		self.reactor.process_forever()
+
+	def _dispatcher(self, connection, event):
+		""" Dispatches events to ``on_<event type>`` methods, which may be coroutine functions.
+		"""
+		method = getattr(self, "on_" + event.type, None)
+		if method != None:
+			# A coroutine is returned to the reactor, which runs it as a task.
+			return method(connection, event)
+
+	def search_command(self, state, sender, query, command_offset=None):
+		self.loop.create_task(self.search_async(state, sender, query, command_offset))
+
+	async def search_async(self, state, sender, query, command_offset=None):
+		""" :meth:`bot.EunomiaBot.search_command`, with the query on the executor.
+		"""
+		search_index = state.channel_logger.search_index
+		if search_index == None or not query.strip():
+			bot.EunomiaBot.search_command(self, state, sender, query, command_offset)
+			return
+
+		# Imported by bot.EunomiaBot.open_search_index() already, if there is an index.
+		import search
+
+		if command_offset == None:
+			command_offset = state.channel_logger.last_offset
+		# The query runs on a connection of its own, which only sees committed lines.
+		await asyncio.wrap_future(search_index.commit())
+		results = await self.loop.run_in_executor(None, search.search_log_dir, search_index.log_dir, query, self.max_search_results + 1)
+		results = [result for result in results if result.offset != command_offset][:self.max_search_results]
+		self.reply_results(state, sender, results)
@@ -0,0 +1,234 @@
+"""
+.. module:: analytics
+	:platform: Unix
+	:synopsis: Activity and legislation statistics over a channel's log history.
+
+Reports, for a range of days:
+
+* message counts per nick (messages and actions),
+* activity per hour of the day (UTC),
+* the distribution of the time from a proposal to the vote that passed it,
+* how many of the lines that got votes passed.
+
+Days (plain or archived, see :mod:`archive`) are analyzed in parallel, one day per task of a process pool.
+Within a day, the counting is done with NumPy on the raw bytes of the log, rather than line by line in Python.
+Only the votes need a line by line pass: they are counted by replaying the day through :mod:`legislation`,
+as in :mod:`replay`. Per-day results are small arrays, which are merged with NumPy as well.
+
+NumPy is only needed here, so it isn't in ``requirements.txt``: install it with ``pip install numpy``,
+or install eunomia with the ``analytics`` extra (``pip install .[analytics]``).
+
+::
+
+	python eunomia/analytics.py "#osdev-offtopic" --from 2016-01-01 --to 2016-12-31
+	python eunomia/analytics.py "#osdev-offtopic" --json report.json
+
+"""
+
+import argparse
+import functools
+import json
+import logging
+import multiprocessing
+import sys
+from re import compile as regex
+
+import numpy
+
+import archive
+import eunomialog
+import legislation
+import replay
+from backlog import Backlog
+
+# The nicks of messages and actions, straight from the bytes of a log.
+message_nick_matcher = regex(rb"(?m)^\d\d:\d\d:\d\d <([^>\n]+)> ")
+action_nick_matcher = regex(rb"(?m)^\d\d:\d\d:\d\d \* ([^*\s]\S*) ")
+
+# Upper bounds (in seconds) of the vote-to-pass latency histogram buckets.
+latency_bounds = numpy.array([10, 30, 60, 120, 300, 600, 1800, 3600, 86400])
+
+def count_messages(data):
+	""" Counts the messages in a day's log, per nick and per hour.
+
+		:param data: The whole log, as bytes.
+		:type data: bytes
+		:returns: ``(nicks, counts, hourly)``: an array of (lower case) nicks, their message counts, and messages per hour.
+	"""
+	buffer = numpy.frombuffer(data, dtype=numpy.uint8)
+
+	# Every line starts with "HH:MM:SS ", so everything needed to classify a line is at a fixed offset from its start.
+	starts = numpy.flatnonzero(buffer == ord("\n")) + 1
+	starts = numpy.concatenate(([0], starts[starts < len(buffer)]))
+	starts = starts[starts + 11 < len(buffer)]
+
+	first = buffer[starts + 9]
+	second = buffer[starts + 10]
+	# "<nick> text", or "* nick text" (but not "*** Joins: ...").
+	is_message = (first == ord("<")) | ((first == ord("*")) & (second == ord(" ")))
+
+	hours = (buffer[starts].astype(numpy.int64) - ord("0")) * 10 + (buffer[starts + 1] - ord("0"))
+	hours = hours[is_message]
+	hourly = numpy.bincount(hours[(hours >= 0) & (hours < 24)], minlength=24)
+
+	nicks = message_nick_matcher.findall(data) + action_nick_matcher.findall(data)
+	if not nicks:
+		return (numpy.array([], dtype="S1"), numpy.array([], dtype=numpy.int64), hourly)
+
+	(nicks, counts) = numpy.unique(numpy.char.lower(numpy.array(nicks)), return_counts=True)
+	return (nicks, counts, hourly)
+
+def count_votes(path, start, channel, backlog_length):
+	""" Replays a day's votes.
+
+		:param start: The start of the day, in seconds since the epoch (see :func:`replay.day_start`).
+		:returns: ``(candidates, latencies)``: how many distinct lines got votes, and for every proposal that passed,
+			the seconds from the proposal to the vote that passed it.
+	"""
+	collector = replay.ProposalCollector()
+	legislator = legislation.Legislation(channel, collector, logger=replay.null_logger)
+	legislator.logger.setLevel(logging.WARNING)
+
+	day_backlog = Backlog(backlog_length)
+	voted_on = set()
+	latencies = []
+
+	for item in replay.items_from_lines((line for (offset, line) in archive.read_lines(path)), start):
+		day_backlog.append(item)
+		# Records are journaled a while after the proposal passed, so look at what is pending instead.
+		newest = legislator.pending[-1] if legislator.pending else None
+		legislator.dereference_if_vote(item, day_backlog)
+
+		if legislator.active_proposal != None:
+			voted_on.add(legislator.active_proposal)
+		if legislator.pending and legislator.pending[-1] is not newest:
+			# This line was the vote that passed it.
+			latencies.append(item.when - legislator.pending[-1].proposal.when)
+
+	return (len(voted_on), numpy.array(latencies, dtype=numpy.int64))
+
+def analyze_day(day, channel, backlog_length):
+	""" Analyzes one day of a channel's log. Runs in a worker process.
+
+		:param day: ``(date, path)``, as from :func:`archive.log_days`.
+		:returns: A dict of the day's (small) result arrays.
+	"""
+	(date, path) = day
+
+	data = b"".join(block for (offset, block) in archive.read_blocks(path))
+	(nicks, counts, hourly) = count_messages(data)
+	(candidates, latencies) = count_votes(path, replay.day_start(date), channel, backlog_length)
+
+	return {
+		"date": date,
+		"nicks": nicks,
+		"counts": counts,
+		"hourly": hourly,
+		"candidates": candidates,
+		"latencies": latencies,
+	}
+
+def merge(results):
+	""" Merges per-day results into the totals for the whole range.
+	"""
+	nicks = numpy.concatenate([result["nicks"] for result in results])
+	counts = numpy.concatenate([result["counts"] for result in results])
+	(nicks, inverse) = numpy.unique(nicks, return_inverse=True)
+	counts = numpy.bincount(inverse, weights=counts, minlength=len(nicks)).astype(numpy.int64)
+
+	order = numpy.argsort(-counts, kind="stable")
+	latencies = numpy.concatenate([result["latencies"] for result in results])
+	candidates = sum(result["candidates"] for result in results)
+
+	return {
+		"days": len(results),
+		"nicks": nicks[order],
+		"counts": counts[order],
+		"hourly": numpy.sum([result["hourly"] for result in results], axis=0),
+		"latencies": latencies,
+		"candidates": candidates,
+		"passed": len(latencies),
+	}
+
+def format_report(report, top):
+	lines = []
+
+	lines.append("{} day(s), {} message(s) from {} nick(s).".format(report["days"], int(report["counts"].sum()), len(report["nicks"])))
+
+	lines.append("")
+	lines.append("Top nicks:")
+	for (nick, count) in zip(report["nicks"][:top], report["counts"][:top]):
+		lines.append("{:>10} {}".format(count, nick.decode("utf-8", "replace")))
+
+	lines.append("")
+	lines.append("Messages per hour (UTC):")
+	peak = max(1, int(report["hourly"].max()))
+	for (hour, count) in enumerate(report["hourly"]):
+		lines.append("{:02d} {:>10} {}".format(hour, count, "#" * int(round(40 * count / peak))))
+
+	lines.append("")
+	if report["candidates"]:
+		rate = report["passed"] / report["candidates"]
+	else:
+		rate = 0.0
+	lines.append("Proposals: {} of {} voted-on line(s) passed ({:.1%}).".format(report["passed"], report["candidates"], rate))
+
+	latencies = report["latencies"]
+	if len(latencies):
+		(p50, p90, p99) = numpy.percentile(latencies, [50, 90, 99])
+		lines.append("Vote-to-pass latency: p50 {:.0f}s, p90 {:.0f}s, p99 {:.0f}s, max {}s".format(p50, p90, p99, latencies.max()))
+		histogram = numpy.bincount(numpy.searchsorted(latency_bounds, latencies), minlength=len(latency_bounds) + 1)
+		for (bound, count) in zip(list(latency_bounds) + ["more"], histogram):
+			lines.append("{:>8} {:>10}".format("<= {}".format(bound) if bound != "more" else "more", count))
+
+	return "\n".join(lines)
+
+def to_json(report):
+	return {
+		"days": report["days"],
+		"messages_per_nick": {nick.decode("utf-8", "replace"): int(count) for (nick, count) in zip(report["nicks"], report["counts"])},
+		"messages_per_hour": [int(count) for count in report["hourly"]],
+		"proposals_voted_on": report["candidates"],
+		"proposals_passed": report["passed"],
+		"vote_to_pass_seconds": [int(latency) for latency in report["latencies"]],
+	}
+
+def main(args=None):
+	parser = argparse.ArgumentParser(description="Activity and legislation statistics over a channel's logs.")
+	parser.add_argument("channel", help="The channel, e.g. \"#osdev-offtopic\".")
+	parser.add_argument("--from", dest="first", metavar="DATE", help="First day (YYYY-MM-DD).")
+	parser.add_argument("--to", dest="last", metavar="DATE", help="Last day (YYYY-MM-DD).")
+	parser.add_argument("--jobs", type=int, default=None, help="Number of worker processes. Defaults to the number of CPUs.")
+	parser.add_argument("--backlog-length", type=int, default=50, help="Backlog capacity, as in the bot.")
+	parser.add_argument("--logs", metavar="DIR", help="Log root to read from, instead of the bot's.")
+	parser.add_argument("--network", metavar="NAME", help="Read the logs of this network (an [irc:NAME] section) instead of the default network's.")
+	parser.add_argument("--top", type=int, default=20, help="Number of nicks to list.")
+	parser.add_argument("--json", metavar="FILE", help="Also write the full report to this file, as JSON.")
+	options = parser.parse_args(args)
+
+	if options.logs != None:
+		eunomialog.log_root = options.logs
+	eunomialog.log_root = eunomialog.network_log_root(options.network)
+
+	log_dir = eunomialog.ChannelLogger(options.channel).log_dir
+	days = [(date, path) for (date, path) in archive.log_days(log_dir)
+		if (options.first == None or date >= options.first) and (options.last == None or date <= options.last)]
+
+	if not days:
+		print("No logs to analyze in \"{}\".".format(log_dir))
+		return 1
+
+	worker = functools.partial(analyze_day, channel=options.channel, backlog_length=options.backlog_length)
+	with multiprocessing.Pool(options.jobs) as pool:
+		report = merge(pool.map(worker, days, chunksize=1))
+
+	print(format_report(report, options.top))
+
+	if options.json != None:
+		with open(options.json, "w") as json_file:
+			json.dump(to_json(report), json_file, indent=1)
+
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,290 @@
+"""
+.. module:: archive
+	:platform: Unix
+	:synopsis: Compressed archival of finished daily logs, and a reader for plain and archived days alike.
+
+Once a day is over, its ``<date>.log`` is replaced by ``<date>.log.gz`` (or ``<date>.log.xz``) and ``<date>.log.gz.idx``.
+
+The archive is a series of independently compressed blocks of whole lines, each holding about ``block_size`` bytes
+of the original log. They are ordinary gzip members (or xz streams), so ``zcat``/``xzcat`` still read the archive as usual.
+The ``.idx`` file has one entry per block: its offset in the original log and its offset in the archive
+(both unsigned 64 bit little endian). With it, reading from any offset of the original log only decompresses
+the blocks from there on, so offsets into the logs (e.g. the ones in :mod:`search`) stay valid after archiving.
+
+Tools that read old logs should use :func:`log_days` to find them and :func:`read_lines` to read them.
+
+"""
+
+import bisect
+import glob
+import gzip
+import lzma
+import os
+import queue
+import re
+import struct
+import threading
+import time
+
+import eunomialog
+import logsetup
+
+# Compression name -> (archive file extension, compress function, decompress function).
+compressions = {
+	"gzip": (".gz", lambda data: gzip.compress(data, 6, mtime=0), gzip.decompress),
+	"lzma": (".xz", lambda data: lzma.compress(data, lzma.FORMAT_XZ), lzma.decompress),
+}
+
+# (offset in the original log, offset in the archive) of one block.
+index_entry = struct.Struct("<QQ")
+
+day_log_matcher = re.compile(r"(\d{4}-\d{2}-\d{2})\.log(\.gz|\.xz)?$")
+
+def archive_path(path):
+	""" Finds the archive of a plain log's path.
+
+		:returns: ``(archive path, compression name)``, or ``(None, None)`` if the log isn't archived.
+	"""
+	for (compression, (extension, compress, decompress)) in compressions.items():
+		if os.path.exists(path + extension):
+			return (path + extension, compression)
+	return (None, None)
+
+def log_days(log_dir):
+	""" Lists the daily logs in a directory, whether they are archived or not.
+
+		:param log_dir: E.g. :attr:`eunomialog.ChannelLogger.log_dir`.
+		:type log_dir: str
+		:returns: A list of ``(date, path)``, oldest first. ``date`` is as in the filename (``YYYY-MM-DD``),
+			and ``path`` is the path of the plain log, even if only its archive exists.
+	"""
+	days = set()
+	for name in os.listdir(log_dir) if os.path.isdir(log_dir) else []:
+		match = day_log_matcher.match(name)
+		if match != None:
+			days.add(match.group(1))
+
+	return [(date, os.path.join(log_dir, date + ".log")) for date in sorted(days)]
+
+def read_index(index_path):
+	with open(index_path, "rb") as index:
+		data = index.read()
+	return [index_entry.unpack_from(data, i) for i in range(0, len(data) - len(data) % index_entry.size, index_entry.size)]
+
+def read_blocks(path, offset=0):
+	""" Yields the contents of a daily log from an offset on, in blocks of whole lines.
+
+		:param path: The path of the plain log. Its archive is read instead if it has been archived.
+		:param offset: Byte offset in the plain log to start at. Must be the start of a line.
+		:type path: str
+		:type offset: int
+		:returns: A generator of ``(offset, bytes)``.
+	"""
+	if os.path.exists(path):
+		with open(path, "rb") as logfile:
+			logfile.seek(offset)
+			while True:
+				data = logfile.read(65536)
+				if data and not data.endswith(b"\n"):
+					data += logfile.readline()
+
+				# Only whole lines. A partial last line is still being written, and is left out.
+				end = data.rfind(b"\n") + 1
+				if end > 0:
+					yield (offset, data[:end])
+					offset += end
+				if end < len(data) or not data:
+					return
+
+	(compressed_path, compression) = archive_path(path)
+	if compressed_path == None:
+		raise FileNotFoundError("No log or archive for \"{}\".".format(path))
+	decompress = compressions[compression][2]
+
+	blocks = read_index(compressed_path + ".idx")
+	first = max(0, bisect.bisect_right(blocks, (offset, float("inf"))) - 1)
+
+	with open(compressed_path, "rb") as archive:
+		for i in range(first, len(blocks)):
+			(block_offset, compressed_offset) = blocks[i]
+			archive.seek(compressed_offset)
+			if i + 1 < len(blocks):
+				data = decompress(archive.read(blocks[i + 1][1] - compressed_offset))
+			else:
+				data = decompress(archive.read())
+
+			if block_offset < offset:
+				data = data[offset - block_offset:]
+				block_offset = offset
+			yield (block_offset, data)
+
+def read_lines(path, offset=0):
+	""" Streams the lines of a daily log, plain or archived, without reading all of it into memory.
+
+		:param path: The path of the plain log. Its archive is read instead if it has been archived.
+		:param offset: Byte offset in the plain log to start at. Must be the start of a line.
+		:type path: str
+		:type offset: int
+		:returns: A generator of ``(offset, line)``, where ``line`` is a ``str`` without the newline.
+	"""
+	for (block_offset, data) in read_blocks(path, offset):
+		raw_lines = data.split(b"\n")
+		if raw_lines[-1] == b"":
+			raw_lines.pop()
+
+		position = block_offset
+		for raw_line in raw_lines:
+			yield (position, raw_line.decode("utf-8", "replace"))
+			position += len(raw_line) + 1
+
+def read_line_at(path, offset):
+	""" Reads the line that starts at byte ``offset`` of a daily log, plain or archived.
+
+		:returns: The line without its trailing newline, or ``None`` if there is no (complete) line there (yet).
+	"""
+	try:
+		for (line_offset, line) in read_lines(path, offset):
+			return line
+	except FileNotFoundError:
+		pass
+	return None
+
+def read_tail_lines(path, count):
+	""" Reads the last ``count`` lines of a daily log, plain or archived.
+
+		Only the end of the log is read: for a plain log, see :func:`eunomialog.read_tail_lines`.
+		For an archive, only the blocks that hold those lines are decompressed, from the last one backwards.
+
+		:returns: A list of up to ``count`` lines, oldest first. Empty if there is no such log.
+	"""
+	if os.path.exists(path):
+		return eunomialog.read_tail_lines(path, count)
+
+	(compressed_path, compression) = archive_path(path)
+	if compressed_path == None or count <= 0:
+		return []
+
+	lines = []
+	for (block_offset, compressed_offset) in reversed(read_index(compressed_path + ".idx")):
+		# Blocks hold whole lines (see archive_log()), and only the first block from the offset on is decompressed.
+		(offset, data) = next(read_blocks(path, block_offset))
+		lines = [raw_line.decode("utf-8", "replace") for raw_line in data.split(b"\n")[:-1]] + lines
+		if len(lines) >= count:
+			break
+
+	return lines[-count:]
+
+def archive_log(path, compression="gzip", block_size=131072):
+	""" Compresses a finished daily log into an archive and its block index, then removes it.
+
+		The archive is written under a temporary name and renamed into place, so a crash never leaves a half archive,
+		and the plain log is only removed once the archive is complete.
+
+		:param path: The plain log.
+		:param compression: ``"gzip"`` or ``"lzma"``.
+		:param block_size: Uncompressed size of a block, in bytes. Smaller blocks make seeking cheaper and compression worse.
+		:type path: str
+		:type compression: str
+		:type block_size: int
+	"""
+	(extension, compress, decompress) = compressions[compression]
+	compressed_path = path + extension
+
+	index = []
+	with open(path, "rb") as logfile, open(compressed_path + ".tmp", "wb") as archive:
+		offset = 0
+		while True:
+			data = logfile.read(block_size)
+			if not data:
+				break
+			# Blocks end at the end of a line, so a line never has to be put together from two blocks.
+			data += logfile.readline()
+
+			index.append(index_entry.pack(offset, archive.tell()))
+			archive.write(compress(data))
+			offset += len(data)
+
+		archive.flush()
+		os.fsync(archive.fileno())
+
+	with open(compressed_path + ".idx.tmp", "wb") as index_file:
+		index_file.write(b"".join(index))
+
+	os.replace(compressed_path + ".idx.tmp", compressed_path + ".idx")
+	os.replace(compressed_path + ".tmp", compressed_path)
+	os.remove(path)
+
+class Archiver:
+	""" Archives finished days of logs from a background thread, so compression never happens on the IRC thread.
+
+		:class:`eunomialog.RolloverLogger` submits its log directory whenever it moves on to a new date.
+		The archiver waits ``delay`` seconds (so lines that are still queued in a :class:`eunomialog.LogWriter`
+		reach the old day's log), then archives every day in the directory before the logger's new date.
+
+		:param compression: ``"gzip"`` or ``"lzma"``.
+		:param block_size: Uncompressed size of a block. See :func:`archive_log`.
+		:param delay: Seconds to wait between a directory being submitted and archiving it.
+		:type compression: str
+		:type block_size: int
+		:type delay: float
+	"""
+	# Queue entry that tells the archiver thread to exit.
+	_close_marker = object()
+
+	def __init__(self, compression="gzip", block_size=131072, delay=60):
+		if compression not in compressions:
+			raise ValueError("Compression \"{}\" not supported.".format(compression))
+
+		self.logger = logsetup.get_pipeline().get_logger("Archiver")
+
+		self.compression = compression
+		self.block_size = block_size
+		self.delay = delay
+
+		self.queue = queue.Queue()
+		self.closing = threading.Event()
+		self.thread = threading.Thread(target=self.run, name="Archiver", daemon=True)
+		self.thread.start()
+
+	def submit(self, log_dir, today):
+		""" Asks for the finished days of a log directory to be archived, ``delay`` seconds from now.
+
+			:param log_dir: The log directory.
+			:param today: The current date of the submitting logger's clock (see :attr:`clock.Clock.date_string`).
+				The days before it are finished.
+			:type log_dir: str
+			:type today: str
+		"""
+		self.queue.put((time.monotonic() + self.delay, log_dir, today))
+
+	def close(self):
+		""" Stops the archiver thread. Directories that are still waiting are left for the next run.
+		"""
+		self.closing.set()
+		self.queue.put(self._close_marker)
+		self.thread.join()
+
+	def run(self):
+		while True:
+			entry = self.queue.get()
+			if entry is self._close_marker:
+				return
+
+			(due, log_dir, today) = entry
+			if self.closing.wait(max(0, due - time.monotonic())):
+				return
+
+			self.archive_dir(log_dir, today)
+
+	def archive_dir(self, log_dir, today):
+		""" Archives every plain daily log in a directory that is older than ``today`` (``YYYY-MM-DD``).
+		"""
+		today_name = "{}.log".format(today)
+		for path in sorted(glob.glob(os.path.join(glob.escape(log_dir), "????-??-??.log"))):
+			if os.path.basename(path) >= today_name:
+				continue
+			try:
+				archive_log(path, self.compression, self.block_size)
+				self.logger.info("Archived \"%s\".", path)
+			except OSError:
+				self.logger.exception("Could not archive \"%s\".", path)
@@ -1,9 +1,351 @@
+import bisect
+import collections
+import datetime
+import sys
+
+import irc.strings
+
+from re import compile as regex
+
 from timetools import TimeTools
 
+# Backlog item kinds. These are the names of the IRC events the items are built from.
+PUBMSG = "pubmsg"
+ACTION = "action"
+JOIN = "join"
+PART = "part"
+QUIT = "quit"
+KICK = "kick"
+MODE = "mode"
+TOPIC = "topic"
+PUBNOTICE = "pubnotice"
+# Not an IRC event: the summary of a join/part/quit flood. See floodfilter.
+FLOOD = "flood"
+
+# Kinds whose nick is the author of the text, i.e. lines that can be referred to by 'nick: :D'.
+AUTHORED_KINDS = frozenset((PUBMSG, ACTION))
+
+# Channel log lines, as EunomiaBot formats them, and the kind of line each one is.
+# The 'nick' group is the nick that caused the line, 'text' the message text (pubmsg/action only).
+log_line_matchers = (
+	(regex(r'<(?P<nick>[^>]+)> (?P<text>.*)$'), PUBMSG),
+	(regex(r'\* (?P<nick>\S+) (?P<text>.*)$'), ACTION),
+	(regex(r'\*\*\* Joins: (?P<nick>\S+)$'), JOIN),
+	(regex(r'\*\*\* Parts: (?P<nick>\S+) \('), PART),
+	(regex(r'\*\*\* Quits: (?P<nick>\S+) \('), QUIT),
+	(regex(r'\*\*\* Kick: \S+ by (?P<nick>\S+) \('), KICK),
+	(regex(r'\*\*\* Mode: .* by (?P<nick>\S+)$'), MODE),
+	(regex(r'\*\*\* Topic: ".*" by (?P<nick>\S+)$'), TOPIC),
+	(regex(r'\*\*\* Notice: \S+ ".*" by (?P<nick>\S+)$'), PUBNOTICE),
+)
+
+def parse_log_line(line):
+	""" Parses a channel log line (``HH:MM:SS <line>``) back into the parts a :class:`BacklogItem` is built from.
+
+		:param line: The log line, without its trailing newline.
+		:type line: str
+		:returns: A ``(kind, nick, text, timestamp)`` tuple, as :meth:`bot.EunomiaBot.message_to_backlog_item` takes them,
+			or ``None`` for lines that aren't channel events (e.g. ``--- log begin ---``) or can't be parsed.
+	"""
+	if len(line) < 10 or line[2] != ":" or line[5] != ":" or line[8] != " ":
+		return None
+
+	try:
+		timestamp = datetime.time(int(line[0:2]), int(line[3:5]), int(line[6:8]))
+	except ValueError:
+		return None
+
+	rest = line[9:]
+	for (matcher, kind) in log_line_matchers:
+		match = matcher.match(rest)
+		if match == None:
+			continue
+
+		if kind in AUTHORED_KINDS:
+			return (kind, match.group("nick"), match.group("text"), timestamp)
+		return (kind, match.group("nick"), rest, timestamp)
+
+	return None
+
 class BacklogItem:
-	def __init__(self, message, timestamp):
-		self.message = message
-		self.timestamp = TimeTools.truncate_ns(timestamp)
+	""" A single, pre-parsed line of channel backlog.
+
+		Everything about the line is computed once, at construction, so the hot path never has to re-parse it.
+
+		:param kind: The kind of line (one of the kind constants in this module, e.g. ``PUBMSG``).
+		:param nick: The nick that caused the line (the sender of a message, the joining user, ...).
+		:param text: The text of a message or action. For other kinds, the full preformatted line (e.g. ``*** Joins: nick``).
+		:param timestamp: The time the line was received. Truncated to whole seconds.
+		:param vote: The parsed vote (see :func:`legislation.parse_vote`), or ``None`` if the line is not a vote.
+		:param when: The time the line was received, in seconds since the epoch. Unlike ``timestamp``, this doesn't wrap
+			around at midnight, so the backlog can be searched by time (see :meth:`Backlog.time_bounds`).
+			Defaults to the time of the line before it, when it is appended.
+		:type kind: str
+		:type nick: str
+		:type text: str
+		:type timestamp: datetime.time
+		:type vote: tuple
+		:type when: float
+	"""
+	__slots__ = ("kind", "nick", "text", "message", "timestamp", "when", "vote", "votes", "legislated", "can_legislate", "seq")
+
+	def __init__(self, kind, nick, text, timestamp, vote=None, when=None):
+		self.kind = kind
+		self.nick = sys.intern(nick) if nick != None else None
+		self.text = text
+
+		# The line as it appears in the logs.
+		if kind == PUBMSG:
+			self.message = "<{}> {}".format(nick, text)
+		elif kind == ACTION:
+			self.message = "* {} {}".format(nick, text)
+		else:
+			self.message = text
+
+		if timestamp.microsecond:
+			timestamp = TimeTools.truncate_ns(timestamp)
+		# Usually clock.Clock.timestamp itself, which clock.Clock.format_time() recognizes.
+		self.timestamp = timestamp
+		self.when = when
+		self.vote = vote
 		self.votes = 0
 		self.legislated = False
 		self.can_legislate = True
+		# Assigned by Backlog.append().
+		self.seq = None
+
+class _Times:
+	""" The times (``when``) of a backlog's items, indexed by sequence number, for :mod:`bisect`. Nothing is copied.
+	"""
+	__slots__ = ("backlog",)
+
+	def __init__(self, backlog):
+		self.backlog = backlog
+
+	def __getitem__(self, seq):
+		return self.backlog._items[seq % self.backlog.size].when
+
+class Backlog:
+	""" Fixed-capacity ring buffer of :class:`BacklogItem` objects.
+
+		Every appended item is stamped with a monotonically increasing sequence number (``item.seq``).
+		Sequence numbers are never reused, so a reference to an item (e.g. the active proposal) stays valid
+		while older items are evicted, and no index shifting is needed.
+
+		Appending (and the eviction of the oldest item that comes with it) is O(1), whatever the capacity.
+
+		Alongside the items, a per-nick index maps each case-folded nick to a deque of the sequence numbers
+		of that nick's messages still in the backlog (or kept around, see below), so :meth:`nick_message` does not have to scan the backlog.
+
+		Item times (``item.when``) never go backwards in the backlog: an item older than the one before it (e.g. after
+		the system clock was set back) gets the same time as that one. So the items are sorted by time as well as by
+		sequence number, and :meth:`time_bounds` finds a time range with a binary search.
+
+		Evicted items are kept around for another ``slack`` appends. The backlog doesn't hold them anymore, but they
+		can still be looked up ``as_of`` the time they were (see :meth:`has_seq` and :meth:`nick_message`).
+		The bot appends a whole batch of lines before it legislates any of them (see :mod:`pipeline`),
+		so its legislators look at the backlog as it was when each line was appended.
+
+		:param capacity: The maximum number of items kept in the backlog.
+		:param slack: The number of appends evicted items are kept around for.
+		:type capacity: int
+		:type slack: int
+	"""
+	def __init__(self, capacity, slack=0):
+		if capacity < 1:
+			raise ValueError("Backlog capacity must be at least 1, got {}.".format(capacity))
+
+		self.capacity = capacity
+		self.slack = slack
+		# The ring holds the backlog and the items evicted in the last `slack` appends.
+		self.size = capacity + slack
+		self._items = [None] * self.size
+		# Sequence number that will be assigned to the next appended item.
+		self.next_seq = 0
+		# irc.strings.lower(nick) -> deque of sequence numbers, oldest first.
+		self.nick_index = {}
+		# The time of the newest item.
+		self.last_when = 0.0
+		self._times = _Times(self)
+
+	def __len__(self):
+		return min(self.next_seq, self.capacity)
+
+	@property
+	def first_seq(self):
+		""" Sequence number of the oldest item still in the backlog.
+		"""
+		return self.next_seq - len(self)
+
+	@property
+	def last_seq(self):
+		""" Sequence number of the newest item in the backlog, or ``None`` if the backlog is empty.
+		"""
+		if self.next_seq == 0:
+			return None
+		return self.next_seq - 1
+
+	def has_seq(self, seq, as_of=None):
+		""" Checks whether the item with sequence number ``seq`` is still in the backlog.
+
+			:param seq: The sequence number to check. ``None`` is accepted, and never in the backlog.
+			:param as_of: Check the backlog as it was when this item was the newest one, instead.
+				Only items evicted at most ``slack`` appends ago are still known.
+			:type seq: int
+			:type as_of: int
+			:rtype: bool
+		"""
+		if seq == None:
+			return False
+		if as_of == None:
+			return self.first_seq <= seq < self.next_seq
+		return as_of - self.capacity < seq <= as_of and seq >= self.next_seq - self.size
+
+	def get(self, seq, as_of=None):
+		""" Gets an item by its sequence number.
+
+			:param seq: The sequence number of the item.
+			:param as_of: As for :meth:`has_seq`.
+			:type seq: int
+			:type as_of: int
+			:returns: The :class:`BacklogItem`, or ``None`` if it was evicted (or never existed).
+		"""
+		if not self.has_seq(seq, as_of):
+			return None
+		return self._items[seq % self.size]
+
+	def append(self, item):
+		""" Appends an item, stamping it with the next sequence number.
+
+			:param item: The item to append.
+			:type item: BacklogItem
+			:returns: The evicted (oldest) :class:`BacklogItem` if the backlog was full, otherwise ``None``.
+		"""
+		slot = self.next_seq % self.size
+		evicted = self._items[(self.next_seq - self.capacity) % self.size] if self.next_seq >= self.capacity else None
+		# The item that was evicted `slack` appends ago, which is forgotten now.
+		dropped = self._items[slot] if self.next_seq >= self.size else None
+
+		if dropped != None and dropped.kind in AUTHORED_KINDS:
+			# Sequence numbers only grow, so the dropped item is always the oldest one in its nick's deque.
+			folded = irc.strings.lower(dropped.nick)
+			positions = self.nick_index[folded]
+			positions.popleft()
+			if not positions:
+				# Don't keep entries around for everyone who ever spoke.
+				del self.nick_index[folded]
+
+		if item.when == None or item.when < self.last_when:
+			item.when = self.last_when
+		self.last_when = item.when
+
+		item.seq = self.next_seq
+		self._items[slot] = item
+		self.next_seq += 1
+
+		if item.kind in AUTHORED_KINDS:
+			folded = irc.strings.lower(item.nick)
+			positions = self.nick_index.get(folded)
+			if positions == None:
+				positions = self.nick_index[folded] = collections.deque()
+			positions.append(item.seq)
+
+		return evicted
+
+	def nick_message(self, nick, back_x=0, as_of=None):
+		""" Finds the ``back_x``-th most recent message (0 being the newest) sent by ``nick``.
+
+			Nicks are compared case-insensitively, using IRC case folding.
+
+			:param nick: The nick whose messages to look for.
+			:param back_x: How many of the nick's messages to skip, newest first.
+			:param as_of: Look in the backlog as it was when this item was the newest one, as for :meth:`has_seq`.
+			:type nick: str
+			:type back_x: int
+			:type as_of: int
+			:returns: The sequence number of the message, or ``None`` if it is not in the backlog.
+		"""
+		positions = self.nick_index.get(irc.strings.lower(nick))
+		if positions == None:
+			return None
+
+		newest = len(positions) - 1
+		if as_of != None:
+			# Skip the nick's messages that came later. There are at most `slack` of them.
+			while newest >= 0 and positions[newest] > as_of:
+				newest -= 1
+		if back_x > newest:
+			return None
+
+		seq = positions[newest - back_x]
+		return seq if self.has_seq(seq, as_of) else None
+
+	def range(self, start_seq=None, end_seq=None):
+		""" Yields items from oldest to newest, with ``start_seq <= item.seq < end_seq``.
+
+			Both bounds are clamped to the backlog, so they may safely point at evicted or future items.
+			An explicit ``start_seq`` may reach back to the items evicted in the last ``slack`` appends.
+
+			:param start_seq: The first sequence number to yield. Defaults to the oldest item.
+			:param end_seq: The sequence number to stop before. Defaults to just past the newest item.
+			:type start_seq: int
+			:type end_seq: int
+		"""
+		start = self.first_seq if start_seq == None else max(start_seq, self.next_seq - self.size, 0)
+		end = self.next_seq if end_seq == None else min(end_seq, self.next_seq)
+
+		for seq in range(start, end):
+			yield self._items[seq % self.size]
+
+	def time_bounds(self, start_when=None, end_when=None, as_of=None):
+		""" Finds the items with ``start_when <= item.when <= end_when``, with a binary search over the item times.
+
+			:param start_when: The earliest time, in seconds since the epoch. Defaults to the oldest item.
+			:param end_when: The latest time. Defaults to the newest item.
+			:param as_of: Look in the backlog as it was when this item was the newest one, as for :meth:`has_seq`.
+			:type start_when: float
+			:type end_when: float
+			:type as_of: int
+			:returns: ``(start_seq, end_seq)``, to pass to :meth:`range`. Empty (``start_seq == end_seq``) if no item matches.
+		"""
+		if as_of == None:
+			(first, end_seq) = (self.first_seq, self.next_seq)
+		else:
+			(first, end_seq) = (max(as_of + 1 - self.capacity, self.next_seq - self.size, 0), as_of + 1)
+
+		start = first if start_when == None else bisect.bisect_left(self._times, start_when, first, end_seq)
+		end = end_seq if end_when == None else bisect.bisect_right(self._times, end_when, start, end_seq)
+		return (start, end)
+
+	def range_by_time(self, start_when=None, end_when=None):
+		""" Yields the items with ``start_when <= item.when <= end_when``, from oldest to newest. See :meth:`time_bounds`.
+		"""
+		return self.range(*self.time_bounds(start_when, end_when))
+
+	def reverse_from(self, seq=None):
+		""" Yields items from newest to oldest, starting at sequence number ``seq``.
+
+			:param seq: The sequence number to start at. Defaults to the newest item.
+			:type seq: int
+		"""
+		start = self.next_seq - 1 if seq == None else min(seq, self.next_seq - 1)
+
+		for s in range(start, self.first_seq - 1, -1):
+			yield self._items[s % self.size]
+
+	def __iter__(self):
+		return self.range()
+
+	def __reversed__(self):
+		return self.reverse_from()
+
+	def __getitem__(self, index):
+		""" List-style access, relative to the oldest item (negative indices count from the newest).
+		"""
+		length = len(self)
+		if index < 0:
+			index += length
+		if not 0 <= index < length:
+			raise IndexError("backlog index out of range")
+
+		return self._items[(self.first_seq + index) % self.size]
@@ -0,0 +1,262 @@
+"""
+.. module:: benchmark
+	:platform: Unix
+	:synopsis: Throughput benchmarks for eunomia's event handlers.
+
+Drives :class:`bot.EunomiaBot` with synthetic events through a :class:`stubirc.StubConnection`, so no network is involved.
+For every scenario it reports throughput, p50/p99 latency per event (and p99 of the votes alone), and allocations.
+
+Run it from the repository root::
+
+	python eunomia/benchmark.py
+	python eunomia/benchmark.py --scenario vote_storm --events 50000
+	python eunomia/benchmark.py --save before.json
+	python eunomia/benchmark.py --compare before.json
+	python eunomia/benchmark.py --tick-events 16
+
+All logs are written to a temporary directory, which is removed afterwards.
+The bot runs on a :class:`clock.FakeClock` that advances by a fixed step per event, so every run sees the same times.
+
+By default, the bot's pipeline (see :mod:`pipeline`) is drained after every event, as if every line came in on a
+socket read of its own. With ``--tick-events N``, the handler scenarios drain it once per N events instead, the way
+a busy connection delivers them. Their latencies are then those of a whole tick, and so is that of a vote: its tick
+has to be drained before the vote counts.
+
+"""
+
+import argparse
+import array
+import functools
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import eunomialog
+import legislation
+import metrics
+import stubirc
+import traffic
+from backlog import BacklogItem
+from clock import FakeClock
+
+# Scenario name -> (traffic pattern, backlog capacity or None for the bot's default, what is timed).
+# What is timed is one of:
+#   'handlers': the whole on_* handler, dispatched like the reactor does.
+#   'add_to_backlog': EunomiaBot.add_to_backlog with prebuilt items.
+#   'legislation': Legislation.dereference_if_vote alone, with items already in the backlog.
+scenarios = {
+	"chatter": ("chatter", None, "handlers"),
+	"vote_storm": ("vote_storm", None, "handlers"),
+	"nick_vote_chains": ("nick_vote_chains", None, "handlers"),
+	"join_part_flood": ("join_part_flood", None, "handlers"),
+	"paste_flood": ("paste_flood", None, "handlers"),
+	"large_backlog": ("mixed", 5000, "handlers"),
+	"add_to_backlog": ("chatter", None, "add_to_backlog"),
+	"dereference_if_vote": ("nick_vote_chains", 5000, "legislation"),
+}
+
+# How far the fake clock moves per event.
+seconds_per_event = 0.01
+
+def percentile(sorted_values, fraction):
+	""" Nearest-rank percentile of an already sorted sequence.
+	"""
+	if not sorted_values:
+		return 0
+	index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+	return sorted_values[index]
+
+def prepare(bot_inst, target, events, tick_events=1):
+	""" Builds the per-event step function and its inputs for a timing target.
+
+		:param tick_events: Events per reactor tick, for the handlers. See the module description.
+		:type tick_events: int
+		:returns: A tuple of ``(step, inputs)``. ``step`` is called once per input.
+	"""
+	if target == "handlers" and tick_events > 1:
+		clock = bot_inst.clock
+
+		def step(tick):
+			clock.fake_time += seconds_per_event * len(tick)
+			stubirc.dispatch_tick(bot_inst, tick)
+
+		return (step, [events[i:i + tick_events] for i in range(0, len(events), tick_events)])
+
+	if target == "handlers":
+		clock = bot_inst.clock
+
+		def step(event):
+			# Steady traffic, so the clock's cached strings are rebuilt as often as they would be live.
+			clock.fake_time += seconds_per_event
+			stubirc.dispatch(bot_inst, event)
+
+		return (step, events)
+
+	items = [bot_inst.message_to_backlog_item(event.type, event.source.nick, event.arguments[0]) for event in events]
+
+	state = bot_inst.get_channel_state("#bench")
+
+	if target == "add_to_backlog":
+		return (functools.partial(bot_inst.add_to_backlog, state), items)
+
+	if target == "legislation":
+		legislator = state.legislator
+		channel_backlog = state.backlog
+
+		def step(item):
+			channel_backlog.append(item)
+			legislator.dereference_if_vote(item, channel_backlog)
+
+		return (step, items)
+
+	raise ValueError("Unknown benchmark target \"{}\".".format(target))
+
+def is_vote(value):
+	""" Whether a step input (an event or a backlog item) is a vote, or a tick of events has one.
+	"""
+	if isinstance(value, list):
+		return any(is_vote(event) for event in value)
+	if isinstance(value, BacklogItem):
+		return value.vote != None
+	return value.type == "pubmsg" and legislation.parse_vote(value.arguments[0]) != None
+
+def run_scenario(name, count, users, writer_mode, with_metrics=False, with_flood_filter=False, tick_events=1):
+	""" Runs one scenario twice: once timed, once under tracemalloc to count allocations.
+
+		:returns: A dict with the results.
+	"""
+	(pattern, backlog_length, target) = scenarios[name]
+	events = stubirc.make_events(traffic.generate(pattern, count, users), "#bench")
+
+	results = {"scenario": name, "events": count, "target": target, "tick_events": tick_events}
+
+	# Timed pass.
+	bot_inst = build_bot(backlog_length, writer_mode, with_metrics, with_flood_filter)
+	try:
+		(step, inputs) = prepare(bot_inst, target, events, tick_events)
+		votes = [is_vote(value) for value in inputs]
+
+		latencies = array.array('q')
+		vote_latencies = array.array('q')
+		perf = time.perf_counter_ns
+		started = perf()
+		for (value, vote) in zip(inputs, votes):
+			t0 = perf()
+			step(value)
+			latency = perf() - t0
+			latencies.append(latency)
+			if vote:
+				vote_latencies.append(latency)
+		elapsed = perf() - started
+	finally:
+		stubirc.release_bot(bot_inst)
+
+	latencies = sorted(latencies)
+	results["events_per_sec"] = count / (elapsed / 1e9) if elapsed else 0
+	results["p50_us"] = percentile(latencies, 0.50) / 1000
+	results["p99_us"] = percentile(latencies, 0.99) / 1000
+	results["vote_p99_us"] = percentile(sorted(vote_latencies), 0.99) / 1000
+
+	# Allocation pass. tracemalloc slows everything down, so it is kept apart from the timing.
+	bot_inst = build_bot(backlog_length, writer_mode, with_metrics, with_flood_filter)
+	try:
+		(step, inputs) = prepare(bot_inst, target, events, tick_events)
+
+		blocks_before = sys.getallocatedblocks()
+		tracemalloc.start()
+		for value in inputs:
+			step(value)
+		(current, peak) = tracemalloc.get_traced_memory()
+		tracemalloc.stop()
+		blocks_after = sys.getallocatedblocks()
+	finally:
+		stubirc.release_bot(bot_inst)
+
+	results["traced_peak_kib"] = peak / 1024
+	results["retained_kib"] = current / 1024
+	results["retained_blocks_per_1k"] = (blocks_after - blocks_before) * 1000 / count
+
+	return results
+
+def build_bot(backlog_length, writer_mode, with_metrics, with_flood_filter):
+	log_writer = eunomialog.LogWriter() if writer_mode == "thread" else None
+	metrics_registry = metrics.Metrics() if with_metrics else None
+	bot_inst = stubirc.build_bot("#bench", backlog_length=backlog_length, log_writer=log_writer, metrics=metrics_registry, clock=FakeClock())
+	if with_flood_filter:
+		bot_inst.enable_flood_filter()
+	return bot_inst
+
+def print_results(all_results, baseline=None):
+	header = "{:<22} {:>9} {:>12} {:>10} {:>10} {:>12} {:>11} {:>13}".format(
+		"scenario", "events", "events/s", "p50 us", "p99 us", "vote p99 us", "peak KiB", "blocks/1k ev")
+	print(header)
+	print("-" * len(header))
+
+	for results in all_results:
+		line = "{scenario:<22} {events:>9} {events_per_sec:>12.0f} {p50_us:>10.2f} {p99_us:>10.2f} {vote_p99_us:>12.2f} {traced_peak_kib:>11.1f} {retained_blocks_per_1k:>13.1f}".format(**results)
+		if baseline != None and results["scenario"] in baseline:
+			before = baseline[results["scenario"]]["events_per_sec"]
+			line += "  ({:+.1%} vs baseline)".format(results["events_per_sec"] / before - 1)
+		print(line)
+
+def find_regressions(all_results, baseline, tolerance):
+	""" Lists the scenarios whose throughput dropped by more than ``tolerance`` (a fraction) compared to ``baseline``.
+	"""
+	regressions = []
+	for results in all_results:
+		before = baseline.get(results["scenario"])
+		if before != None and results["events_per_sec"] < before["events_per_sec"] * (1 - tolerance):
+			regressions.append(results["scenario"])
+	return regressions
+
+def main(args=None):
+	parser = argparse.ArgumentParser(description="Benchmark eunomia's event handlers with synthetic traffic.")
+	parser.add_argument("--scenario", action="append", choices=sorted(scenarios), help="Scenario to run. May be repeated. Defaults to all.")
+	parser.add_argument("--events", type=int, default=20000, help="Events per scenario.")
+	parser.add_argument("--users", type=int, default=50, help="Number of simulated users.")
+	parser.add_argument("--writer", choices=("sync", "thread"), default="sync", help="How channel logs are written.")
+	parser.add_argument("--metrics", action="store_true", help="Run with metrics enabled, to measure their overhead.")
+	parser.add_argument("--flood-filter", action="store_true", help="Run with the flood filter enabled.")
+	parser.add_argument("--tick-events", type=int, default=1, help="Events per reactor tick, i.e. per pipeline drain.")
+	parser.add_argument("--save", metavar="FILE", help="Save the results as JSON, to --compare against later.")
+	parser.add_argument("--compare", metavar="FILE", help="Compare throughput against results saved with --save.")
+	parser.add_argument("--tolerance", type=float, default=0.15, help="Throughput drop (fraction) reported as a regression.")
+	options = parser.parse_args(args)
+
+	baseline = None
+	if options.compare != None:
+		with open(options.compare) as baseline_file:
+			baseline = {results["scenario"]: results for results in json.load(baseline_file)}
+
+	# Every scenario builds a fresh bot, with channel logs, a journal and eunomia.log of its own. Write them to a scratch directory.
+	work_dir = tempfile.mkdtemp(prefix="eunomia-bench-")
+	old_cwd = os.getcwd()
+	eunomialog.log_root = work_dir + "/logs"
+	os.chdir(work_dir)
+
+	try:
+		all_results = [run_scenario(name, options.events, options.users, options.writer, options.metrics, options.flood_filter, options.tick_events) for name in (options.scenario or list(scenarios))]
+	finally:
+		os.chdir(old_cwd)
+		shutil.rmtree(work_dir, ignore_errors=True)
+
+	print_results(all_results, baseline)
+
+	if options.save != None:
+		with open(options.save, "w") as save_file:
+			json.dump(all_results, save_file, indent=2)
+
+	if baseline != None:
+		regressions = find_regressions(all_results, baseline, options.tolerance)
+		if regressions:
+			print("Throughput regressions: {}".format(", ".join(regressions)))
+			return 1
+
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -1,3 +1,4 @@
+import functools
 import importlib
 import signal
 import sys
@@ -6,42 +7,118 @@ import irc.bot
 import irc.strings
 import logging
 import legislation
-import datetime
 import eunomialog
+import floodfilter
+import logsetup
+import pipeline
+import sendqueue
+import backlog
 from backlog import BacklogItem
+from channelstate import ChannelState
+from clock import Clock
+from timetools import TimeTools
+
+# How every kind of line appears in the logs, for the normalize stage. {0} is the nick that caused the line,
+# the rest are the arguments its handler queued (see EunomiaBot.queue_line()).
+# Messages, actions and flood summaries are logged as their one argument.
+line_formats = {
+	backlog.JOIN: "*** Joins: {0}",
+	backlog.PART: "*** Parts: {0} ({1})",
+	backlog.QUIT: "*** Quits: {0} ({1})",
+	backlog.KICK: "*** Kick: {1} by {0} ({2})",
+	backlog.MODE: "*** Mode: {1} {2} by {0}",
+	backlog.TOPIC: "*** Topic: \"{1}\" by {0}",
+	backlog.PUBNOTICE: "*** Notice: {2} \"{1}\" by {0}",
+}
 
 class EunomiaBot(irc.bot.SingleServerIRCBot):
-	def __init__(self, channel, nickname, server, pretty_version, ident_packed=None, port=6667):
-		self.logger = logging.getLogger("EunomiaBot")
-		self.logger.setLevel(logging.INFO)
-
-		lformat = logging.Formatter("[%(asctime)s] [%(name)s.%(funcName)s] [%(levelname)-5.5s]: %(message)s", "%Y-%m-%d %H:%M:%S")
-
-		fh = logging.FileHandler("eunomia.log")
-		fh.setFormatter(lformat)
-		sh = logging.StreamHandler()
-		sh.setFormatter(lformat)
-
-		self.logger.addHandler(fh)
-		self.logger.addHandler(sh)
-
-		self.file_log_handler = fh
-		self.stream_log_handler = sh
+	""" The bot itself. One connection, serving any number of channels.
+
+		Events are routed to the :class:`channelstate.ChannelState` of the channel they happened in (``event.target``),
+		so every channel has its own backlog, legislator and channel log.
+
+		The ``on_*`` handlers only queue the lines of their events. They are handled in batches, once per reactor tick,
+		by the stages of ``self.pipeline`` (see :mod:`pipeline` and :meth:`add_stages`).
+
+		:param channels: The channel to join, or a list of channels.
+		:param network: The name of the network, for a process that serves several (see :mod:`networks`).
+			Its logs go in a tree of their own. ``None`` for the default network.
+		:param reactor: A reactor to share with the bots of other networks, e.g. a :class:`networks.SharedReactor`.
+			Defaults to one of its own.
+		:param clock: The clock every event is timed with (see :mod:`clock`). Defaults to the system time;
+			pass a :class:`clock.FakeClock` for deterministic runs.
+		:type channels: str/list
+		:type network: str
+		:type reactor: irc.client.Reactor
+		:type clock: clock.Clock
+	"""
+	def __init__(self, channels, nickname, server, pretty_version, ident_packed=None, port=6667, log_writer=None, metrics=None, network=None, reactor=None, clock=None):
+		# Shared by every bot (and legislator) in the process. Records are written by its listener thread.
+		self.log_pipeline = logsetup.get_pipeline()
+		self.logger = self.log_pipeline.get_logger("EunomiaBot")
+
+		self.file_log_handler = self.log_pipeline.file_handler
+		self.stream_log_handler = self.log_pipeline.stream_handler
+
+		self.network = network
+
+		# Sampled once per event (see sample_clock()), and read by everything that handles it.
+		self.clock = Clock() if clock == None else clock
+		# The root of this network's logs. See eunomialog.network_log_root().
+		self.log_root = eunomialog.network_log_root(network)
+
+		if reactor != None:
+			# Read by irc.client.SimpleIRCClient.__init__, which takes no arguments.
+			self.reactor_class = lambda: reactor
 
 		self.logger.info("Logging initialized.")
 		irc.bot.SingleServerIRCBot.__init__(self, [(server, port)], nickname, nickname)
-		self.channel = channel
+
+		if isinstance(channels, str):
+			channels = [channels]
 
 		self.reloading = False
 
 		self.logger.info("Init complete.")
 
-		self.legislator = legislation.Legislation(fh, sh, channel)
+		# If set, channel and proposal logs are written by this eunomialog.LogWriter's thread.
+		self.log_writer = log_writer
+
+		# If set, finished days of the channel logs are compressed by this archive.Archiver. See enable_archiving().
+		self.archiver = None
 
 		self.max_backlog_length = 50
-		self.backlog = []
 
-		self.channel_logger = eunomialog.ChannelLogger(channel)
+		# Maximum number of lines a search command replies with.
+		self.max_search_results = 3
+
+		# Seconds between checks for passed proposals whose record is due. See flush_proposals().
+		self.proposal_flush_interval = 15
+
+		# Maximum number of lines the pipeline handles in one batch. Backlogs keep this many evicted lines around.
+		self.pipeline_batch_size = 32
+
+		# irc.strings.lower(channel name) -> ChannelState.
+		self.channel_states = {}
+		for channel in channels:
+			self.channel_states[irc.strings.lower(channel)] = ChannelState(channel, self.max_backlog_length, log_writer, self.log_root, self.clock, self.pipeline_batch_size)
+
+		# Event target, spelled exactly as the server sent it -> ChannelState. See get_channel_state().
+		self.channel_targets = {}
+
+		# The channels a quitting user was in. See record_quit_channels().
+		self.quit_channels = []
+		self.connection.add_global_handler("quit", self.record_quit_channels, -30)
+
+		self.connection.add_global_handler("all_events", self.sample_clock, -35)
+
+		# Everything the bot sends on its own account goes through this, paced so it never floods the server.
+		# Configured with the [send] section (see __main__).
+		self.send_queue = sendqueue.SendQueue(self.connection, self.reactor.scheduler)
+
+		# Passed proposals are journaled once the context after their vote is in (see Legislation.legislate()).
+		# Their records are also written by a timer, so a quiet channel doesn't hold them back.
+		self.reactor.scheduler.execute_every(self.proposal_flush_interval, self.flush_proposals)
 
 		if ident_packed != None:
 			(self.ident_username, self.ident_pass, self.ident_method) = ident_packed
@@ -50,57 +127,54 @@ class EunomiaBot(irc.bot.SingleServerIRCBot):
 
 		self.pretty_version = pretty_version
 
+		# Drained once per reactor tick. With metrics enabled, its stage timings are part of them.
+		self.pipeline = pipeline.Pipeline(self.reactor.scheduler, self.pipeline_batch_size, None if metrics == None else metrics.histograms)
+		self.add_stages()
+
+		# A metrics.Metrics registry, or None if metrics are disabled.
+		self.metrics = metrics
+		if metrics != None:
+			self.instrument()
+
 		signal.signal(signal.SIGTERM, self.shutdown_handler)
 		signal.signal(signal.SIGINT, self.shutdown_handler)
 
 	def on_nicknameinuse(self, c, event):
 		c.nick(c.get_nickname() + "_")
-		self.logger.info("Nickname {} was in use. Trying {}.".format(c.get_nickname(), c.get_nickname() + "_"))
+		self.logger.info("Nickname %s was in use. Trying %s.", c.get_nickname(), c.get_nickname() + "_")
 
 	def on_welcome(self, c, event):
-		self.channel_logger.append_log_begin_message()
-		
-		c.join(self.channel)
+		for state in self.channel_states.values():
+			state.channel_logger.append_log_begin_message()
+			self.send_queue.join(state.name)
+
 		self.logger.info("Connection complete.")
 
 		if self.ident_method != None:
 			if self.ident_method == "nickserv":
 				self.logger.info("Identifying to NickServ.")
-				c.privmsg("NickServ", "identify {} {}".format(self.ident_username, self.ident_pass))
+				self.send_queue.privmsg("NickServ", "identify {} {}".format(self.ident_username, self.ident_pass), sendqueue.AUTH)
 			else:
-				self.logger.error("Identification method \"{}\" not supported.".format(self.ident_method))
+				self.logger.error("Identification method \"%s\" not supported.", self.ident_method)
 			self.logger.info("Identification finished.")
 		else:
 			self.logger.info("Not identifying.")
 
+	def on_disconnect(self, c, event):
+		# Nothing that is still waiting makes sense on the next connection.
+		self.send_queue.clear()
+
 	def on_privmsg(self, c, event):
-		self.do_command(event, event.arguments[0])
-		self.logger.info("Got a PRIVMSG: \"{}\"").format(event.arguments[0])
+		# Commands are only taken in channels. Private messages are just logged.
+		self.logger.info("Got a PRIVMSG: \"%s\"", event.arguments[0])
 
 	def on_pubmsg(self, c, event):
-		message = event.arguments[0]
-		sender = event.source.split("!")[0]
-		message = "<{}> {}".format(sender, message)
-
-		timestamp = datetime.datetime.utcnow().time()
-
-		mbi = self.message_to_backlog_item(message, timestamp)
+		state = self.get_channel_state(event.target)
+		if state == None:
+			return
 
-		self.add_to_backlog(mbi, timestamp)
+		self.queue_line(state, backlog.PUBMSG, event.source.split("!")[0], event.arguments[0])
 
-		self.backlog = self.legislator.dereference_if_vote(mbi, self.backlog)
-
-		a = event.arguments[0].split(":", 1)
-		if len(a) > 1 and irc.strings.lower(a[0]) == irc.strings.lower(self.connection.get_nickname()):
-			command = a[1].strip()
-			self.logger.info("Command \"{}\" sent by \"{}\"".format(command, sender))
-			if command == "reload-legislation":
-				self.logger.info("Reloading legislation.")
-				importlib.reload(legislation)
-				self.legislator = legislation.Legislation(self.file_log_handler, self.stream_log_handler, self.channel)
-			else:
-				self.logger.warning("Command \"{}\" unknown.".format(command))
-			
 	def on_dccmsg(self, c, event):
 		self.logger.error("on_dccmsg called but not implemented!")
 
@@ -108,28 +182,33 @@ class EunomiaBot(irc.bot.SingleServerIRCBot):
 		self.logger.error("on_dccchat called but not implemented!")
 
 	def on_action(self, c, event):
-		message = event.arguments[0]
-		message = "* {} {}".format(event.source.split("!")[0], message)
+		state = self.get_channel_state(event.target)
+		if state == None:
+			# Private actions (sent to us directly) aren't logged.
+			return
 
-		self.add_to_backlog(message)
+		self.queue_line(state, backlog.ACTION, event.source.split("!")[0], event.arguments[0])
 
 	def on_join(self, c, event):
-		nick = event.source.split("!")[0]
-		message = "*** Joins: {}".format(nick)
+		state = self.get_channel_state(event.target)
+		if state == None:
+			return
 
-		self.add_to_backlog(message)
+		self.queue_line(state, backlog.JOIN, event.source.split("!")[0])
 
 	def on_part(self, c, event):
-		nick = event.source.split("!")[0]
+		state = self.get_channel_state(event.target)
+		if state == None:
+			return
+
 		try:
 			part_message = event.arguments[0]
 		except IndexError:
 			# A debug message is probably not needed here.
 			# Parts without a message are not uncommon.
 			part_message = ""
-		message = "*** Parts: {} ({})".format(nick, part_message)
 
-		self.add_to_backlog(message)
+		self.queue_line(state, backlog.PART, event.source.split("!")[0], part_message)
 
 	def on_quit(self, c, event):
 		nick = event.source.split("!")[0]
@@ -137,19 +216,53 @@ class EunomiaBot(irc.bot.SingleServerIRCBot):
 			quit_message = event.arguments[0]
 		except IndexError:
 			quit_message = ""
-		message = "*** Quits: {} ({})".format(nick, quit_message)
-		
-		self.add_to_backlog(message)
+
+		# Quits aren't sent to a channel, so log them in every channel the user was in.
+		# The server only sends quits of users that share a channel with us. If we don't know which one
+		# (e.g. the names list hadn't arrived yet), log it everywhere rather than losing it.
+		quit_channels = self.quit_channels or list(self.channel_states.values())
+		for state in quit_channels:
+			self.queue_line(state, backlog.QUIT, nick, quit_message)
+		self.quit_channels = []
+
+	def flush_proposals(self):
+		""" Writes the records of passed proposals whose context window has closed, in every channel.
+		"""
+		self.clock.sample()
+		for state in self.channel_states.values():
+			if state.legislator.pending:
+				state.legislator.flush_due(self.clock.now)
+
+	def sample_clock(self, c, event):
+		""" Reads the time once per event, before any other handler runs. See :mod:`clock`.
+		"""
+		self.clock.sample()
+
+	def record_quit_channels(self, c, event):
+		""" Records the channels a quitting user was in, for :meth:`on_quit`.
+
+			This runs before irc.bot's own quit handler, which removes the user from its channel lists.
+		"""
+		nick = event.source.split("!")[0]
+		self.quit_channels = [state for state in self.channel_states.values() if state.name in self.channels and self.channels[state.name].has_user(nick)]
 
 	def on_kick(self, c, event):
+		state = self.get_channel_state(event.target)
+		if state == None:
+			return
+
 		kicker_nick = event.source.split("!")[0]
 		kickee_nick = event.arguments[0]
 		kick_message = event.arguments[1]
-		message = "*** Kick: {} by {} ({})".format(kickee_nick, kicker_nick, kick_message)
 
-		self.add_to_backlog(message)
+		self.queue_line(state, backlog.KICK, kicker_nick, kickee_nick, kick_message)
 
 	def on_mode(self, c, event):
+		state = self.get_channel_state(event.target)
+		if state == None:
+			# Mode changes on ourselves, rather than on a channel.
+			return
+
 		changer_nick = event.source.split("!")[0]
 		mode_change = event.arguments[0]
 		try:
@@ -160,70 +273,461 @@ class EunomiaBot(irc.bot.SingleServerIRCBot):
 			# The target is the channel, so set changee_nick to the current channel (event.target)
 			changee_nick = event.target
 
-		message = "*** Mode: {} {} by {}".format(mode_change, changee_nick, changer_nick)
-
-		self.add_to_backlog(message)
+		self.queue_line(state, backlog.MODE, changer_nick, mode_change, changee_nick)
 
 	def on_topic(self, c, event):
+		state = self.get_channel_state(event.target)
+		if state == None:
+			return
+
 		changer_nick = event.source.split("!")[0]
 		new_topic = event.arguments[0]
-		message = "*** Topic: \"{}\" by {}".format(new_topic, changer_nick)
 
-		self.add_to_backlog(message)
+		self.queue_line(state, backlog.TOPIC, changer_nick, new_topic)
 
 	def on_pubnotice(self, c, event):
+		state = self.get_channel_state(event.target)
+		if state == None:
+			return
+
 		sender_nick = event.source.split("!")[0]
 		notice_message = event.arguments[0]
-		message = "*** Notice: {} \"{}\" by {}".format(event.target, notice_message, sender_nick)
 
-		self.add_to_backlog(message)
+		self.queue_line(state, backlog.PUBNOTICE, sender_nick, notice_message, event.target)
+
+	def run_command(self, line):
+		""" Runs the command a channel line asks of the bot.
+
+			:param line: The line, with its command set by the normalize stage.
+			:type line: pipeline.Line
+		"""
+		state = line.state
+		sender = line.nick
+		(command, command_args) = line.command
+
+		self.logger.info("Command \"%s\" sent by \"%s\"", command, sender)
+		if command == "reload-legislation":
+			self.logger.info("Reloading legislation.")
+			importlib.reload(legislation)
+			# The module is shared, so every channel gets a fresh legislator.
+			for other_state in self.channel_states.values():
+				other_state.new_legislator()
+				if self.metrics != None:
+					self.instrument_legislator(other_state)
+		elif command == "stats":
+			if self.metrics == None:
+				self.reply(state.name, sender, "Metrics are disabled.")
+			else:
+				# The gauges (several per channel) don't fit in a reply. They are in the dump file.
+				summary = self.metrics.summary(["pipeline." + name for name in self.pipeline.stage_names()], with_gauges=False)
+				self.reply(state.name, sender, sendqueue.truncate(summary, self.reply_budget(state.name, sender)))
+		elif command == "search":
+			self.search_command(state, sender, command_args, line.offset)
+		else:
+			self.logger.warning("Command \"%s\" unknown.", command)
+
+	def search_command(self, state, sender, query, command_offset=None):
+		""" Replies with the most recent lines of a channel's logs that match a query. See :mod:`search`.
+
+			:param command_offset: The offset of the command's own line in the channel log, which would always be the
+				first match. Defaults to the last line logged.
+			:type command_offset: int
+		"""
+		search_index = state.channel_logger.search_index
+		if search_index == None:
+			self.reply(state.name, sender, "Search is disabled.")
+			return
+
+		if not query.strip():
+			self.reply(state.name, sender, "Usage: search [nick:<nick>] <words>")
+			return
+
+		if command_offset == None:
+			command_offset = state.channel_logger.last_offset
+		results = [result for result in search_index.search(query, self.max_search_results + 1) if result.offset != command_offset]
+		self.reply_results(state, sender, results[:self.max_search_results])
+
+	def reply_results(self, state, sender, results):
+		""" Replies with search results, one line each. Lines too long for an IRC line are cut short.
+
+			:param results: The results, newest first.
+			:type results: list
+		"""
+		if not results:
+			self.reply(state.name, sender, "No matches.")
+			return
+
+		budget = self.reply_budget(state.name, sender)
+		for (i, result) in enumerate(results):
+			# Only the first line is the answer. The others wait behind other commands' answers.
+			self.reply(state.name, sender, sendqueue.truncate("[{}] {}".format(result.date, result.line), budget), sendqueue.REPLY if i == 0 else sendqueue.BULK)
+
+	def get_channel_state(self, target):
+		""" Gets the :class:`channelstate.ChannelState` an event target refers to.
+
+			Folding the name for a case-insensitive lookup is slow compared to the rest of a handler,
+			so the result is remembered for every exact spelling of the target.
+
+			:param target: The event target.
+			:type target: str
+			:returns: The channel's state, or ``None`` if the target isn't one of our channels.
+		"""
+		state = self.channel_targets.get(target)
+		if state == None and target != None:
+			state = self.channel_states.get(irc.strings.lower(target))
+			if state != None:
+				self.channel_targets[target] = state
+		return state
+
+	def instrument(self):
+		""" Attaches ``self.metrics`` to the hot path: every ``on_*`` handler, the legislator and the channel log.
+			The pipeline's stages are timed either way.
+
+			Only called when metrics are enabled. Otherwise, nothing is wrapped and the handlers run uninstrumented.
+		"""
+		for name in dir(type(self)):
+			if name.startswith("on_"):
+				self.metrics.instrument(self, name, "handler." + name)
+
+		for state in self.channel_states.values():
+			self.metrics.instrument(state.channel_logger, "append", "log.channel.append")
+			self.instrument_legislator(state)
+			self.metrics.gauge("backlog.size.{}".format(self.qualified_name(state.name)), functools.partial(len, state.backlog))
+		if self.log_writer != None:
+			self.metrics.gauge("log_writer.queue", self.log_writer.pending)
+		for total in ("batches", "lines"):
+			self.metrics.gauge(self.qualified_name("pipeline.{}".format(total)), functools.partial(getattr, self.pipeline, total))
+
+		# Looked up through self on every read, since __main__ may replace the send queue after this.
+		for (priority, priority_name) in enumerate(sendqueue.priority_names):
+			self.metrics.gauge(self.qualified_name("send_queue.depth.{}".format(priority_name)), functools.partial(self.send_queue_depth, priority))
+		for total in ("sent", "merged", "dropped", "invalid"):
+			self.metrics.gauge(self.qualified_name("send_queue.{}".format(total)), functools.partial(self.send_queue_total, total))
+
+		# Counts every event type, including the ones without a handler.
+		self.reactor.add_global_handler("all_events", self.count_event, -15)
+
+	def send_queue_depth(self, priority):
+		return self.send_queue.depth(priority)
+
+	def send_queue_total(self, name):
+		return getattr(self.send_queue, name)
+
+	def instrument_legislator(self, state):
+		""" Attaches ``self.metrics`` to a channel's current legislator. Needs redoing whenever the legislator is replaced.
+		"""
+		self.metrics.instrument(state.legislator, "dereference_if_vote", "legislation.dereference_if_vote")
+		self.metrics.instrument(state.legislator.proposal_journal, "append", "log.proposal.append")
+
+	def qualified_name(self, name):
+		""" Prefixes a name (e.g. of a channel) with the network's name, if it has one, e.g. for metric names.
+		"""
+		if self.network == None:
+			return name
+		return "{}/{}".format(self.network, name)
+
+	def count_event(self, c, event):
+		self.metrics.count("events." + event.type)
 
 	def get_version(self):
 		return self.pretty_version
 
-	def message_to_backlog_item(self, message, timestamp):
-		return BacklogItem(message, timestamp)
+	def message_to_backlog_item(self, kind, nick, text, timestamp=None, when=None):
+		""" Builds a :class:`backlog.BacklogItem`, parsing everything about the line exactly once.
+
+			:param kind: The kind of line, e.g. ``backlog.PUBMSG``.
+			:param nick: The nick that caused the line.
+			:param text: The message text, or the full preformatted line for non-message kinds.
+			:param timestamp: The time the line was received. Defaults to the time of the current event (UTC).
+			:param when: The same, in seconds since the epoch. Defaults to the time of the current event,
+				if ``timestamp`` isn't given either.
+			:type kind: str
+			:type nick: str
+			:type text: str
+			:type timestamp: datetime.time
+			:type when: float
+		"""
+		if timestamp == None:
+			timestamp = self.clock.timestamp
+			if when == None:
+				when = self.clock.now
 
-	def reply(self, sender_nick, reply):
-		c = self.connection
-		c.privmsg(self.channel, "{}: {}".format(sender_nick, reply))
+		vote = legislation.parse_vote(text) if kind == backlog.PUBMSG else None
 
-	def add_to_backlog(self, message, timestamp=None):
-		if timestamp == None:
-			timestamp = datetime.datetime.utcnow().time()
+		return BacklogItem(kind, nick, text, timestamp, vote, when)
+
+	def reply(self, channel, sender_nick, reply, priority=sendqueue.REPLY):
+		""" Sends a line to a channel, addressed to a nick, through the send queue.
+
+			:param priority: The line's priority in the send queue. See :mod:`sendqueue`.
+			:type priority: int
+		"""
+		self.send_queue.privmsg(channel, "{}: {}".format(sender_nick, reply), priority)
+
+	def reply_budget(self, channel, sender_nick):
+		""" Gets the number of bytes a reply (see :meth:`reply`) may have, so its line fits :data:`sendqueue.max_line_bytes`.
+		"""
+		return sendqueue.max_line_bytes - len("PRIVMSG {} :{}: \r\n".format(channel, sender_nick).encode("utf-8"))
+
+	def queue_line(self, state, kind, nick, *arguments):
+		""" Queues a channel line for the pipeline, timed with the current event.
+
+			:param state: The channel the line belongs to.
+			:param kind: The kind of line, e.g. ``backlog.PUBMSG``.
+			:param nick: The nick that caused the line.
+			:param arguments: The message text, or what the line is formatted with (see :data:`line_formats`).
+			:type state: channelstate.ChannelState
+			:type kind: str
+			:type nick: str
+		"""
+		self.pipeline.put(pipeline.Line(state, kind, nick, arguments, self.clock.timestamp, self.clock.now))
+
+	def add_stages(self):
+		""" Adds the bot's stages to ``self.pipeline``, in order. See :mod:`pipeline`.
+		"""
+		self.pipeline.add_stage("normalize", self.normalize_lines)
+		self.pipeline.add_stage("backlog", self.backlog_lines)
+		self.pipeline.add_stage("persist", self.persist_lines)
+		self.pipeline.add_stage("legislate", self.legislate_lines)
+		self.pipeline.add_stage("respond", self.respond_to_lines)
+
+	def normalize_lines(self, batch):
+		""" The normalize stage: formats and parses every line (for votes and commands), and builds its backlog item.
+		"""
+		# Only folded once a line looks like a command.
+		nickname = None
+
+		for line in batch:
+			line_format = line_formats.get(line.kind)
+			text = line.arguments[0] if line_format == None else line_format.format(line.nick, *line.arguments)
+			line.item = self.message_to_backlog_item(line.kind, line.nick, text, line.timestamp, line.when)
+
+			if line.kind == backlog.PUBMSG:
+				a = text.split(":", 1)
+				if len(a) > 1:
+					if nickname == None:
+						nickname = irc.strings.lower(self.connection.get_nickname())
+					if irc.strings.lower(a[0]) == nickname:
+						(command, _, command_args) = a[1].strip().partition(" ")
+						line.command = (command, command_args)
+
+		return batch
+
+	def backlog_lines(self, batch):
+		""" The backlog stage: appends every line to its channel's backlog.
+
+			If the channel has a flood filter (see :meth:`enable_flood_filter`), it decides first how much of that the line gets.
+		"""
+		admitted = []
+		for line in batch:
+			flood_filter = line.state.flood_filter
+			if flood_filter != None:
+				if flood_filter.flood_start != None:
+					# Summarize the flood before it goes on, once it is due.
+					summary = flood_filter.take_summary(line.when)
+					if summary != None:
+						admitted.append(self.flood_summary_line(line.state, summary, line.timestamp, line.when))
+
+				verdict = flood_filter.admit(line.item)
+				if verdict == floodfilter.COALESCE:
+					# Only counted, for the summary line.
+					continue
+				if verdict == floodfilter.SHED:
+					# Still logged, and still ends a run of votes, but never legislated.
+					line.item.can_legislate = False
+
+			admitted.append(line)
+
+		debug = self.logger.isEnabledFor(logging.DEBUG)
+		for line in admitted:
+			# Note that we do not need to truncate the timestamp - BacklogItem's constructor does so automatically.
+			# The backlog is a ring buffer, so this is O(1) even when it is full.
+			# Items are referenced by sequence number, so nothing has to be shifted when the oldest one is evicted.
+			evicted = line.state.backlog.append(line.item)
+			if debug:
+				if evicted != None:
+					self.logger.debug("Backlog full. Evicted oldest line.")
+				self.logger.debug("Appended new backlog message \"%s\"", line.item.message)
+
+		return admitted
+
+	def persist_lines(self, batch):
+		""" The persist stage: writes the lines of every channel to its channel log, in one write per channel.
+		"""
+		channel_lines = {}
+		for line in batch:
+			lines = channel_lines.get(line.state)
+			if lines == None:
+				lines = channel_lines[line.state] = []
+			lines.append(line)
+
+		for (state, lines) in channel_lines.items():
+			offsets = state.channel_logger.append_items([line.item for line in lines])
+			if offsets != None:
+				for (line, offset) in zip(lines, offsets):
+					line.offset = offset
 
-		if isinstance(message, str):
-			message = self.message_to_backlog_item(message, timestamp)
+		return batch
 
-		if len(self.backlog) > self.max_backlog_length:
-			self.backlog.pop(0) # Remove the first item from the backlog.
-			self.logger.debug("Backlog too long. Popped first line.")
+	def legislate_lines(self, batch):
+		""" The legislate stage: feeds every line to its channel's legislator, in order.
 
-			# This also means that the active proposal has to be shifted by - 1
-			if self.legislator.active_proposal != None:
-				self.legislator.active_proposal -= 1
-				if self.legislator.active_proposal <= -1:
-					self.legislator.active_proposal = None
-					self.logger.debug("Active proposal <= -1. Active proposal is now out of backlog range. Setting to None.")
+			The vote tally is incremental, so it has to see every line, not just votes.
+		"""
+		for line in batch:
+			line.state.legislator.dereference_if_vote(line.item, line.state.backlog)
+
+		return batch
+
+	def respond_to_lines(self, batch):
+		""" The respond stage: runs the commands among the lines. They are logged (and indexed) by now.
+		"""
+		for line in batch:
+			if line.command != None:
+				self.run_command(line)
+
+		return batch
+
+	def add_to_backlog(self, state, message):
+		""" Runs a prebuilt line through the pipeline right away, from the backlog stage on.
+			Lines that are still queued are drained first.
+
+			:param state: The channel the line belongs to.
+			:param message: The line to append.
+			:type state: channelstate.ChannelState
+			:type message: backlog.BacklogItem
+		"""
+		self.pipeline.drain()
+
+		line = pipeline.Line(state, message.kind, message.nick, None, message.timestamp, message.when)
+		line.item = message
+		self.pipeline.run([line], "backlog")
+
+	def restore_backlogs(self):
+		""" Rebuilds every channel's backlog (and vote tally) from the tail of today's channel log.
+
+			Meant to be called once, before connecting, so votes on proposals made before a restart still count.
+			Only the last ``max_backlog_length`` lines are read, seeking backwards from the end of the file,
+			so this is fast whatever the size of the log. Proposals that pass while replaying are not legislated again.
+		"""
+		for state in self.channel_states.values():
+			state.channel_logger.update_log_filename()
+			lines = eunomialog.read_tail_lines(state.channel_logger.log_filename, self.max_backlog_length)
+
+			state.legislator.replaying = True
+			restored = 0
+			try:
+				for line in lines:
+					parsed = backlog.parse_log_line(line)
+					if parsed == None:
+						continue
+
+					(kind, nick, text, timestamp) = parsed
+					item = self.message_to_backlog_item(kind, nick, text, timestamp, self.clock.day_start + TimeTools.seconds_of_day(timestamp))
+					# Not through the pipeline: these lines are in the channel log already.
+					state.backlog.append(item)
+					state.legislator.dereference_if_vote(item, state.backlog)
+					restored += 1
+			finally:
+				state.legislator.replaying = False
+
+			self.logger.info("Restored %d backlog line(s) for %s.", restored, self.qualified_name(state.name))
+
+	def enable_search(self):
+		""" Gives every channel a :class:`search.SearchIndex`, and indexes every line logged from now on.
+
+			Anything already logged that isn't indexed yet (e.g. because search was disabled when it was logged) is indexed first.
+			Meant to be called once, before connecting: lines logged before that might still be queued in ``log_writer``,
+			and the index would not know their place in the log.
+		"""
+		for state in self.channel_states.values():
+			(search_index, indexed) = self.open_search_index(state.channel_logger.log_dir)
+			if indexed:
+				self.logger.info("Indexed %d logged line(s) of %s.", indexed, self.qualified_name(state.name))
+			state.channel_logger.set_search_index(search_index)
+
+	def open_search_index(self, log_dir):
+		""" Opens a channel's search index, and indexes what is logged but not indexed yet.
 
-		# Note that we do not need to truncate the timestamp - BacklogItem's constructor does so automatically.
-		self.backlog.append(message)
-		self.logger.debug("Appended new backlog message \"{}\"".format(message.message))
+			:returns: ``(index, number of lines indexed)``.
+		"""
+		import search
+
+		search_index = search.SearchIndex(log_dir)
+		return (search_index, search_index.catch_up())
+
+	def enable_flood_filter(self, window=10.0, repeat_limit=3, nick_limit=8, presence_limit=10, overload_limit=40):
+		""" Puts a :class:`floodfilter.FloodFilter` in front of every channel's backlog and legislator.
+			The parameters are those of :class:`floodfilter.FloodFilter`.
+		"""
+		for state in self.channel_states.values():
+			state.flood_filter = floodfilter.FloodFilter(window, repeat_limit, nick_limit, presence_limit, overload_limit)
+			if self.metrics != None:
+				for total in ("shed", "coalesced"):
+					self.metrics.gauge("flood.{}.{}".format(total, self.qualified_name(state.name)), functools.partial(getattr, state.flood_filter, total))
+
+		# Summaries are written by the backlog stage when the next line comes in, or by this timer if the channel went quiet.
+		self.reactor.scheduler.execute_every(window, self.flush_flood_summaries)
+
+	def flush_flood_summaries(self):
+		""" Writes the summary lines of join/part/quit floods that are due, in every channel.
+		"""
+		self.clock.sample()
+		for state in self.channel_states.values():
+			if state.flood_filter != None and state.flood_filter.flood_start != None:
+				summary = state.flood_filter.take_summary(self.clock.now)
+				if summary != None:
+					self.queue_line(state, backlog.FLOOD, None, summary)
+
+	def flood_summary_line(self, state, summary, timestamp, when):
+		""" Builds the (normalized) pipeline line of a flood summary.
+		"""
+		line = pipeline.Line(state, backlog.FLOOD, None, (summary,), timestamp, when)
+		line.item = self.message_to_backlog_item(backlog.FLOOD, None, summary, timestamp, when)
+		return line
+
+	def enable_archiving(self, archiver):
+		""" Has finished days of every channel's log compressed in the background. See :mod:`archive`.
 
-		# Add to the channel logs, too.
-		self.channel_logger.append("{} {}".format(message.timestamp, message.message))
+			Days that finished while eunomia wasn't running are archived too.
+
+			:param archiver: The archiver.
+			:type archiver: archive.Archiver
+		"""
+		self.archiver = archiver
+		for state in self.channel_states.values():
+			state.channel_logger.archiver = archiver
+			archiver.submit(state.channel_logger.log_dir, self.clock.date_string)
 
 	def shutdown_handler(self, signum, frame):
 		""" Called when a SIGTERM, or SIGINT event is handled.
 			Just calls "shutdown" in turn, which performs all cleanup.
 		"""
-		self.logger.info("SIGTERM or SIGINT caught. (signum {})".format(signum))
+		self.logger.info("SIGTERM or SIGINT caught. (signum %d)", signum)
 		self.shutdown()
 
+	def close_channels(self):
+		""" Drains the pipeline, journals the proposals that are still waiting for context, appends "log end" messages,
+			and closes the search indexes.
+		"""
+		self.pipeline.drain()
+		for state in self.channel_states.values():
+			state.legislator.flush()
+			state.channel_logger.append_log_end_message()
+			if state.channel_logger.search_index != None:
+				state.channel_logger.search_index.close()
+
 	def shutdown(self):
-		""" Logs the shutdown, appends "log end" messages, exits gracefully.
+		""" Logs the shutdown, appends "log end" messages, drains the log writer, exits gracefully.
+
+			Bots that share a reactor (and with it, the log writer) are shut down with :func:`networks.shutdown` instead.
 		"""
-		self.channel_logger.append_log_end_message()
+		self.close_channels()
+		if self.log_writer != None:
+			# Make sure everything queued (including the "log end" message) reaches the disk.
+			self.log_writer.close()
+		if self.archiver != None:
+			self.archiver.close()
 		self.logger.info("Shutting down.")
 		sys.exit(0)
 		
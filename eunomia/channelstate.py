@@ -0,0 +1,44 @@
+import eunomialog
+import journal
+import legislation
+from backlog import Backlog
+
+class ChannelState:
+	""" Everything eunomia keeps for one channel: its backlog, its legislator and its channel logger.
+
+		:param name: The channel name.
+		:param backlog_length: The capacity of the channel's backlog.
+		:param log_writer: Background writer for the channel log, or ``None`` to write synchronously.
+		:param log_root: Root of the channel's logs. Defaults to :data:`eunomialog.log_root`.
+		:param clock: The bot's clock, shared by the channel logger and the legislators.
+		:param backlog_slack: The number of appends evicted backlog items are kept around for, see :class:`backlog.Backlog`.
+		:type name: str
+		:type backlog_length: int
+		:type log_writer: eunomialog.LogWriter
+		:type log_root: str
+		:type clock: clock.Clock
+		:type backlog_slack: int
+	"""
+	def __init__(self, name, backlog_length, log_writer=None, log_root=None, clock=None, backlog_slack=0):
+		self.name = name
+
+		self.clock = clock
+		self.log_writer = log_writer
+
+		self.backlog = Backlog(backlog_length, backlog_slack)
+		self.channel_logger = eunomialog.ChannelLogger(name, log_writer, log_root, clock)
+		# Outlives the legislators, so reloading the legislation module doesn't reopen (and re-check) the journal.
+		self.proposal_journal = journal.ProposalJournal(name, root=log_root)
+		self.legislator = None
+		self.new_legislator()
+		# A floodfilter.FloodFilter, if flood filtering is enabled. See EunomiaBot.enable_flood_filter().
+		self.flood_filter = None
+
+	def new_legislator(self):
+		""" Replaces the legislator with a fresh one, built from the (possibly reloaded) legislation module.
+
+			Proposals the old one passed are journaled first, with the context they have so far.
+		"""
+		if self.legislator != None:
+			self.legislator.flush()
+		self.legislator = legislation.Legislation(self.name, self.proposal_journal, self.clock)
@@ -0,0 +1,107 @@
+"""
+.. module:: clock
+	:platform: Unix
+	:synopsis: A clock that is read once per event, with the formatted time and date cached.
+
+Handling one line used to read the time several times (for the backlog item, the channel log's date and its
+timestamp, the proposal journal), and format it again for every log line. Instead, the bot samples a :class:`Clock`
+once per event (see :meth:`bot.EunomiaBot.sample_clock`), and everything that handles the event reads the sample:
+
+* :attr:`Clock.timestamp` and :attr:`Clock.time_string` (``HH:MM:SS``) are only rebuilt when the second changes,
+* :attr:`Clock.date`, :attr:`Clock.date_string` and :attr:`Clock.day` are only rebuilt when the day changes.
+  The end of the current day is precomputed, so checking for a new day is one integer compare.
+
+All times are UTC. :class:`FakeClock` is a clock that only moves when told to, for deterministic benchmarks and tests.
+
+"""
+
+import datetime
+import time
+
+class Clock:
+	""" A sampled clock. See the module description.
+
+		:param time_function: Gets the current time as seconds since the epoch.
+		:type time_function: function
+	"""
+	def __init__(self, time_function=time.time):
+		self.time_function = time_function
+
+		# The last sample, in seconds since the epoch.
+		self.now = 0.0
+		# Whole seconds since the epoch of the last sample. Everything below is as of this second.
+		self.second = None
+
+		# Days since the epoch, and the second the next day starts at.
+		self.day = None
+		self.day_start = 0
+		self.next_midnight = 0
+		self.date = None
+		self.date_string = None
+
+		self.timestamp = None
+		self.time_string = None
+
+		self.sample()
+
+	def sample(self):
+		""" Reads the time. Everything derived from it is only recomputed if it changed.
+
+			:returns: The clock itself.
+		"""
+		self.now = self.time_function()
+		second = int(self.now)
+		if second == self.second:
+			return self
+
+		self.second = second
+		if not self.day_start <= second < self.next_midnight:
+			# A new day (or the clock was set back past midnight).
+			self.day = second // 86400
+			self.day_start = self.day * 86400
+			self.next_midnight = self.day_start + 86400
+			self.date = datetime.date(1970, 1, 1) + datetime.timedelta(days=self.day)
+			self.date_string = str(self.date)
+
+		seconds_of_day = second - self.day_start
+		self.timestamp = datetime.time(seconds_of_day // 3600, seconds_of_day // 60 % 60, seconds_of_day % 60)
+		self.time_string = "{:02d}:{:02d}:{:02d}".format(seconds_of_day // 3600, seconds_of_day // 60 % 60, seconds_of_day % 60)
+
+		return self
+
+	def format_time(self, timestamp):
+		""" Formats a time as ``HH:MM:SS``, without formatting it again if it is the current sample.
+
+			:type timestamp: datetime.time
+		"""
+		if timestamp is self.timestamp:
+			return self.time_string
+		return str(timestamp)
+
+	def isoformat(self, when=None):
+		""" Gets the sampled date and time as ``YYYY-MM-DDTHH:MM:SS``.
+
+			:param when: Format this time (in seconds since the epoch) instead. Only formatted again if it isn't the sampled second.
+			:type when: float
+		"""
+		if when != None and int(when) != self.second:
+			return datetime.datetime.fromtimestamp(int(when), datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+		return "{}T{}".format(self.date_string, self.time_string)
+
+class FakeClock(Clock):
+	""" A :class:`Clock` that only moves when :meth:`advance` or :meth:`set` is called.
+
+		:param start: The initial time, in seconds since the epoch. Defaults to a fixed time, so runs are repeatable.
+		:type start: float
+	"""
+	def __init__(self, start=1451606400.0):
+		self.fake_time = start
+		super().__init__(lambda: self.fake_time)
+
+	def set(self, now):
+		self.fake_time = now
+		return self.sample()
+
+	def advance(self, seconds):
+		self.fake_time += seconds
+		return self.sample()
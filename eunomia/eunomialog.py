@@ -1,18 +1,250 @@
-import datetime
 import os
+import queue
+import threading
+import time
+
+import logsetup
+from clock import Clock
+
+# Root directory of all logs. Every RolloverLogger puts its files in a subdirectory of this.
+log_root = os.path.dirname(os.path.dirname(os.path.realpath(__file__))) + "/logs"
+
+def network_log_root(network=None):
+	""" Gets the root directory of a network's logs.
+
+		:param network: The network's name, or ``None`` for the default network, whose logs are right in :data:`log_root`.
+		:type network: str
+	"""
+	if network == None:
+		return log_root
+	return "{}/{}".format(log_root, network)
+
+class LogWriter:
+	""" Writes log lines from a dedicated thread, so disk I/O never happens on the IRC thread.
+
+		Lines are handed over through a bounded queue (:meth:`put` blocks when it is full, which bounds memory).
+		The writer thread keeps the current file of every logger open, and writes in batches:
+		a batch is written once it holds ``batch_size`` lines, or ``flush_interval`` seconds after its first line arrived,
+		whichever comes first. All lines of a batch that go to the same file are written with a single ``writelines``.
+
+		:param durability: ``"flush"`` to flush each batch to the OS, or ``"fsync"`` to also ``os.fsync`` it to disk.
+		:param batch_size: Number of lines that triggers an immediate write.
+		:param flush_interval: Maximum number of seconds a line waits in a batch.
+		:param queue_size: Maximum number of pending :meth:`put` calls.
+		:type durability: str
+		:type batch_size: int
+		:type flush_interval: float
+		:type queue_size: int
+	"""
+	durabilities = ("flush", "fsync")
+
+	# Queue entry that tells the writer thread to write what it has and exit.
+	_close_marker = object()
+
+	def __init__(self, durability="flush", batch_size=64, flush_interval=0.5, queue_size=10000):
+		if durability not in self.durabilities:
+			raise ValueError("Log durability \"{}\" not supported.".format(durability))
+
+		self.logger = logsetup.get_pipeline().get_logger("LogWriter")
+
+		self.durability = durability
+		self.batch_size = batch_size
+		self.flush_interval = flush_interval
+
+		self.queue = queue.Queue(queue_size)
+		# Stream key (one per logger) -> (filename, open file).
+		self.files = {}
+
+		self.thread = threading.Thread(target=self.run, name="LogWriter", daemon=True)
+		self.thread.start()
+
+	def put(self, key, filename, lines):
+		""" Queues lines to be appended to a file.
+
+			:param key: Identifies the logger writing the lines. Only one file is kept open per key;
+				when a key moves to a new file (e.g. on a new day) the old one is closed.
+			:param filename: The file to append to.
+			:param lines: The lines to append, each including its trailing newline.
+			:type key: str
+			:type filename: str
+			:type lines: list
+		"""
+		self.queue.put((key, filename, lines))
+
+	def pending(self):
+		""" Gets the number of writes that are waiting for the writer thread.
+		"""
+		return self.queue.qsize()
+
+	def close(self):
+		""" Writes out everything that is still queued, closes all files and stops the writer thread.
+
+			Safe to call more than once.
+		"""
+		if not self.thread.is_alive():
+			return
+
+		self.queue.put(self._close_marker)
+		self.thread.join()
+
+	def run(self):
+		""" Body of the writer thread.
+		"""
+		pending = []
+		pending_lines = 0
+		deadline = None
+		closing = False
+
+		while not closing:
+			timeout = None if deadline == None else max(0, deadline - time.monotonic())
+			try:
+				entry = self.queue.get(timeout=timeout)
+			except queue.Empty:
+				entry = None
+
+			if entry is self._close_marker:
+				closing = True
+			elif entry != None:
+				pending.append(entry)
+				pending_lines += len(entry[2])
+				if deadline == None:
+					deadline = time.monotonic() + self.flush_interval
+
+			if pending and (closing or pending_lines >= self.batch_size or time.monotonic() >= deadline):
+				self.write_batch(pending)
+				pending = []
+				pending_lines = 0
+				deadline = None
+
+		for (filename, logfile) in self.files.values():
+			logfile.close()
+		self.files = {}
+
+	def write_batch(self, batch):
+		""" Writes a batch of queued entries, then flushes (and optionally fsyncs) every file that was written to.
+
+			:param batch: A list of ``(key, filename, lines)`` tuples, in queue order.
+			:type batch: list
+		"""
+		# Merge the batch into one list of lines per file, keeping the order within each file.
+		merged = {}
+		for (key, filename, lines) in batch:
+			merged.setdefault((key, filename), []).extend(lines)
+
+		for ((key, filename), lines) in merged.items():
+			try:
+				logfile = self.get_file(key, filename)
+				logfile.writelines(lines)
+				logfile.flush()
+				if self.durability == "fsync":
+					os.fsync(logfile.fileno())
+			except OSError:
+				self.logger.exception("Could not write %d line(s) to \"%s\".", len(lines), filename)
+
+	def get_file(self, key, filename):
+		""" Gets the open file for a stream key, (re)opening it if the key moved on to another file.
+		"""
+		current = self.files.get(key)
+		if current != None:
+			(current_filename, logfile) = current
+			if current_filename == filename:
+				return logfile
+			logfile.close()
+			del self.files[key]
+
+		logfile = open(filename, 'a', encoding="utf-8")
+		self.files[key] = (filename, logfile)
+		return logfile
+
+def read_tail_lines(path, count, block_size=8192):
+	""" Reads the last ``count`` lines of a file, by reading blocks backwards from its end.
+
+		Only the tail is read, so this takes the same time for a 1 KiB file as for a 1 GiB one.
+
+		:param path: The file to read.
+		:param count: The maximum number of lines to return.
+		:param block_size: How many bytes to read at a time.
+		:type path: str
+		:type count: int
+		:type block_size: int
+		:returns: A list of up to ``count`` lines, oldest first, without trailing newlines. Empty if the file does not exist.
+	"""
+	if count <= 0:
+		return []
+
+	try:
+		logfile = open(path, 'rb')
+	except FileNotFoundError:
+		return []
+
+	with logfile:
+		position = logfile.seek(0, os.SEEK_END)
+		data = b""
+
+		# One more newline than lines wanted, so the oldest line is known to be complete.
+		while position > 0 and data.count(b"\n") <= count:
+			read_size = min(block_size, position)
+			position -= read_size
+			logfile.seek(position)
+			data = logfile.read(read_size) + data
+
+	lines = data.split(b"\n")
+	if lines and lines[-1] == b"":
+		# The file ends with a newline.
+		lines.pop()
+	if position > 0:
+		# The first line is (probably) cut off.
+		lines = lines[1:]
+
+	return [line.decode("utf-8", "replace") for line in lines[-count:]]
 
 class RolloverLogger:
 	"""	Provides a basic class for logging that creates new logfiles based on date.
+
+		:param log_type_name: The type of log, used as the first subdirectory of ``logs/``.
+		:param log_subdirs: Extra subdirectories below that, if any.
+		:param writer: If given, lines are handed to this :class:`LogWriter` instead of being written synchronously.
+		:param root: The directory ``logs/`` stands for above. Defaults to :data:`log_root`. See :func:`network_log_root`.
+		:param clock: A clock that is sampled once per event (see :mod:`clock`). Without one, the logger has a clock of its own,
+			which it samples on every append.
+		:type log_type_name: str
+		:type log_subdirs: str
+		:type writer: LogWriter
+		:type root: str
+		:type clock: clock.Clock
 	"""
-	def __init__(self, log_type_name, log_subdirs=None):
-		self.log_dir = os.path.dirname(os.path.dirname(os.path.realpath(__file__))) + "/logs/{}".format(log_type_name)
+	def __init__(self, log_type_name, log_subdirs=None, writer=None, root=None, clock=None):
+		if root == None:
+			root = log_root
+		self.log_dir = "{}/{}".format(root, log_type_name)
 
 		if log_subdirs != None:
 			# If there are extra subdirs, append them.
 			self.log_dir = "{}/{}".format(self.log_dir, log_subdirs)
 
+		self.writer = writer
+		self.log_dir_created = False
+
+		# An archive.Archiver that gets the log dir whenever the date changes, or None.
+		self.archiver = None
+
+		# Byte offset tracking, for indexes that point into the logs. See append().
+		self.track_offsets = False
+		self.offset_filename = None
+		# Byte offset at which the next line will be written, and of the first line of the last append().
+		self.log_offset = 0
+		self.last_offset = 0
+
+		self.own_clock = clock == None
+		self.clock = Clock() if clock == None else clock
+
+		# The current log file, and the day (see clock.Clock.day) it belongs to.
+		self.log_filename = None
+		self.log_filename_day = None
+
 		# Also initialize the current date.
 		self.date_now = self.get_current_date()
+		self.day = self.clock.day
 
 	def get_current_date(self):
 		""" Gets the current UTC date.
@@ -20,21 +252,27 @@ class RolloverLogger:
 			:returns: A :class:`datetime.date` object containing the current date.
 			:rtype: datetime.date
 		"""
-		datetime_now = datetime.datetime.utcnow()
-		return datetime.date(datetime_now.year, datetime_now.month, datetime_now.day)
+		if self.own_clock:
+			self.clock.sample()
+		return self.clock.date
 
 	def update_current_date(self):
 		""" Updates the current UTC date.
 			Ignores if the date is current.
 		"""
-		# TODO: This could probably just be 'self.date_now = self.get_current_date()'.
-		date_new = self.get_current_date()
+		if self.own_clock:
+			self.clock.sample()
 
-		if date_new == self.date_now:
+		if self.clock.day == self.day:
 			# There's no need to change the date - we're already up to date.
 			return
 
-		self.date_now = date_new
+		self.day = self.clock.day
+		self.date_now = self.clock.date
+
+		if self.archiver != None:
+			# Yesterday's log is finished now.
+			self.archiver.submit(self.log_dir, self.clock.date_string)
 
 	def update_log_filename(self):
 		""" Updates the current log filename, making sure to use the correct file for the date.
@@ -42,11 +280,17 @@ class RolloverLogger:
 		# Make sure the date is correct.
 		self.update_current_date()
 
+		if self.log_filename_day == self.day:
+			return
+
 		# Create the log dir (recursively) if it does not exist.
-		if not os.path.exists(self.log_dir):
-			os.makedirs(self.log_dir)
+		# This only needs checking once, not for every line.
+		if not self.log_dir_created:
+			os.makedirs(self.log_dir, exist_ok=True)
+			self.log_dir_created = True
 
 		self.log_filename = "{}/{}.log".format(self.log_dir, self.date_now)
+		self.log_filename_day = self.day
 
 	def append(self, log_message):
 		""" Appends a new line/list of lines to the log.
@@ -62,48 +306,92 @@ class RolloverLogger:
 		self.update_log_filename()
 
 		# We assume log_message is already preformatted.
-		# This is basically a stub to append to the file right now.
 		# However, it is assumed that the log entry does not include trailing newline.
-		with open(self.log_filename, 'a') as logfile:
-			# Write all items, one by one, with newlines after each, if it's a list.
-			if isinstance(log_message, list):
-				for line in log_message:
-					logfile.write(line + "\n")
-			# Or if it's a string, just write the message with a trailing newline.
-			elif isinstance(log_message, str):
-				logfile.write(log_message + "\n")
+		if isinstance(log_message, list):
+			lines = [line + "\n" for line in log_message]
+		elif isinstance(log_message, str):
+			lines = [log_message + "\n"]
+		else:
+			return
+
+		if self.track_offsets:
+			if self.offset_filename != self.log_filename:
+				# A file we haven't written to yet (at startup, or on a new day), so nothing of ours is queued for it.
+				self.offset_filename = self.log_filename
+				try:
+					self.log_offset = os.path.getsize(self.log_filename)
+				except OSError:
+					self.log_offset = 0
+
+			self.last_offset = self.log_offset
+			for line in lines:
+				self.log_offset += len(line.encode("utf-8"))
+
+		if self.writer != None:
+			self.writer.put(self.log_dir, self.log_filename, lines)
+			return
+
+		with open(self.log_filename, 'a', encoding="utf-8") as logfile:
+			logfile.writelines(lines)
 
 class ChannelLogger(RolloverLogger):
 	""" Handles logging of channel messages to disk.
 	"""
-	def __init__(self, channel_name):
+	def __init__(self, channel_name, writer=None, root=None, clock=None):
 		self.channel_name = channel_name
 
-		super().__init__("channel", channel_name)
+		super().__init__("channel", channel_name, writer, root, clock)
 
-	# TODO: Unify timestamp formatting between this and the legislation module.
+		# A search.SearchIndex that gets every line appended with append_item() or append_items(), or None.
+		self.search_index = None
 
-	def append_log_begin_message(self):
-		time_now = datetime.datetime.utcnow()
-		self.append("{:02d}:{:02d}:{:02d} --- log begin ---".format(time_now.hour, time_now.minute, time_now.second))
+	def set_search_index(self, search_index):
+		""" Starts feeding every line appended with :meth:`append_item` or :meth:`append_items` to a search index.
 
-	def append_log_end_message(self):
-		time_now = datetime.datetime.utcnow()
-		self.append("{:02d}:{:02d}:{:02d} --- log end ---".format(time_now.hour, time_now.minute, time_now.second))
+			:param search_index: The index, or ``None`` to stop indexing.
+			:type search_index: search.SearchIndex
+		"""
+		self.search_index = search_index
+		self.track_offsets = search_index != None
 
-class ProposalLogger(RolloverLogger):
-	""" Handles logging of proposals to disk.
-	"""
-	def __init__(self, channel_name):
-		self.channel_name = channel_name
+	def append_item(self, item):
+		""" Appends a backlog item to the log, and indexes it if there is a search index.
 
-		super().__init__("proposal", channel_name)
+			:param item: The item to append.
+			:type item: backlog.BacklogItem
+		"""
+		# Items stamped with the current sample (all live ones) reuse its formatted time.
+		self.append("{} {}".format(self.clock.format_time(item.timestamp), item.message))
 
-	def get_current_time(self):
-		datetime_now = datetime.datetime.utcnow()
+		if self.search_index != None:
+			self.search_index.add(self.clock.date_string, self.last_offset, self.log_offset, item)
 
-		return datetime.time(datetime_now.hour, datetime_now.minute, datetime_now.second)
+	def append_items(self, items):
+		""" Appends backlog items to the log in one write, and indexes them if there is a search index.
 
-	def update_log_filename(self):
-		super().update_log_filename()
-		self.log_filename = "{}/{}_{}.log".format(self.log_dir, self.date_now, self.get_current_time())
+			:param items: The items to append, oldest first.
+			:type items: list
+			:returns: The offset of every item's line in the log file if there is a search index, otherwise ``None``.
+		"""
+		format_time = self.clock.format_time
+		lines = ["{} {}".format(format_time(item.timestamp), item.message) for item in items]
+		self.append(lines)
+
+		if self.search_index == None:
+			return None
+
+		# append() only tracks where the whole batch starts and ends.
+		offsets = []
+		offset = self.last_offset
+		for (item, line) in zip(items, lines):
+			end = offset + len(line.encode("utf-8")) + 1
+			self.search_index.add(self.clock.date_string, offset, end, item)
+			offsets.append(offset)
+			offset = end
+		return offsets
+
+	def append_log_begin_message(self):
+		self.append("{} --- log begin ---".format(self.clock.sample().time_string))
+
+	def append_log_end_message(self):
+		self.append("{} --- log end ---".format(self.clock.sample().time_string))
@@ -0,0 +1,151 @@
+"""
+.. module:: fakeserver
+	:platform: Unix
+	:synopsis: A minimal local IRC server stand-in, for end-to-end load tests.
+
+It only speaks as much IRC as :class:`bot.EunomiaBot` needs: registration (``NICK``/``USER`` -> ``001``),
+``JOIN`` (with a names reply), ``PING``/``PONG`` and ``QUIT``. Everything else the bot sends is recorded.
+Channel traffic from simulated users is injected with :meth:`FakeIRCServer.send_events`.
+
+"""
+
+import socket
+import threading
+import time
+
+server_name = "fake.server"
+
+def format_event(kind, nick, channel, arguments):
+	""" Formats a ``(kind, nick, arguments)`` traffic tuple (see :mod:`traffic`) as a raw IRC line, as a server would send it.
+
+		:returns: The line, including the trailing CRLF, or ``None`` for kinds that can't be sent.
+	"""
+	prefix = ":{0}!{0}@sim.invalid".format(nick)
+
+	if kind == "pubmsg":
+		return "{} PRIVMSG {} :{}\r\n".format(prefix, channel, arguments[0])
+	elif kind == "action":
+		return "{} PRIVMSG {} :\x01ACTION {}\x01\r\n".format(prefix, channel, arguments[0])
+	elif kind == "join":
+		return "{} JOIN {}\r\n".format(prefix, channel)
+	elif kind == "part":
+		if arguments:
+			return "{} PART {} :{}\r\n".format(prefix, channel, arguments[0])
+		return "{} PART {}\r\n".format(prefix, channel)
+	elif kind == "quit":
+		return "{} QUIT :{}\r\n".format(prefix, arguments[0] if arguments else "")
+
+	return None
+
+class FakeIRCServer:
+	""" Listens on a local port and serves a single client connection.
+
+		:param host: Address to listen on.
+		:param port: Port to listen on. 0 picks a free port; see :attr:`port`.
+		:type host: str
+		:type port: int
+	"""
+	def __init__(self, host="127.0.0.1", port=0):
+		self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		self.listener.bind((host, port))
+		self.listener.listen(1)
+
+		(self.host, self.port) = self.listener.getsockname()
+
+		self.client = None
+		self.client_nick = None
+		self.send_lock = threading.Lock()
+
+		# Raw lines received from the client, and when they arrived.
+		self.received = []
+		self.connected = threading.Event()
+		self.registered = threading.Event()
+		self.joined = {}
+
+		self.thread = threading.Thread(target=self.serve, name="FakeIRCServer", daemon=True)
+		self.thread.start()
+
+	def serve(self):
+		""" Body of the server thread: accepts one client and handles what it sends.
+		"""
+		(self.client, address) = self.listener.accept()
+		self.client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		self.connected.set()
+
+		buffer = b""
+		while True:
+			try:
+				data = self.client.recv(65536)
+			except OSError:
+				break
+			if not data:
+				break
+
+			buffer += data
+			lines = buffer.split(b"\r\n")
+			buffer = lines.pop()
+			for line in lines:
+				self.handle_line(line.decode("utf-8", "replace"))
+
+	def handle_line(self, line):
+		now = time.monotonic()
+		self.received.append((now, line))
+
+		parts = line.split(" ")
+		command = parts[0].upper()
+
+		if command == "NICK":
+			self.client_nick = parts[1]
+		elif command == "USER":
+			self.send_raw(":{} 001 {} :Welcome to the fake IRC server\r\n".format(server_name, self.client_nick))
+			self.registered.set()
+		elif command == "PING":
+			self.send_raw(":{} PONG {} {}\r\n".format(server_name, server_name, " ".join(parts[1:])))
+		elif command == "JOIN":
+			for channel in parts[1].split(","):
+				self.send_raw(":{0}!{0}@sim.invalid JOIN {1}\r\n".format(self.client_nick, channel))
+				self.send_raw(":{} 353 {} = {} :{}\r\n".format(server_name, self.client_nick, channel, self.client_nick))
+				self.send_raw(":{} 366 {} {} :End of /NAMES list.\r\n".format(server_name, self.client_nick, channel))
+				self.joined.setdefault(channel, threading.Event()).set()
+		elif command == "QUIT":
+			self.close()
+
+	def wait_for_join(self, channel, timeout=10):
+		""" Waits until the client has joined ``channel``.
+
+			:returns: True if it did within ``timeout`` seconds.
+		"""
+		return self.joined.setdefault(channel, threading.Event()).wait(timeout)
+
+	def send_raw(self, data):
+		""" Sends raw, already formatted data to the client.
+		"""
+		with self.send_lock:
+			self.client.sendall(data.encode("utf-8"))
+
+	def send_events(self, events, channel):
+		""" Sends traffic tuples (see :mod:`traffic`) to the client, as lines from simulated users, in one write.
+
+			:param events: ``(kind, nick, arguments)`` tuples.
+			:param channel: The channel the traffic happens in.
+			:type events: list
+			:type channel: str
+			:returns: The number of events that were sent.
+		"""
+		lines = [format_event(kind, nick, channel, arguments) for (kind, nick, arguments) in events]
+		lines = [line for line in lines if line != None]
+		if lines:
+			self.send_raw("".join(lines))
+		return len(lines)
+
+	def close(self):
+		""" Closes the client connection and stops listening.
+		"""
+		for sock in (self.client, self.listener):
+			if sock == None:
+				continue
+			try:
+				sock.close()
+			except OSError:
+				pass
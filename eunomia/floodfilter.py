@@ -0,0 +1,147 @@
+"""
+.. module:: floodfilter
+	:platform: Unix
+	:synopsis: A cheap admission check in front of the backlog and legislation, for join/part storms and paste floods.
+
+Without it, every line of a flood is appended to the backlog, written to the channel log and run through
+the legislator. A :class:`FloodFilter` sees every line of its channel first (see :meth:`bot.EunomiaBot.backlog_lines`),
+and decides how much of that it gets:
+
+* :data:`ADMIT`: all of it.
+* :data:`SHED`: the backlog and the channel log, but it is never legislated, however many votes it gets (it still
+  ends a run of votes, so a ``:D`` after it isn't taken for a vote on the line before). Lines that repeat a line said
+  more than ``repeat_limit`` times in the last ``window`` seconds, lines of a nick that said more than ``nick_limit``
+  lines in it, and, while the channel is overloaded (more than ``overload_limit`` lines in the window), every other
+  line too. So a flood costs no journal writes, however much of it gets voted on.
+* :data:`COALESCE`: none of it. Once there were more than ``presence_limit`` joins, parts and quits in the window,
+  the rest are only counted, and written as one summary line (``*** Flood: ...``) a window later.
+
+Votes are always admitted, so they keep counting (and passing proposals) during a flood. Commands aren't filtered
+at all, and are answered as always. The filter only keeps counts of the lines in the window, so it costs a few
+dict operations per line.
+
+"""
+
+import collections
+
+from backlog import AUTHORED_KINDS, JOIN, PART, QUIT
+
+# Verdicts of FloodFilter.admit().
+ADMIT = 0
+SHED = 1
+COALESCE = 2
+
+presence_kinds = frozenset((JOIN, PART, QUIT))
+
+class FloodFilter:
+	""" Sliding window counts of a channel's recent lines, and what they mean for the next one. See the module description.
+
+		:param window: Length of the sliding window, in seconds.
+		:param repeat_limit: Times the same text may be said in the window before it is shed.
+		:param nick_limit: Lines one nick may say in the window before the rest of them are shed.
+		:param presence_limit: Joins, parts and quits in the window before the rest are coalesced.
+		:param overload_limit: Lines in the window before every line but votes is shed.
+		:type window: float
+		:type repeat_limit: int
+		:type nick_limit: int
+		:type presence_limit: int
+		:type overload_limit: int
+	"""
+	def __init__(self, window=10.0, repeat_limit=3, nick_limit=8, presence_limit=10, overload_limit=40):
+		self.window = window
+		self.repeat_limit = repeat_limit
+		self.nick_limit = nick_limit
+		self.presence_limit = presence_limit
+		self.overload_limit = overload_limit
+
+		# (time, nick, text) of every line in the window, oldest first. Nick and text are None for joins, parts and quits.
+		self.recent = collections.deque()
+		self.nick_counts = {}
+		self.text_counts = {}
+		self.presence_count = 0
+
+		# The coalesced joins, parts and quits that are not summarized yet, per kind, and when the first and last were.
+		self.coalesced_counts = dict.fromkeys(presence_kinds, 0)
+		self.flood_start = None
+		self.flood_last = None
+
+		# Totals, for metrics.
+		self.shed = 0
+		self.coalesced = 0
+
+	def expire(self, now):
+		""" Forgets the lines that are older than the window.
+		"""
+		horizon = now - self.window
+		recent = self.recent
+		while recent and recent[0][0] <= horizon:
+			(when, nick, text) = recent.popleft()
+			if nick == None:
+				self.presence_count -= 1
+				continue
+
+			self.nick_counts[nick] -= 1
+			if not self.nick_counts[nick]:
+				del self.nick_counts[nick]
+			self.text_counts[text] -= 1
+			if not self.text_counts[text]:
+				del self.text_counts[text]
+
+	def admit(self, item):
+		""" Counts a line, and decides what happens to it.
+
+			:param item: The line, with its time (``when``) set.
+			:type item: backlog.BacklogItem
+			:returns: :data:`ADMIT`, :data:`SHED` or :data:`COALESCE`.
+		"""
+		now = item.when
+		self.expire(now)
+
+		kind = item.kind
+		if kind in presence_kinds:
+			self.recent.append((now, None, None))
+			self.presence_count += 1
+			if self.presence_count <= self.presence_limit:
+				return ADMIT
+
+			self.coalesced_counts[kind] += 1
+			if self.flood_start == None:
+				self.flood_start = now
+			self.flood_last = now
+			self.coalesced += 1
+			return COALESCE
+
+		if kind not in AUTHORED_KINDS:
+			# Kicks, modes, topics, ...: rare, and never voted on.
+			return ADMIT
+
+		nick = item.nick
+		text = item.text
+		self.recent.append((now, nick, text))
+		nick_count = self.nick_counts[nick] = self.nick_counts.get(nick, 0) + 1
+		text_count = self.text_counts[text] = self.text_counts.get(text, 0) + 1
+
+		if item.vote != None:
+			return ADMIT
+		if text_count > self.repeat_limit or nick_count > self.nick_limit or len(self.recent) > self.overload_limit:
+			self.shed += 1
+			return SHED
+		return ADMIT
+
+	def take_summary(self, now):
+		""" Gets the summary line of the coalesced joins, parts and quits, once the first of them is a window old.
+
+			:param now: The current time, in seconds since the epoch.
+			:type now: float
+			:returns: The line (e.g. ``*** Flood: 120 joins, 80 parts, 3 quits in 10s``), or ``None`` if it isn't due yet.
+		"""
+		if self.flood_start == None or now - self.flood_start < self.window:
+			return None
+
+		counts = self.coalesced_counts
+		summary = "*** Flood: {} joins, {} parts, {} quits in {:.0f}s".format(counts[JOIN], counts[PART], counts[QUIT], max(1, self.flood_last - self.flood_start))
+
+		self.coalesced_counts = dict.fromkeys(presence_kinds, 0)
+		self.flood_start = None
+		self.flood_last = None
+		return summary
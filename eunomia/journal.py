@@ -0,0 +1,270 @@
+"""
+.. module:: journal
+	:platform: Unix
+	:synopsis: Append-only journal of a channel's legislated proposals, with an offset index.
+
+Every channel has two files in ``logs/proposal/<channel>/``:
+
+``proposals.journal``
+	A header, followed by one framed record per proposal: the length of the record, its CRC-32
+	(both unsigned 32 bit little endian), then the record itself, as UTF-8 JSON.
+``proposals.index``
+	The offset of every record in the journal, as unsigned 64 bit little endian integers.
+	Proposal ``n`` (counting from 0) is at ``8 * n``, so the number of proposals is the size of the file divided by 8.
+
+The journal is written before the index. If eunomia dies between the two, the next :class:`ProposalJournal`
+indexes the records that are missing from the index, and cuts off a record that was only written partially.
+
+List or read proposals from the command line::
+
+	python eunomia/journal.py "#osdev-offtopic"
+	python eunomia/journal.py "#osdev-offtopic" 42
+
+Proposal logs from before the journal (one ``<date>_<time>.log`` per proposal) can be imported with ``--import``.
+
+"""
+
+import glob
+import json
+import os
+import struct
+import sys
+import zlib
+
+import eunomialog
+
+journal_filename = "proposals.journal"
+index_filename = "proposals.index"
+
+journal_header = b"eunomia proposal journal 1\n"
+
+# (length, crc32) in front of every record.
+frame = struct.Struct("<II")
+# One record offset in the index.
+index_entry = struct.Struct("<Q")
+
+class ProposalJournal:
+	""" The proposal journal of one channel.
+
+		Proposals are rare, so records are written synchronously, each with one open, write and close.
+		That way, every :class:`ProposalJournal` of a channel (e.g. the one of a legislator that was replaced
+		by ``reload-legislation``) always agrees with the files.
+
+		:param channel_name: The channel.
+		:param fsync: Also ``os.fsync`` every record and index entry.
+		:param root: The log root. Defaults to :data:`eunomialog.log_root`. See :func:`eunomialog.network_log_root`.
+		:param read_only: Only read the journal: nothing is created or recovered, and :meth:`append` raises ``ValueError``.
+			A journal that doesn't exist reads as empty.
+		:type channel_name: str
+		:type fsync: bool
+		:type root: str
+		:type read_only: bool
+	"""
+	def __init__(self, channel_name, fsync=False, root=None, read_only=False):
+		self.channel_name = channel_name
+		self.fsync = fsync
+		self.read_only = read_only
+
+		if root == None:
+			root = eunomialog.log_root
+		self.log_dir = "{}/proposal/{}".format(root, channel_name)
+		self.journal_path = "{}/{}".format(self.log_dir, journal_filename)
+		self.index_path = "{}/{}".format(self.log_dir, index_filename)
+
+		if not read_only:
+			os.makedirs(self.log_dir, exist_ok=True)
+			self.recover()
+
+	def __len__(self):
+		try:
+			return os.path.getsize(self.index_path) // index_entry.size
+		except FileNotFoundError:
+			return 0
+
+	def recover(self):
+		""" Makes the journal and index consistent again after a crash. Only looks at the end of the files.
+		"""
+		if not os.path.exists(self.journal_path) or os.path.getsize(self.journal_path) == 0:
+			with open(self.journal_path, "wb") as journal:
+				journal.write(journal_header)
+			with open(self.index_path, "wb"):
+				pass
+			return
+
+		with open(self.index_path, "ab+") as index, open(self.journal_path, "rb+") as journal:
+			index_size = index.seek(0, os.SEEK_END)
+			if index_size % index_entry.size:
+				# Half an index entry.
+				index_size -= index_size % index_entry.size
+				index.truncate(index_size)
+
+			# Find the end of the last indexed record.
+			if index_size > 0:
+				index.seek(index_size - index_entry.size)
+				(offset,) = index_entry.unpack(index.read(index_entry.size))
+				journal.seek(offset)
+				(length, crc) = frame.unpack(journal.read(frame.size))
+				position = offset + frame.size + length
+			else:
+				position = len(journal_header)
+
+			# Index every complete record after it, and cut off whatever follows the last one.
+			while True:
+				journal.seek(position)
+				record = self.read_frame(journal)
+				if record == None:
+					break
+				index.write(index_entry.pack(position))
+				position = journal.tell()
+
+			journal.truncate(position)
+
+	def read_frame(self, journal):
+		""" Reads the record the journal is positioned at.
+
+			:returns: The record's JSON, or ``None`` if there is no complete, intact record there.
+		"""
+		header = journal.read(frame.size)
+		if len(header) < frame.size:
+			return None
+
+		(length, crc) = frame.unpack(header)
+		data = journal.read(length)
+		if len(data) < length or zlib.crc32(data) != crc:
+			return None
+
+		return data
+
+	def append(self, record):
+		""" Appends a proposal to the journal.
+
+			:param record: The proposal. Anything JSON can serialize; :meth:`Legislation.legislate` uses a dict.
+			:type record: dict
+			:returns: The number of the proposal.
+		"""
+		if self.read_only:
+			raise ValueError("{} was opened read-only.".format(self.journal_path))
+
+		data = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+		with open(self.journal_path, "ab") as journal:
+			offset = journal.tell()
+			journal.write(frame.pack(len(data), zlib.crc32(data)) + data)
+			if self.fsync:
+				journal.flush()
+				os.fsync(journal.fileno())
+
+		with open(self.index_path, "ab") as index:
+			number = index.tell() // index_entry.size
+			index.write(index_entry.pack(offset))
+			if self.fsync:
+				index.flush()
+				os.fsync(index.fileno())
+
+		return number
+
+	def get(self, number):
+		""" Reads proposal ``number``, counting from 0. Negative numbers count from the end, as with lists.
+
+			:raises IndexError: If there is no such proposal.
+		"""
+		count = len(self)
+		if number < 0:
+			number += count
+		if not 0 <= number < count:
+			raise IndexError("No proposal {} in {}.".format(number, self.journal_path))
+
+		with open(self.index_path, "rb") as index:
+			index.seek(number * index_entry.size)
+			(offset,) = index_entry.unpack(index.read(index_entry.size))
+
+		with open(self.journal_path, "rb") as journal:
+			journal.seek(offset)
+			data = self.read_frame(journal)
+
+		if data == None:
+			raise IndexError("Proposal {} in {} is damaged.".format(number, self.journal_path))
+		return json.loads(data.decode("utf-8"))
+
+	def __getitem__(self, number):
+		return self.get(number)
+
+	def __iter__(self):
+		""" Iterates over all proposals, oldest first, reading the journal sequentially.
+		"""
+		count = len(self)
+		if count == 0:
+			return
+
+		with open(self.journal_path, "rb") as journal:
+			journal.seek(len(journal_header))
+			for number in range(count):
+				data = self.read_frame(journal)
+				if data == None:
+					return
+				yield json.loads(data.decode("utf-8"))
+
+	def import_proposal_logs(self):
+		""" Appends the proposals of old, one file per proposal, logs (``<date>_<time>.log``) to the journal,
+			oldest first. Their vote count wasn't logged, so it is ``None``.
+
+			:returns: The number of proposals imported.
+		"""
+		imported = 0
+
+		for path in sorted(glob.glob("{}/*_*.log".format(self.log_dir))):
+			(date, time) = os.path.basename(path)[:-len(".log")].split("_", 1)
+			with open(path, encoding="utf-8", errors="replace") as logfile:
+				lines = logfile.read().splitlines()
+			if not lines or not lines[0].startswith("["):
+				continue
+
+			self.append({
+				"legislated": "{}T{}".format(date, time),
+				"proposal": lines[0][1:-1],
+				"votes": None,
+				"context": lines[1:],
+			})
+			imported += 1
+
+		return imported
+
+def format_proposal(number, record):
+	return "#{} {} ({} votes) {}".format(number, record["legislated"], record["votes"], record["proposal"])
+
+def main(args=None):
+	import argparse
+
+	parser = argparse.ArgumentParser(description="List or read a channel's legislated proposals.")
+	parser.add_argument("channel", help="The channel, e.g. \"#osdev-offtopic\".")
+	parser.add_argument("number", type=int, nargs="?", help="Show this proposal (counting from 0; negative counts from the end) with its context.")
+	parser.add_argument("--import", dest="import_logs", action="store_true", help="Import old, one file per proposal, logs first. Only do this once.")
+	parser.add_argument("--network", metavar="NAME", help="Read the logs of this network (an [irc:NAME] section) instead of the default network's.")
+	options = parser.parse_args(args)
+
+	# Only importing writes to the journal. A mistyped channel must not leave a journal behind.
+	journal = ProposalJournal(options.channel, root=eunomialog.network_log_root(options.network), read_only=not options.import_logs)
+	if not os.path.exists(journal.journal_path):
+		print("No proposal journal at {}.".format(journal.journal_path))
+		return 1
+
+	if options.import_logs:
+		print("Imported {} proposal(s).".format(journal.import_proposal_logs()))
+
+	if options.number != None:
+		try:
+			record = journal.get(options.number)
+		except IndexError as error:
+			print(error)
+			return 1
+		print(format_proposal(options.number % len(journal), record))
+		for line in record["context"]:
+			print(line)
+	else:
+		for (number, record) in enumerate(journal):
+			print(format_proposal(number, record))
+
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
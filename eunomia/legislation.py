@@ -8,196 +8,328 @@
 """
 
 import logging
-import eunomialog
+import journal
+import logsetup
 
-from backlog import BacklogItem
+from backlog import FLOOD, JOIN, PART, QUIT, PUBMSG
+from clock import Clock
 
 from enum import Enum
 
 from re import compile as regex
 
-vote_matcher = regex(r'<[^>]+> (?:(?P<nick>\S+)[:,] )?:D(?:(?P<carots>\^+)|~(?P<ints>\d+)|~(?P<expr>.+))?$')
+# All of these match against the text of a message, without the "<nick> " prefix.
+vote_matcher = regex(r'(?:(?P<nick>\S+)[:,] )?:D(?:(?P<carots>\^+)|~(?P<ints>\d+)|~(?P<expr>.+))?$')
+npf_matcher = regex(r'(?:(\S+)[:,] )?(:)?D:')
+
+# Kinds of backlog lines that are skipped when legislating.
+ignored_kinds = frozenset((JOIN, PART, QUIT, FLOOD))
+
+# The backlog journaled with a passed proposal: from this many minutes before the proposal,
+# to this many minutes after the vote that passed it. The record is written once the second window has closed.
+context_minutes_before = 10
+context_minutes_after = 2
+# In a busy channel, the context is cut short: at most half of this many lines before the proposal,
+# and the record is written early, once it has this many lines in all.
+context_max_lines = 60
+
+def parse_vote(text):
+	""" Parses the text of a message, determines if it's a vote or not, and returns various information about the type of vote and its attributes.
+
+		This is called once per message, when its :class:`backlog.BacklogItem` is built. The result is cached in ``BacklogItem.vote``.
+
+		:param text: Message text to parse.
+		:type text: str
+		:returns: A tuple, containing nick (or None), and, if applicable, and a backreference index, if applicable. Alternatively, returns None if the message was not matched to a known form of vote.
+	"""
+	match = vote_matcher.match(text)
+	if match is None:
+		return None
+
+	match = match.groupdict()
+	if match['ints'] is not None:
+		return (match['nick'], int(match['ints']))
+	elif match['carots'] is not None:
+		return (match['nick'], len(match['carots']))
+	elif match['expr'] is not None:
+		pass
+
+	return (match['nick'], 0)
+
+class PassedProposal:
+	""" A proposal that passed, and whose record is waiting for the context after the vote. See :meth:`Legislation.legislate`.
+	"""
+	__slots__ = ("proposal", "backlog", "record", "votes", "closes", "context", "start_seq")
+
+	def __init__(self, proposal, backlog, record, votes, closes, start_seq):
+		self.proposal = proposal
+		self.backlog = backlog
+		self.record = record
+		# The votes it got, including the ones after it passed.
+		self.votes = votes
+		# The end of the context window, in seconds since the epoch.
+		self.closes = closes
+		# Context lines that were formatted before the backlog evicted them, and the first line that wasn't.
+		self.context = []
+		self.start_seq = start_seq
 
 class Legislation:
 	""" Class that contains all legislation related functions.
 
-		:param fhandler: Logging handler for output to a file.
-		:type fhandler: logging.FileHandler
-		:param shandler: Logging handler for output to a stream.
-		:type shandler: logging.StreamHandler
+		:param channel: The channel being legislated.
+		:type channel: str
+		:param proposal_journal: Where legislated proposals go. Defaults to the channel's :class:`journal.ProposalJournal`;
+			anything with a compatible ``append`` will do (see :mod:`replay`).
+		:type proposal_journal: journal.ProposalJournal
+		:param clock: The bot's clock, which is sampled once per event (see :mod:`clock`). Defaults to a clock of its own.
+		:type clock: clock.Clock
+		:param logger: Where the legislator's messages go. Defaults to the "Legislation" logger of the process'
+			:class:`logsetup.LogPipeline`.
+		:type logger: logging.Logger
 	"""
 
-	def __init__(self, fhandler, shandler, channel):
-		self.logger = logging.getLogger("Legislation")
-		self.logger.setLevel(logging.INFO)
-
-		self.logger.addHandler(fhandler)
-		self.logger.addHandler(shandler)
+	def __init__(self, channel, proposal_journal=None, clock=None, logger=None):
+		if logger == None:
+			logger = logsetup.get_pipeline().get_logger("Legislation")
+		self.logger = logger
 
 		self.logger.info("Init complete.")
 
 		self.active_proposal = None
+		self.run_proposal = None
+		# Set while old lines are replayed (see EunomiaBot.restore_backlogs). Proposals that pass while
+		# replaying were legislated before, so they only update the tally instead of being logged again.
+		self.replaying = False
 		self._votecount = 0
 		self.votecount = 0
 
-		self.proposal_logger = eunomialog.ProposalLogger(channel)
+		if proposal_journal == None:
+			proposal_journal = journal.ProposalJournal(channel)
+		self.proposal_journal = proposal_journal
+
+		self.own_clock = clock == None
+		self.clock = Clock() if clock == None else clock
+
+		# Proposals that passed, but whose records are not written yet (PassedProposal), oldest first.
+		self.pending = []
 
 	@property
 	def votecount(self):
 		return self._votecount
 	@votecount.setter
 	def votecount(self, value):
-		self.logger.debug("Votecount previously {}, now {}".format(self.votecount, value))
+		if self.logger.isEnabledFor(logging.DEBUG):
+			self.logger.debug("Votecount previously %d, now %d", self._votecount, value)
 		self._votecount = value
 	def is_non_proposal_filibuster(self, message):
-		""" Parses the message, determines if it is a filibustering non-proposal (D: or :D:)
+		""" Determines if the message is a filibustering non-proposal (D: or :D:)
 
-			:param message: Message to parse.
-			:type message: str
+			:param message: Message to check.
+			:type message: BacklogItem
 			:returns: True if the message is 'D:', ':D:', or 'nick: D:', etc.
 		"""
+		if message.kind != PUBMSG:
+			return False
 
-		npf_matcher = regex(r'<[^>]+> (?:(\S+)[:,] )?(:)?D:')
-		result = npf_matcher.match(message)
-
-		return False if result == None else True
+		return npf_matcher.match(message.text) != None
 
 	def is_ignored_message(self, message):
-		""" Parses the message, determines if it should be ignored (does not reset votecount, is not a proposal)
+		""" Determines if the message should be ignored (does not reset votecount, is not a proposal)
 
-			:param message: Message to parse.
-			:type message: strings
+			:param message: Message to check.
+			:type message: BacklogItem
 			:returns: True if the message should be ignored when legislating.
 		"""
+		return message.kind in ignored_kinds
 
-		jpq_matcher = regex(r'\*\*\* (Joins|Parts|Quits)')
-		result = jpq_matcher.match(message)
-
-		return False if result == None else True
+	def dereference_if_vote(self, message, backlog):
+		""" Updates the vote tally with the newest backlog message, and legislates the active proposal once it has enough votes.
 
-	def get_packed_vote_index(self, message):
-		""" Parses the message, determines if it's a vote or not, and returns various information about the type of vote and its attributes.
+			The tally is incremental: only ``message`` is classified, and the state carried between calls
+			(``votecount``, ``active_proposal`` and ``run_proposal``) replaces rescanning the backlog.
+			Because of this, **every** message appended to the backlog must be passed in, in order.
 
-			:param message: Message to parse.
-			:type message: str
-			:returns: A tuple, containing nick (or None), and, if applicable, and a backreference index, if applicable. Alternatively, returns None if the message was not matched to a known form of vote.
-		"""
-		match = vote_matcher.match(message)
-		if match is None:
-			return None
+			``active_proposal`` and ``run_proposal`` are sequence numbers (see :class:`backlog.Backlog`).
+			``run_proposal`` is the newest non-vote message, which a basic ``:D`` votes for.
 
-		match = match.groupdict()
-		if match['ints'] is not None:
-			return (match['nick'], int(match['ints']))
-		elif match['carots'] is not None:
-			return (match['nick'], len(match['carots']))
-		elif match['expr'] is not None:
-			pass
+			Lines appended after ``message`` (up to ``backlog.slack`` of them, see :class:`backlog.Backlog`) are not
+			seen yet: the vote is counted, and the context of passed proposals is taken, from the backlog as it was
+			when ``message`` was appended. So the journal doesn't depend on how the lines were batched.
 
-		return (match['nick'], 0)
+			:param message: A message already appended to the backlog: the newest one, or one of the last ``backlog.slack``.
+			:param backlog: The channel backlog.
+			:type message: BacklogItem
+			:type backlog: backlog.Backlog
+			:returns: The backlog.
+		"""
+		if self.pending:
+			self.flush_due(message.when, message.seq)
 
-	def dereference_if_vote(self, message, backlog):
-		# Step backwards, from newest to oldest messages, one at a time.
-		for i in range(len(backlog) - 1, -1, -1):
-			self.logger.debug("At backlog position " + str(i))
-			current_message = backlog[i].message
-			self.logger.debug("Current message=" + current_message)
+		if self.is_ignored_message(message):
+			return backlog
 
-			if current_message.startswith("*** Joins") or current_message.startswith("*** Parts") or current_message.startswith("*** Quits"):
-				continue
+		# Checked once per message. Nothing below builds a log message when DEBUG is off.
+		debug = self.logger.isEnabledFor(logging.DEBUG)
 
-			packed = self.get_packed_vote_index(current_message)
+		packed = message.vote
 
-			if packed == None:
+		if packed == None:
+			# Anything that isn't a vote ends the current run of votes, and may be voted on itself.
+			if debug:
 				self.logger.debug("packed==None")
-				self.votecount = 0
-				return backlog
+			self.votecount = 0
+			self.run_proposal = message.seq
+			return backlog
+
+		(nick, back_x) = packed
+		if nick == None:
+			if back_x == 0:
+				if debug:
+					self.logger.debug("Basic ':D'")
+				target = self.run_proposal
 			else:
-				(nick, back_x) = packed
-				if nick == None:
-					if back_x == 0:
-						self.logger.debug("Basic ':D'")
-						# Walk in reverse until we find a non-basic :D or a proposal.
-						for i in range(i, -1, -1):
-							d_packed = self.get_packed_vote_index(backlog[i].message)
-							if d_packed == None:
-								# It's a proposal.
-								if i == self.active_proposal:
-									self.votecount += 1
-								else:
-									self.votecount = 1
-									self.active_proposal = i
-									
-								break
-							(d_nick, d_back_x) = packed
-							if d_nick == None and d_back_x == 0:
-								# Basic :D, keep going.
-								continue
-							elif d_nick != None or d_back_x != 0:
-								# We ran into something else entirely. Probably a vote. Quit.
-								break
-					else:
-						self.logger.debug("':D~expr/:D~N'")
-						self.votecount += 1
+				if debug:
+					self.logger.debug("':D~expr/:D~N'")
+				target = self.active_proposal
+		else:
+			if debug:
+				self.logger.debug("'nick: :D'")
+			target = backlog.nick_message(nick, back_x, message.seq)
+
+		if not backlog.has_seq(target, message.seq):
+			if debug:
+				self.logger.debug("Vote target is not in the backlog. Ignoring.")
+			return backlog
+
+		for passed in self.pending:
+			if passed.proposal.seq == target:
+				passed.votes += 1
+
+		if target == self.active_proposal:
+			if debug:
+				self.logger.debug("Incrementing proposal.")
+			self.votecount += 1
+		else:
+			if debug:
+				self.logger.debug("Changing proposal. Setting votecount to 1.")
+			self.active_proposal = target
+			self.votecount = 1
+
+		if debug:
+			self.logger.debug("votecount=%d", self.votecount)
+			self.logger.debug("active_proposal=%s", self.active_proposal)
+		if self.votecount >= 3:
+			proposal = backlog.get(self.active_proposal, message.seq)
+			if proposal.can_legislate == True:
+				# self.legislate() sets self.votecount to 0, so we don't need to worry about it.
+				proposal.can_legislate = False
+				if self.replaying:
+					# Leave the tally the way legislate() would.
+					self.active_proposal = None
+					self.votecount = 0
 				else:
-					self.logger.debug("'nick: :D'")
-					nick_messages = 0
-					for i in range(len(backlog) - 1, -1, -1):
-						self.logger.debug("Indexing... ({})".format(str(i)))
-						message = backlog[i].message
-						if message.startswith("<{}>".format(nick)) or message.startswith("* {}".format(nick)) and (self.get_packed_vote_index(message) != None and back_x == 0):
-							self.logger.debug("Target \"{}\" found.".format(nick))
-							if nick_messages == back_x:
-								if i == self.active_proposal:
-									self.logger.debug("Incrementing proposal.")
-									self.votecount += 1
-								else:
-									self.logger.debug("Changing proposal. Setting votecount to 1.")
-									self.active_proposal = i
-									self.votecount = 1
-
-							nick_messages += 1
-
-			self.logger.debug("votecount=" + str(self.votecount))
-			self.logger.debug("active_proposal=" + str(self.active_proposal))
-			if self.votecount == 3:
-				if self.active_proposal == None:
-					self.active_proposal = len(backlog) - 1
-				if backlog[self.active_proposal].can_legislate == True:
-					# self.legislate() sets self.votecount to 0, so we don't need to worry about it.	
-					backlog[self.active_proposal].can_legislate = False
-					self.legislate(backlog[self.active_proposal], backlog[self.active_proposal - 25:])
-				return backlog
-
-		# Cleanup
-		self.votecount = 0
+					self.legislate(proposal, backlog, message)
+
 		return backlog
 
-	def legislate(self, message, context):
-		""" Legislates a given message and context, writes these to file ``pending_proposals.txt``
+	def legislate(self, message, backlog, vote=None):
+		""" Legislates a given message. Its record is written to the channel's :class:`journal.ProposalJournal` later,
+			once the context after the vote is in the backlog too (see :data:`context_minutes_after` and :meth:`flush_due`).
 
 			Does **not** check if there were sufficient votes - it is up to the caller to determine this **before** ``legislate`` is called.
 
 			:param message: The message that was legislated.
-			:param context: The 'context' (backlog, preferably including votes) around the legislated message.
-			:type message: str
-			:type context: list
+			:param backlog: The channel backlog.
+			:param vote: The vote that passed the message. Defaults to the newest line of the backlog.
+				The record's time, and its context, are those of the vote.
+			:type message: BacklogItem
+			:type backlog: backlog.Backlog
+			:type vote: BacklogItem
 		"""
 
-		self.logger.info("Legislation for proposal \"{}\" succeeded.".format(message.message))
+		self.logger.info("Legislation for proposal \"%s\" succeeded.", message.message)
+
+		if vote == None:
+			vote = backlog.get(backlog.last_seq)
+		if self.own_clock:
+			self.clock.sample()
+
+		record = {
+			"legislated": self.clock.isoformat(vote.when),
+			"time": self.clock.format_time(message.timestamp),
+			"nick": message.nick,
+			"proposal": message.message,
+			"votes": None,
+			"context": None,
+		}
+		# Found with a binary search over the item times, nothing is copied.
+		start_seq = max(backlog.time_bounds(message.when - context_minutes_before * 60, as_of=vote.seq)[0], message.seq - context_max_lines // 2)
+		closes = vote.when + context_minutes_after * 60
+		passed = PassedProposal(message, backlog, record, self.votecount, closes, start_seq)
+		self.pending.append(passed)
+		self.keep_context(passed, vote.seq)
 
-		# NOTE: RolloverLogger (which ProposalLogger inherits) writes lists item-by-item, with a newline after each.
-		# So we don't need to append newlines here.
+		self.active_proposal = None
+		self.votecount = 0
 
-		# Because BacklogItems are used now, just unpack the 'message' field.
-		raw_message = message.message
+	def flush_due(self, now, as_of=None):
+		""" Writes the records of the passed proposals whose context window closed before ``now``
+			(or that already have :data:`context_max_lines` lines of context).
 
-		output = []
-		output.append("[{}]".format(raw_message))
-		for line in context:
-			output.append("{} {}".format(line.timestamp, line.message))
+			The context of the others stays in the backlog. Only lines that the backlog is about to evict are formatted
+			and kept with the proposal, so a busy channel (or a small backlog) doesn't lose any context.
 
-		self.proposal_logger.append(output)
+			:param now: The current time, in seconds since the epoch.
+			:param as_of: The sequence number of the line being legislated. Lines after it aren't context yet.
+				Defaults to the newest line of the backlog.
+			:type now: float
+			:type as_of: int
+		"""
+		for passed in list(self.pending):
+			end_seq = passed.backlog.next_seq if as_of == None else as_of + 1
+			if now <= passed.closes and len(passed.context) + end_seq - passed.start_seq < context_max_lines:
+				self.keep_context(passed, as_of)
+				continue
 
-		self.active_proposal = None
-		self.votecount = 0
+			self.pending.remove(passed)
+			self.write(passed, as_of)
+
+	def keep_context(self, passed, as_of=None):
+		""" Formats the context lines of a passed proposal if the line after ``as_of`` (see :meth:`flush_due`)
+			evicts the first of them.
+		"""
+		backlog = passed.backlog
+		end_seq = backlog.next_seq if as_of == None else as_of + 1
+		if end_seq >= backlog.capacity and end_seq - backlog.capacity >= passed.start_seq:
+			passed.context.extend(self.context_lines(backlog, passed.start_seq, min(end_seq, passed.start_seq + context_max_lines - len(passed.context))))
+			passed.start_seq = end_seq
+
+	def flush(self):
+		""" Writes the records of all passed proposals now, with whatever context there is so far.
+			Called before the legislator is replaced or the bot shuts down.
+		"""
+		pending = self.pending
+		self.pending = []
+		for passed in pending:
+			self.write(passed)
+
+	def write(self, passed, as_of=None):
+		""" Completes a passed proposal's record with its votes and context, and appends it to the journal.
+
+			:param as_of: As for :meth:`flush_due`.
+			:type passed: PassedProposal
+			:type as_of: int
+		"""
+		end_seq = min(passed.backlog.time_bounds(None, passed.closes, as_of)[1], passed.start_seq + context_max_lines - len(passed.context))
+
+		record = passed.record
+		record["votes"] = passed.votes
+		record["context"] = passed.context + self.context_lines(passed.backlog, passed.start_seq, end_seq)
+
+		number = self.proposal_journal.append(record)
+		self.logger.info("Recorded \"%s\" as proposal #%d.", record["proposal"], number)
+
+	def context_lines(self, backlog, start_seq, end_seq):
+		""" Formats backlog lines for a record, as ``HH:MM:SS <line>``.
+		"""
+		return ["{} {}".format(self.clock.format_time(line.timestamp), line.message) for line in backlog.range(start_seq, end_seq)]
@@ -0,0 +1,242 @@
+"""
+.. module:: loadtest
+	:platform: Unix
+	:synopsis: End-to-end load test of a real EunomiaBot against a local fake IRC server.
+
+Unlike :mod:`benchmark`, this goes through everything: the socket, the reactor of
+:class:`irc.bot.SingleServerIRCBot`, decoding (with ``errors = "replace"``, as in ``__main__``),
+the handlers and the channel log on disk.
+
+Traffic is offered at increasing rates. For every rate it reports the rate at which lines reached the channel log,
+and the end-to-end lag from the fake server sending a line to the line appearing in the log.
+The first rate at which the bot falls behind is reported as the saturation point.
+
+Run it from the repository root::
+
+	python eunomia/loadtest.py
+	python eunomia/loadtest.py --rates 500,1000,2000 --duration 10 --users 200 --writer thread
+	python eunomia/loadtest.py --replay logs/channel/#osdev-offtopic/2016-08-01.log
+
+"""
+
+import argparse
+import itertools
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import bot
+import eunomialog
+import traffic
+from fakeserver import FakeIRCServer
+
+class LogTailer:
+	""" Follows a log file from a thread, and records when each line after a sync line appeared.
+
+		:param path: The log file to follow.
+		:param sync_line: Lines up to and including the first one that ends with this are not recorded.
+		:type path: str
+		:type sync_line: str
+	"""
+	def __init__(self, path, sync_line):
+		self.path = path
+		self.sync_line = sync_line
+
+		self.synced = threading.Event()
+		# Arrival time of every line after the sync line, in order.
+		self.arrivals = []
+		self.stopping = False
+
+		self.thread = threading.Thread(target=self.run, name="LogTailer", daemon=True)
+		self.thread.start()
+
+	def run(self):
+		while not os.path.exists(self.path):
+			time.sleep(0.001)
+
+		partial = ""
+		with open(self.path, errors="replace") as logfile:
+			while not self.stopping:
+				chunk = logfile.readline()
+				if not chunk:
+					time.sleep(0.0005)
+					continue
+
+				partial += chunk
+				if not partial.endswith("\n"):
+					# Half a line so far. Wait for the rest.
+					continue
+
+				line = partial.rstrip("\n")
+				partial = ""
+
+				if self.synced.is_set():
+					self.arrivals.append(time.monotonic())
+				elif line.endswith(self.sync_line):
+					self.synced.set()
+
+	def stop(self):
+		self.stopping = True
+		self.thread.join()
+
+def percentile(sorted_values, fraction):
+	if not sorted_values:
+		return 0
+	return sorted_values[min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))]
+
+def offer(server, channel, events, rate, sent_times):
+	""" Sends ``events`` to the bot at ``rate`` events per second, recording the send time of each one.
+	"""
+	started = time.monotonic()
+	sent = 0
+
+	while sent < len(events):
+		now = time.monotonic()
+		due = min(len(events), int((now - started) * rate) + 1)
+		if due > sent:
+			server.send_events(events[sent:due], channel)
+			sent_times.extend([now] * (due - sent))
+			sent = due
+		else:
+			time.sleep(0.0005)
+
+def run_step(server, tailer, channel, events, rate, sent_times, lag_limit, drain_timeout):
+	""" Offers one rate and measures how the bot kept up.
+
+		:returns: A dict with the results of the step.
+	"""
+	first = len(sent_times)
+	offer(server, channel, events, rate, sent_times)
+	last = len(sent_times)
+
+	# Give the bot a chance to catch up before measuring.
+	deadline = time.monotonic() + drain_timeout
+	while len(tailer.arrivals) < last and time.monotonic() < deadline:
+		time.sleep(0.005)
+
+	arrivals = tailer.arrivals[first:last]
+	lags = sorted(arrivals[i] - sent_times[first + i] for i in range(len(arrivals)))
+	unlogged = (last - first) - len(arrivals)
+
+	if arrivals:
+		logged_rate = len(arrivals) / max(arrivals[-1] - sent_times[first], 1e-9)
+	else:
+		logged_rate = 0.0
+
+	# A bot that can't keep up builds a queue, so its lag keeps growing for as long as the step lasts,
+	# and lines trickle into the log slower than they were offered. The rate check is generous because
+	# a batching log writer makes the logged rate jumpy on short steps.
+	p99 = percentile(lags, 0.99)
+	behind = unlogged > 0 or p99 > lag_limit or logged_rate < rate * 0.75
+
+	return {
+		"rate": rate,
+		"events": last - first,
+		"logged_rate": logged_rate,
+		"lag_p50_ms": percentile(lags, 0.50) * 1000,
+		"lag_p99_ms": p99 * 1000,
+		"lag_max_ms": (lags[-1] if lags else 0) * 1000,
+		"unlogged": unlogged,
+		"behind": behind,
+	}
+
+def main(args=None):
+	parser = argparse.ArgumentParser(description="Load test a real EunomiaBot against a local fake IRC server.")
+	parser.add_argument("--rates", default="100,250,500,1000,2000,4000,8000", help="Comma separated list of offered rates (events/s), tried in order.")
+	parser.add_argument("--duration", type=float, default=5, help="Seconds of traffic per rate.")
+	parser.add_argument("--users", type=int, default=50, help="Number of simulated users.")
+	parser.add_argument("--pattern", choices=sorted(traffic.generators), default="mixed", help="Generated traffic pattern.")
+	parser.add_argument("--replay", metavar="LOGFILE", help="Replay the traffic recorded in a channel log (or its archive) instead of generating it.")
+	parser.add_argument("--writer", choices=("sync", "thread"), default="sync", help="How channel logs are written (blocking runtime only).")
+	parser.add_argument("--runtime", choices=("blocking", "asyncio"), default="blocking", help="Run the bot on the blocking reactor, or on asyncio (see aiobot).")
+	parser.add_argument("--lag-limit", type=float, default=1.0, help="p99 lag (seconds) above which the bot counts as falling behind.")
+	parser.add_argument("--keep-going", action="store_true", help="Keep trying higher rates after the bot fell behind.")
+	options = parser.parse_args(args)
+
+	channel = "#loadtest"
+	rates = [float(rate) for rate in options.rates.split(",")]
+
+	if options.replay != None:
+		recorded = traffic.from_log(options.replay)
+		if not recorded:
+			print("No replayable lines in \"{}\".".format(options.replay))
+			return 1
+		source = itertools.cycle(recorded)
+	else:
+		source = iter(traffic.generate(options.pattern, int(sum(rates) * options.duration), options.users))
+
+	work_dir = tempfile.mkdtemp(prefix="eunomia-load-")
+	old_cwd = os.getcwd()
+	eunomialog.log_root = work_dir + "/logs"
+	os.chdir(work_dir)
+
+	server = FakeIRCServer()
+
+	if options.runtime == "asyncio":
+		import aiobot
+		bot_inst = aiobot.AioEunomiaBot(channel, "eunomia", server.host, "eunomia loadtest", None, server.port)
+		log_writer = bot_inst.log_writer
+	else:
+		log_writer = eunomialog.LogWriter() if options.writer == "thread" else None
+		bot_inst = bot.EunomiaBot(channel, "eunomia", server.host, "eunomia loadtest", None, server.port, log_writer)
+	bot_inst.connection.buffer_class.errors = "replace"
+	bot_inst.stream_log_handler.setLevel(logging.WARNING)
+	threading.Thread(target=bot_inst.start, name="EunomiaBot", daemon=True).start()
+
+	try:
+		if not server.wait_for_join(channel):
+			print("The bot did not join {} on the fake server.".format(channel))
+			return 1
+
+		# Every event turns into exactly one channel log line, so after a sync line,
+		# the n-th line in the log belongs to the n-th event sent.
+		sync_text = "loadtest sync {}".format(time.time())
+		tailer = LogTailer(bot_inst.get_channel_state(channel).channel_logger.log_filename, "<loadtest> " + sync_text)
+		server.send_events([("pubmsg", "loadtest", [sync_text])], channel)
+		if not tailer.synced.wait(10):
+			print("The sync line never reached the channel log.")
+			return 1
+
+		print("{:>9} {:>9} {:>12} {:>12} {:>12} {:>12} {:>9}".format("offered/s", "events", "logged/s", "lag p50 ms", "lag p99 ms", "lag max ms", "unlogged"))
+
+		sent_times = []
+		sustainable = None
+		saturation = None
+
+		for rate in rates:
+			events = list(itertools.islice(source, int(rate * options.duration)))
+			results = run_step(server, tailer, channel, events, rate, sent_times, options.lag_limit, options.lag_limit + 5)
+
+			print("{rate:>9.0f} {events:>9} {logged_rate:>12.0f} {lag_p50_ms:>12.1f} {lag_p99_ms:>12.1f} {lag_max_ms:>12.1f} {unlogged:>9}".format(**results))
+
+			if results["behind"]:
+				if saturation == None:
+					saturation = rate
+				if not options.keep_going:
+					break
+			elif saturation == None:
+				sustainable = rate
+
+		tailer.stop()
+
+		if sustainable != None:
+			print("Sustainable rate: at least {:.0f} events/s".format(sustainable))
+		if saturation != None:
+			print("Falls behind at: {:.0f} events/s offered".format(saturation))
+		else:
+			print("Kept up with every offered rate.")
+	finally:
+		server.close()
+		if log_writer != None:
+			log_writer.close()
+		os.chdir(old_cwd)
+		shutil.rmtree(work_dir, ignore_errors=True)
+
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
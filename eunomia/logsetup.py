@@ -0,0 +1,83 @@
+"""
+.. module:: logsetup
+	:platform: Unix
+	:synopsis: The bot's own logging (``eunomia.log`` and the console), written from a listener thread.
+
+The bot's loggers (``EunomiaBot``, ``Legislation``, ``SendQueue``, ``LogWriter`` and ``Archiver``)
+only have a :class:`logging.handlers.QueueHandler`. It puts records on a queue, and a :class:`logging.handlers.QueueListener`
+thread formats them and writes them to the file and the stream, so neither the formatting nor the I/O happens on the IRC thread.
+
+There is one :class:`LogPipeline` per process (see :func:`get_pipeline`): every bot, and every legislator
+(including the new ones ``reload-legislation`` makes), share its handlers instead of adding their own.
+What is still queued is written when the process exits.
+
+(Channel and proposal logs are something else, see :mod:`eunomialog`.)
+
+"""
+
+import atexit
+import logging
+import logging.handlers
+import queue
+
+log_format = "[%(asctime)s] [%(name)s.%(funcName)s] [%(levelname)-5.5s]: %(message)s"
+date_format = "%Y-%m-%d %H:%M:%S"
+
+class LogPipeline:
+	""" A queue handler for the loggers, and the listener that writes what it queues.
+
+		:param filename: The file to append to.
+		:type filename: str
+	"""
+	def __init__(self, filename="eunomia.log"):
+		formatter = logging.Formatter(log_format, date_format)
+
+		self.file_handler = logging.FileHandler(filename)
+		self.file_handler.setFormatter(formatter)
+		self.stream_handler = logging.StreamHandler()
+		self.stream_handler.setFormatter(formatter)
+
+		self.queue = queue.SimpleQueue()
+		self.queue_handler = logging.handlers.QueueHandler(self.queue)
+
+		# Respecting the handler levels lets e.g. the console be quieter than the file (see stubirc.make_bot()).
+		self.listener = logging.handlers.QueueListener(self.queue, self.file_handler, self.stream_handler, respect_handler_level=True)
+		self.listener.start()
+		self.closed = False
+
+	def get_logger(self, name, level=logging.INFO):
+		""" Gets a logger that logs through this pipeline. Safe to call any number of times for the same name.
+
+			:param name: The logger name.
+			:param level: The logger's level.
+			:type name: str
+			:type level: int
+		"""
+		logger = logging.getLogger(name)
+		logger.setLevel(level)
+		if self.queue_handler not in logger.handlers:
+			logger.addHandler(self.queue_handler)
+		return logger
+
+	def close(self):
+		""" Writes out everything that is still queued, then closes the file. Safe to call more than once.
+		"""
+		if self.closed:
+			return
+		self.closed = True
+
+		self.listener.stop()
+		self.file_handler.close()
+
+_pipeline = None
+
+def get_pipeline():
+	""" Gets the process' :class:`LogPipeline`, starting it on first use.
+	"""
+	global _pipeline
+
+	if _pipeline == None:
+		_pipeline = LogPipeline()
+		atexit.register(_pipeline.close)
+
+	return _pipeline
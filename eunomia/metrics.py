@@ -0,0 +1,184 @@
+"""
+.. module:: metrics
+	:platform: Unix
+	:synopsis: Lightweight hot-path instrumentation: counters, latency histograms and gauges.
+
+Instrumentation is attached by wrapping methods on individual instances (see :meth:`Metrics.instrument`).
+When metrics are disabled nothing is wrapped, so the hot path runs exactly the code it would without this module.
+
+"""
+
+import bisect
+import functools
+import json
+import os
+import time
+
+# Upper bounds (in seconds) of the latency histogram buckets: 1us, 2us, 4us, ... ~16.8s.
+# Anything slower ends up in one last overflow bucket.
+bucket_bounds = tuple(1e-6 * 2 ** i for i in range(25))
+
+class Histogram:
+	""" A latency histogram with fixed, power-of-two buckets.
+	"""
+	def __init__(self):
+		self.buckets = [0] * (len(bucket_bounds) + 1)
+		self.count = 0
+		self.total = 0.0
+		self.max = 0.0
+
+	def observe(self, seconds):
+		self.buckets[bisect.bisect_left(bucket_bounds, seconds)] += 1
+		self.count += 1
+		self.total += seconds
+		if seconds > self.max:
+			self.max = seconds
+
+	def percentile(self, fraction):
+		""" Estimates a percentile, as the upper bound of the bucket it falls in.
+
+			:param fraction: The percentile, between 0 and 1.
+			:type fraction: float
+			:returns: The estimate in seconds, or 0 if nothing was observed.
+		"""
+		if self.count == 0:
+			return 0.0
+
+		rank = fraction * self.count
+		seen = 0
+		for (i, in_bucket) in enumerate(self.buckets):
+			seen += in_bucket
+			if seen >= rank and in_bucket:
+				return bucket_bounds[i] if i < len(bucket_bounds) else self.max
+
+		return self.max
+
+	def to_dict(self):
+		return {
+			"count": self.count,
+			"mean": self.total / self.count if self.count else 0.0,
+			"p50": self.percentile(0.50),
+			"p99": self.percentile(0.99),
+			"max": self.max,
+			"buckets": {"{:g}".format(bound): n for (bound, n) in zip(bucket_bounds + (float("inf"),), self.buckets) if n},
+		}
+
+class Metrics:
+	""" A registry of counters, latency histograms and gauges.
+	"""
+	def __init__(self):
+		self.started = time.time()
+		self.counters = {}
+		self.histograms = {}
+		# Gauge name -> function returning the current value. Evaluated only when the metrics are read.
+		self.gauges = {}
+
+	def count(self, name, n=1):
+		self.counters[name] = self.counters.get(name, 0) + n
+
+	def observe(self, name, seconds):
+		histogram = self.histograms.get(name)
+		if histogram == None:
+			histogram = self.histograms[name] = Histogram()
+		histogram.observe(seconds)
+
+	def gauge(self, name, function):
+		""" Registers (or replaces) a gauge.
+
+			:param name: The gauge name.
+			:param function: Called without arguments whenever the metrics are read.
+			:type name: str
+			:type function: callable
+		"""
+		self.gauges[name] = function
+
+	def instrument(self, obj, method_name, name):
+		""" Wraps a method of one instance, so each call is counted and its latency recorded under ``name``.
+
+			The wrapper is set as an instance attribute, so the class (and every other instance) is left alone.
+			Instrumenting the same method of the same instance twice is a no-op.
+
+			:param obj: The instance.
+			:param method_name: The name of the method to wrap.
+			:param name: The histogram name.
+			:type method_name: str
+			:type name: str
+		"""
+		method = getattr(obj, method_name)
+		if getattr(method, "_metrics_instrumented", False):
+			return
+
+		histogram = self.histograms.get(name)
+		if histogram == None:
+			histogram = self.histograms[name] = Histogram()
+		observe = histogram.observe
+		perf = time.perf_counter
+
+		@functools.wraps(method)
+		def wrapper(*args, **kwargs):
+			started = perf()
+			try:
+				return method(*args, **kwargs)
+			finally:
+				observe(perf() - started)
+
+		wrapper._metrics_instrumented = True
+		setattr(obj, method_name, wrapper)
+
+	def read_gauges(self):
+		values = {}
+		for (name, function) in self.gauges.items():
+			try:
+				values[name] = function()
+			except Exception:
+				values[name] = None
+		return values
+
+	def snapshot(self):
+		""" Gets every metric as a JSON-serializable dict.
+		"""
+		return {
+			"time": time.time(),
+			"uptime": time.time() - self.started,
+			"counters": dict(self.counters),
+			"gauges": self.read_gauges(),
+			"histograms": {name: histogram.to_dict() for (name, histogram) in self.histograms.items()},
+		}
+
+	def summary(self, histogram_names=None, with_gauges=True):
+		""" Summarizes the metrics on one line: the number of events, the percentiles of some histograms, and the gauges.
+
+			With every gauge (there are several per channel), the line is too long for an IRC reply. Leave them out,
+			and only include a few histograms, for one. :meth:`dump` has everything.
+
+			:param histogram_names: Histograms to include. Defaults to all that have observations.
+			:param with_gauges: Include the gauges.
+			:type histogram_names: list
+			:type with_gauges: bool
+		"""
+		parts = []
+
+		events = sum(n for (name, n) in self.counters.items() if name.startswith("events."))
+		parts.append("{} events in {:.0f}s".format(events, time.time() - self.started))
+
+		if histogram_names == None:
+			histogram_names = sorted(name for (name, histogram) in self.histograms.items() if histogram.count)
+		for name in histogram_names:
+			histogram = self.histograms.get(name)
+			if histogram == None or histogram.count == 0:
+				continue
+			parts.append("{} n={} p50={:.0f}us p99={:.0f}us".format(name, histogram.count, histogram.percentile(0.5) * 1e6, histogram.percentile(0.99) * 1e6))
+
+		if with_gauges:
+			for (name, value) in sorted(self.read_gauges().items()):
+				parts.append("{}={}".format(name, value))
+
+		return " | ".join(parts)
+
+	def dump(self, path):
+		""" Writes a snapshot to ``path`` as JSON. The file is replaced atomically, so readers never see half a dump.
+		"""
+		temp_path = path + ".tmp"
+		with open(temp_path, "w") as dump_file:
+			json.dump(self.snapshot(), dump_file, indent=1, sort_keys=True)
+		os.replace(temp_path, path)
@@ -0,0 +1,129 @@
+"""
+.. module:: networks
+	:platform: Unix
+	:synopsis: Serving several IRC networks from one process, with one shared reactor.
+
+Every network gets its own :class:`bot.EunomiaBot` (its own connection, nick, ident, channels, backlogs and
+log tree, see :func:`eunomialog.network_log_root`), but all of them are built on one reactor from this module.
+The reactor selects on every network's socket at once (or, for the asyncio runtime, runs on one event loop),
+and has one scheduler for every bot's timers. The log writer, the archiver and the metrics registry are shared too,
+so an extra network only costs its connection and its channels' state, not another loop, thread or set of files.
+
+An irc library reactor calls every global handler for every event, whichever connection it came in on.
+:class:`RoutingMixin` keeps the handlers of each bot apart instead: a handler that is a bound method of a bot
+(or of a connection) only gets the events of that bot's connection. Finding a connection's handlers is a dict lookup,
+so the work per event does not grow with the number of networks. The handlers of each connection and event type are
+merged and sorted once, when the first such event comes in, and again only after a handler was added or removed.
+
+"""
+
+import signal
+import sys
+
+import irc.client
+
+def handler_connection(callback):
+	""" Finds the connection a handler belongs to.
+
+		:returns: The connection, if the handler is a bound method of a connection or of a bot. Otherwise ``None``.
+	"""
+	owner = getattr(callback, "__self__", None)
+	if isinstance(owner, irc.client.ServerConnection):
+		return owner
+	return getattr(owner, "connection", None)
+
+class RoutingMixin:
+	""" Makes a reactor deliver events only to the handlers of the connection they came in on.
+		See the module description.
+
+		Handlers of no particular connection (e.g. the irc library's ``ping`` handler) are in ``self.handlers``,
+		as usual, and get every event.
+	"""
+	def __init__(self, *args, **kwargs):
+		# Connection -> (event type -> sorted list of irc.client.PrioritizedHandler).
+		self.connection_handlers = {}
+		# (connection, event type) -> what matching_handlers() returns. Cleared whenever a handler is added or removed.
+		self.merged_handlers = {}
+		super().__init__(*args, **kwargs)
+
+	def add_global_handler(self, event, handler, priority=0):
+		connection = handler_connection(handler)
+		if connection == None:
+			super().add_global_handler(event, handler, priority)
+			self.merged_handlers.clear()
+			return
+
+		with self.mutex:
+			handlers = self.connection_handlers.setdefault(connection, {}).setdefault(event, [])
+			handlers.append(irc.client.PrioritizedHandler(priority, handler))
+			handlers.sort()
+			self.merged_handlers.clear()
+
+	def remove_global_handler(self, event, handler):
+		connection = handler_connection(handler)
+		if connection == None:
+			removed = super().remove_global_handler(event, handler)
+			self.merged_handlers.clear()
+			return removed
+
+		with self.mutex:
+			handlers = self.connection_handlers.get(connection, {}).get(event, [])
+			handlers[:] = [h for h in handlers if h.callback != handler]
+			self.merged_handlers.clear()
+		return 1
+
+	def matching_handlers(self, connection, event):
+		""" Gets the handlers of an event, in priority order. The list is shared, and must not be changed.
+		"""
+		key = (connection, event.type)
+		handlers = self.merged_handlers.get(key)
+		if handlers == None:
+			own_handlers = self.connection_handlers.get(connection, {})
+			handlers = self.merged_handlers[key] = sorted(self.handlers.get("all_events", []) + self.handlers.get(event.type, [])
+				+ own_handlers.get("all_events", []) + own_handlers.get(event.type, []))
+		return handlers
+
+class SharedReactor(RoutingMixin, irc.client.Reactor):
+	""" The blocking runtime's reactor for several networks: one select() over all of their sockets.
+	"""
+	def _handle_event(self, connection, event):
+		with self.mutex:
+			for handler in self.matching_handlers(connection, event):
+				if handler.callback(connection, event) == "NO MORE":
+					return
+
+def serve(bots):
+	""" Connects every bot, and runs their (shared) reactor forever.
+
+		SIGTERM and SIGINT shut all of them down together, see :func:`shutdown`.
+
+		:param bots: The bots, all built on the same reactor.
+		:type bots: list
+	"""
+	def shutdown_handler(signum, frame):
+		bots[0].logger.info("SIGTERM or SIGINT caught. (signum %d)", signum)
+		shutdown(bots)
+
+	signal.signal(signal.SIGTERM, shutdown_handler)
+	signal.signal(signal.SIGINT, shutdown_handler)
+
+	for bot_inst in bots:
+		bot_inst._connect()
+	bots[0].reactor.process_forever()
+
+def shutdown(bots):
+	""" :meth:`bot.EunomiaBot.shutdown` for bots that share their log writer and archiver: every bot's channels are
+		closed first, then the shared resources (once each), then the process exits.
+	"""
+	for bot_inst in bots:
+		bot_inst.close_channels()
+
+	closed = []
+	for bot_inst in bots:
+		for resource in (bot_inst.log_writer, bot_inst.archiver):
+			if resource != None and not any(resource is other for other in closed):
+				resource.close()
+				closed.append(resource)
+
+	bots[0].logger.info("Shutting down.")
+	sys.exit(0)
@@ -0,0 +1,180 @@
+"""
+.. module:: pipeline
+	:platform: Unix
+	:synopsis: The staged event pipeline: channel lines are handled in batches, one stage at a time.
+
+The ``on_*`` handlers of :class:`bot.EunomiaBot` only take what they need from an event (the channel, the nick,
+the arguments and the time of the event) and queue it as a :class:`Line`. The lines queued while the reactor
+handles the data of one socket read are drained together, once per reactor tick: the first line queued schedules
+:meth:`Pipeline.drain` on ``reactor.scheduler`` without a delay, which runs right after the events of the tick
+(in the blocking runtime, ``process_timeout`` runs the scheduler after ``process_data``; with asyncio,
+``loop.call_later(0, ...)`` runs after the protocol's callback).
+
+A drain runs the batch through every stage in turn, and each stage gets (and returns) the whole batch.
+The bot's stages are (see :meth:`bot.EunomiaBot.add_stages`):
+
+* ``normalize``: the line is formatted, parsed (votes and commands) and built into a :class:`backlog.BacklogItem`,
+* ``backlog``: the flood filter has its say, and the line is appended to its channel's backlog,
+* ``persist``: the lines of each channel are written to its channel log (and search index) at once,
+* ``legislate``: the lines are fed to their channels' legislators, in order,
+* ``respond``: commands are answered.
+
+Stages are plain functions, and can be added, replaced or removed by name. If metrics are enabled, every stage
+is timed on every batch: the times go in histograms (see :class:`metrics.Histogram`) named ``pipeline.<stage>``,
+in the bot's metrics registry. Otherwise nothing is timed, and :mod:`metrics` isn't even imported.
+
+A batch holds at most ``max_batch`` lines; a larger drain runs several batches. Backlogs keep their last
+``max_batch`` evicted items around (see :class:`backlog.Backlog`), so the legislate stage still sees every
+line's backlog as it was when the line was appended, though the whole batch was appended before.
+
+"""
+
+import time
+
+class Line:
+	""" A channel line on its way through the pipeline.
+
+		:param state: The channel the line belongs to.
+		:param kind: The kind of line, e.g. ``backlog.PUBMSG``.
+		:param nick: The nick that caused the line.
+		:param arguments: What else the normalize stage needs from the event, e.g. the message text.
+		:param timestamp: The time of the event (see :attr:`clock.Clock.timestamp`).
+		:param when: The same, in seconds since the epoch.
+		:type state: channelstate.ChannelState
+		:type kind: str
+		:type nick: str
+		:type arguments: tuple
+		:type timestamp: datetime.time
+		:type when: float
+	"""
+	__slots__ = ("state", "kind", "nick", "arguments", "timestamp", "when", "item", "command", "offset")
+
+	def __init__(self, state, kind, nick, arguments, timestamp, when):
+		self.state = state
+		self.kind = kind
+		self.nick = nick
+		self.arguments = arguments
+		self.timestamp = timestamp
+		self.when = when
+		# Set by the stages: the backlog.BacklogItem, the (command, arguments) the line asks of the bot,
+		# and the offset of the line in the channel log (only if there is a search index).
+		self.item = None
+		self.command = None
+		self.offset = None
+
+class Pipeline:
+	""" Queued lines, and the stages they are drained through. See the module description.
+
+		:param scheduler: Runs the drains, e.g. ``reactor.scheduler``. ``None`` if the caller drains the pipeline itself.
+		:param max_batch: The maximum number of lines in one batch.
+		:param histograms: Where the stage timings go, e.g. :attr:`metrics.Metrics.histograms`.
+			``None`` if the stages aren't timed.
+		:type scheduler: irc.schedule.IScheduler
+		:type max_batch: int
+		:type histograms: dict
+	"""
+	def __init__(self, scheduler, max_batch=32, histograms=None):
+		if max_batch < 1:
+			raise ValueError("A pipeline batch needs room for at least one line.")
+
+		self.scheduler = scheduler
+		self.max_batch = max_batch
+		self.histograms = histograms
+
+		# (name, function, histogram), in order. The histogram is None if the stages aren't timed.
+		self.stages = []
+
+		self.queue = []
+		# Whether a drain is scheduled.
+		self.drain_pending = False
+
+		# Totals, for metrics.
+		self.batches = 0
+		self.lines = 0
+
+	def stage_names(self):
+		return [name for (name, function, histogram) in self.stages]
+
+	def stage_index(self, name):
+		for (i, stage) in enumerate(self.stages):
+			if stage[0] == name:
+				return i
+		raise KeyError("No pipeline stage named \"{}\".".format(name))
+
+	def add_stage(self, name, function, before=None):
+		""" Adds a stage.
+
+			:param name: The stage's name, which its timings are recorded under.
+			:param function: Called with every batch (a list of :class:`Line`). Returns the batch for the next stage,
+				which may leave lines out, or add some.
+			:param before: The name of the stage to add it before. Defaults to the end of the pipeline.
+			:type name: str
+			:type function: function
+			:type before: str
+		"""
+		histogram = None
+		if self.histograms != None:
+			histogram_name = "pipeline." + name
+			histogram = self.histograms.get(histogram_name)
+			if histogram == None:
+				# Only imported with a metrics registry, so it costs nothing on startup otherwise.
+				from metrics import Histogram
+				histogram = self.histograms[histogram_name] = Histogram()
+
+		index = len(self.stages) if before == None else self.stage_index(before)
+		self.stages.insert(index, (name, function, histogram))
+
+	def replace_stage(self, name, function):
+		""" Replaces the function of a stage, keeping its place and its timings.
+		"""
+		index = self.stage_index(name)
+		self.stages[index] = (name, function, self.stages[index][2])
+
+	def remove_stage(self, name):
+		del self.stages[self.stage_index(name)]
+
+	def put(self, line):
+		""" Queues a line, and schedules a drain if there isn't one yet.
+
+			:type line: Line
+		"""
+		self.queue.append(line)
+		if not self.drain_pending and self.scheduler != None:
+			self.drain_pending = True
+			self.scheduler.execute_after(0, self.drain)
+
+	def drain(self):
+		""" Runs every queued line through the stages, ``max_batch`` lines at a time.
+		"""
+		self.drain_pending = False
+		while self.queue:
+			batch = self.queue[:self.max_batch]
+			del self.queue[:self.max_batch]
+			self.run(batch)
+
+	def run(self, batch, first_stage=None):
+		""" Runs a batch through the stages, timing each of them.
+
+			:param batch: The lines.
+			:param first_stage: The name of the stage to start at. Defaults to the first one.
+			:type batch: list
+			:type first_stage: str
+		"""
+		start = 0 if first_stage == None else self.stage_index(first_stage)
+
+		self.batches += 1
+		self.lines += len(batch)
+
+		if self.histograms == None:
+			for (name, function, histogram) in self.stages[start:]:
+				batch = function(batch)
+			return
+
+		perf = time.perf_counter
+		started = perf()
+		for (name, function, histogram) in self.stages[start:]:
+			batch = function(batch)
+			# Each stage ends when the next one starts.
+			ended = perf()
+			histogram.observe(ended - started)
+			started = ended
@@ -0,0 +1,188 @@
+"""
+.. module:: replay
+	:platform: Unix
+	:synopsis: Re-runs legislation over historical channel logs, and compares the result with the proposal journal.
+
+Useful to see how a change to :mod:`legislation` (``vote_matcher``, ``dereference_if_vote``, ...)
+would have scored the past. Every day of a channel's logs (plain or archived, see :mod:`archive`) is streamed through
+:func:`backlog.parse_log_line`, turned into :class:`backlog.BacklogItem` objects and fed to a fresh
+:class:`legislation.Legislation`, whose proposals are collected instead of journaled.
+Each day starts with the tail of the day before it in the backlog, the way a warm restart
+(:meth:`bot.EunomiaBot.restore_backlogs`) would, so votes just after midnight still count.
+
+Days are replayed in parallel by a process pool. A worker holds one day's backlog and proposals at a time,
+and only the proposals are sent back, so memory use does not grow with the amount of history.
+
+The proposals that would pass are compared with the ones in the channel's :class:`journal.ProposalJournal`::
+
+	python eunomia/replay.py "#osdev-offtopic"
+	python eunomia/replay.py "#osdev-offtopic" --from 2016-01-01 --to 2016-12-31 --jobs 8 --all
+
+Lines starting with ``+`` would pass now but are not in the journal, lines starting with ``-`` are in the journal
+but would not pass now. With ``--all``, proposals that are in both are listed too, starting with ``=``.
+
+"""
+
+import argparse
+import collections
+import datetime
+import functools
+import logging
+import multiprocessing
+import sys
+
+import archive
+import backlog
+import eunomialog
+import journal
+import legislation
+from backlog import Backlog, BacklogItem
+from timetools import TimeTools
+
+# Where replayed legislators log: nowhere. Replay workers don't start a log pipeline (and an eunomia.log) of their own,
+# and thousands of replayed days would only bury the bot's messages in it.
+null_logger = logging.getLogger("Legislation.replay")
+null_logger.addHandler(logging.NullHandler())
+null_logger.propagate = False
+
+class ProposalCollector:
+	""" Stands in for :class:`journal.ProposalJournal`, keeping proposals in memory instead.
+	"""
+	def __init__(self):
+		self.records = []
+
+	def append(self, record):
+		self.records.append(record)
+		return len(self.records) - 1
+
+def day_start(date):
+	""" Gets the start of a day (``YYYY-MM-DD``, UTC) in seconds since the epoch.
+	"""
+	return (datetime.date(*map(int, date.split("-"))) - datetime.date(1970, 1, 1)).days * 86400
+
+def items_from_lines(lines, start=None):
+	""" Turns channel log lines into backlog items, skipping lines that aren't messages or events.
+
+		:param lines: An iterable of log lines, without newlines.
+		:param start: The start of the log's day, in seconds since the epoch (see :func:`day_start`), to time the items with.
+			Without it, the items are only timed by their ``timestamp``.
+		:type start: int
+		:returns: A generator of :class:`backlog.BacklogItem`.
+	"""
+	for line in lines:
+		parsed = backlog.parse_log_line(line)
+		if parsed == None:
+			continue
+
+		(kind, nick, text, timestamp) = parsed
+		# The same as bot.EunomiaBot.message_to_backlog_item.
+		vote = legislation.parse_vote(text) if kind == backlog.PUBMSG else None
+		when = start + TimeTools.seconds_of_day(timestamp) if start != None else None
+		yield BacklogItem(kind, nick, text, timestamp, vote, when)
+
+def replay_day(day, channel, backlog_length):
+	""" Replays one day of a channel's log.
+
+		:param day: ``(date, path, previous path)``, where the previous path is ``None`` for the first day.
+		:param channel: The channel.
+		:param backlog_length: Capacity of the backlog, as in the bot.
+		:type day: tuple
+		:type channel: str
+		:type backlog_length: int
+		:returns: ``(date, records)``, with the records of the proposals that passed, in order.
+	"""
+	(date, path, previous_path) = day
+
+	collector = ProposalCollector()
+	legislator = legislation.Legislation(channel, collector, logger=null_logger)
+	# Nothing reads the legislator's log messages; don't spend time formatting them.
+	legislator.logger.setLevel(logging.WARNING)
+
+	day_backlog = Backlog(backlog_length)
+
+	if previous_path != None:
+		# Like a warm restart: the end of yesterday is in the backlog, but what passed then was counted yesterday.
+		legislator.replaying = True
+		for item in items_from_lines(archive.read_tail_lines(previous_path, backlog_length), day_start(date) - 86400):
+			day_backlog.append(item)
+			legislator.dereference_if_vote(item, day_backlog)
+		legislator.replaying = False
+
+	for item in items_from_lines((line for (offset, line) in archive.read_lines(path)), day_start(date)):
+		day_backlog.append(item)
+		legislator.dereference_if_vote(item, day_backlog)
+	# What passed at the end of the day is still waiting for the context after it.
+	legislator.flush()
+
+	return (date, collector.records)
+
+def journal_proposals(channel):
+	""" Gets the proposals in a channel's journal, as a multiset of ``proposal`` per date.
+
+		:returns: A dict of date (``YYYY-MM-DD``) -> :class:`collections.Counter` of proposal lines.
+	"""
+	by_date = collections.defaultdict(collections.Counter)
+	for record in journal.ProposalJournal(channel, read_only=True):
+		by_date[record["legislated"][:10]][record["proposal"]] += 1
+	return by_date
+
+def main(args=None):
+	parser = argparse.ArgumentParser(description="Re-run legislation over a channel's logs, and compare the result with its proposal journal.")
+	parser.add_argument("channel", help="The channel, e.g. \"#osdev-offtopic\".")
+	parser.add_argument("--from", dest="first", metavar="DATE", help="First day to replay (YYYY-MM-DD).")
+	parser.add_argument("--to", dest="last", metavar="DATE", help="Last day to replay (YYYY-MM-DD).")
+	parser.add_argument("--jobs", type=int, default=None, help="Number of worker processes. Defaults to the number of CPUs.")
+	parser.add_argument("--backlog-length", type=int, default=50, help="Backlog capacity, as in the bot.")
+	parser.add_argument("--logs", metavar="DIR", help="Log root to read from, instead of the bot's.")
+	parser.add_argument("--network", metavar="NAME", help="Read the logs of this network (an [irc:NAME] section) instead of the default network's.")
+	parser.add_argument("--all", action="store_true", help="Also list the proposals that are unchanged.")
+	options = parser.parse_args(args)
+
+	if options.logs != None:
+		eunomialog.log_root = options.logs
+	eunomialog.log_root = eunomialog.network_log_root(options.network)
+
+	log_dir = eunomialog.ChannelLogger(options.channel).log_dir
+	days = []
+	previous_path = None
+	for (date, path) in archive.log_days(log_dir):
+		if (options.first == None or date >= options.first) and (options.last == None or date <= options.last):
+			days.append((date, path, previous_path))
+		previous_path = path
+
+	if not days:
+		print("No logs to replay in \"{}\".".format(log_dir))
+		return 1
+
+	expected = journal_proposals(options.channel)
+	counts = collections.Counter()
+
+	worker = functools.partial(replay_day, channel=options.channel, backlog_length=options.backlog_length)
+	with multiprocessing.Pool(options.jobs) as pool:
+		# imap keeps the days in order, and hands back each day as soon as it (and every day before it) is done.
+		for (date, records) in pool.imap(worker, days):
+			in_journal = expected.pop(date, collections.Counter())
+
+			for record in records:
+				proposal = record["proposal"]
+				if in_journal[proposal] > 0:
+					in_journal[proposal] -= 1
+					counts["="] += 1
+					if options.all:
+						print("= {} {} {}".format(date, record["time"], proposal))
+				else:
+					counts["+"] += 1
+					print("+ {} {} {}".format(date, record["time"], proposal))
+
+			for (proposal, missing) in in_journal.items():
+				for i in range(missing):
+					counts["-"] += 1
+					print("- {} {}".format(date, proposal))
+
+			counts["days"] += 1
+
+	print("{} day(s) replayed: {} proposal(s) unchanged, {} new, {} no longer passing.".format(counts["days"], counts["="], counts["+"], counts["-"]))
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,289 @@
+"""
+.. module:: search
+	:platform: Unix
+	:synopsis: Incremental full-text index over a channel's logs.
+
+Every channel log directory gets a ``search.db`` next to its ``<date>.log`` files.
+It is an SQLite database with an inverted index: for every token, the lines it occurs in,
+and for every line, its nick, its day and the byte offset of the line in that day's log.
+Searching never scans the logs; only the lines that are shown are read, by seeking to their offsets.
+
+Lines are indexed as they are logged (see :meth:`eunomialog.ChannelLogger.append_item`).
+History logged before the index existed (or while it was disabled) is indexed with::
+
+	python eunomia/search.py --catch-up "#osdev-offtopic"
+
+which can also be used to search from the command line::
+
+	python eunomia/search.py "#osdev-offtopic" nick:sortie kernel panic
+
+"""
+
+import collections
+import os
+import sqlite3
+import sys
+import time
+from re import compile as regex
+
+import irc.strings
+
+import archive
+import backlog
+import eunomialog
+
+# Name of the index file in a channel's log directory.
+index_filename = "search.db"
+
+token_matcher = regex(r"\w+")
+
+# Longer "tokens" are almost always URLs, hashes or pastes, which nobody searches for word by word.
+max_token_length = 48
+
+schema = """
+	CREATE TABLE IF NOT EXISTS lines (
+		id INTEGER PRIMARY KEY,
+		date TEXT NOT NULL,
+		offset INTEGER NOT NULL,
+		nick TEXT NOT NULL
+	);
+	CREATE INDEX IF NOT EXISTS lines_by_nick ON lines (nick, id);
+	CREATE TABLE IF NOT EXISTS postings (
+		token TEXT NOT NULL,
+		line INTEGER NOT NULL,
+		PRIMARY KEY (token, line)
+	) WITHOUT ROWID;
+	CREATE TABLE IF NOT EXISTS files (
+		date TEXT PRIMARY KEY,
+		indexed_size INTEGER NOT NULL
+	);
+"""
+
+SearchResult = collections.namedtuple("SearchResult", ("date", "offset", "line"))
+
+def tokenize(text):
+	""" Splits text into the distinct, lower case tokens it is indexed (and searched) by.
+
+		:param text: The text.
+		:type text: str
+		:returns: A set of tokens.
+	"""
+	return {token for token in token_matcher.findall(text.lower()) if len(token) <= max_token_length}
+
+def parse_query(query):
+	""" Splits a search query into its tokens and its ``nick:`` filter.
+
+		:param query: E.g. ``"nick:sortie kernel panic"``.
+		:type query: str
+		:returns: ``(tokens, nick)``, where ``nick`` is ``None`` if the query doesn't filter by nick.
+	"""
+	tokens = set()
+	nick = None
+
+	for word in query.split():
+		if word.lower().startswith("nick:") and len(word) > 5:
+			nick = word[5:]
+		else:
+			tokens |= tokenize(word)
+
+	return (tokens, nick)
+
+class SearchIndex:
+	""" The search index of one channel's logs.
+
+		Writes are batched into transactions, which are committed every ``commit_every`` lines,
+		or on the first line more than ``commit_interval`` seconds after the last commit, whichever comes first.
+		Searches commit first, so they always see every line added so far.
+
+		:param log_dir: The channel's log directory (:attr:`eunomialog.ChannelLogger.log_dir`).
+		:param commit_every: Number of lines per transaction.
+		:param commit_interval: Maximum number of seconds a transaction is kept open while lines are coming in.
+		:type log_dir: str
+		:type commit_every: int
+		:type commit_interval: float
+	"""
+	def __init__(self, log_dir, commit_every=256, commit_interval=1.0):
+		self.log_dir = log_dir
+		self.commit_every = commit_every
+		self.commit_interval = commit_interval
+
+		os.makedirs(log_dir, exist_ok=True)
+		# Transactions are managed by hand (see add_line()), so the sqlite3 module must not open any.
+		self.db = sqlite3.connect(os.path.join(log_dir, index_filename), isolation_level=None)
+		self.db.execute("PRAGMA journal_mode = WAL")
+		self.db.execute("PRAGMA synchronous = NORMAL")
+		self.db.executescript(schema)
+
+		self.pending = 0
+		self.last_commit = time.monotonic()
+
+	def add(self, date, offset, end, item):
+		""" Indexes a line that was just logged.
+
+			:param date: The day of the log the line went to, as in its filename (``YYYY-MM-DD``).
+			:param offset: The byte offset of the line in that log.
+			:param end: The byte offset just after the line.
+			:param item: The line.
+			:type date: str
+			:type offset: int
+			:type end: int
+			:type item: backlog.BacklogItem
+		"""
+		if item.kind == backlog.FLOOD:
+			# Flood summaries aren't by anyone. catch_up() skips them too (they don't parse as channel events).
+			return
+		self.add_line(date, offset, item.nick, item.text, end)
+
+	def add_line(self, date, offset, nick, text, end):
+		""" Indexes a line.
+
+			:param date: The day of the log the line is in.
+			:param offset: The byte offset of the line.
+			:param nick: The nick that caused the line.
+			:param text: The text to index.
+			:param end: The byte offset just after the line, recorded as how far the day has been indexed.
+			:type date: str
+			:type offset: int
+			:type nick: str
+			:type text: str
+			:type end: int
+		"""
+		if self.pending == 0:
+			self.db.execute("BEGIN")
+
+		line_id = self.db.execute("INSERT INTO lines (date, offset, nick) VALUES (?, ?, ?)", (date, offset, irc.strings.lower(nick))).lastrowid
+		self.db.executemany("INSERT OR IGNORE INTO postings (token, line) VALUES (?, ?)", ((token, line_id) for token in tokenize(text)))
+		self.db.execute("INSERT OR REPLACE INTO files (date, indexed_size) VALUES (?, ?)", (date, end))
+
+		self.pending += 1
+		if self.pending >= self.commit_every or time.monotonic() - self.last_commit > self.commit_interval:
+			self.commit()
+
+	def commit(self):
+		if self.pending > 0:
+			self.db.execute("COMMIT")
+			self.pending = 0
+		self.last_commit = time.monotonic()
+
+	def close(self):
+		self.commit()
+		self.db.close()
+
+	def indexed_size(self, date):
+		""" Gets how many bytes of a day's log have been indexed.
+		"""
+		row = self.db.execute("SELECT indexed_size FROM files WHERE date = ?", (date,)).fetchone()
+		return row[0] if row != None else 0
+
+	def catch_up(self):
+		""" Indexes whatever part of the channel's logs isn't indexed yet: days that are missing entirely,
+			and lines appended to a day after it was last indexed.
+
+			:returns: The number of lines indexed.
+		"""
+		indexed = 0
+
+		for (date, path) in archive.log_days(self.log_dir):
+			# Reads archived days too. Only whole lines are read; one that is still being written is left for later.
+			for (offset, data) in archive.read_blocks(path, self.indexed_size(date)):
+				for raw_line in data.split(b"\n")[:-1]:
+					parsed = backlog.parse_log_line(raw_line.decode("utf-8", "replace"))
+					end = offset + len(raw_line) + 1
+					if parsed != None:
+						(kind, nick, text, timestamp) = parsed
+						self.add_line(date, offset, nick, text, end)
+						indexed += 1
+					offset = end
+
+		self.commit()
+		return indexed
+
+	def search(self, query, limit=3):
+		""" Finds the most recent lines that contain every token of a query (and are by the nick it filters by, if any).
+
+			:param query: The query. See :func:`parse_query`.
+			:param limit: The maximum number of results.
+			:type query: str
+			:type limit: int
+			:returns: A list of :class:`SearchResult`, newest first.
+		"""
+		self.commit()
+		return run_query(self.db, self.log_dir, query, limit)
+
+def run_query(db, log_dir, query, limit):
+	""" Runs a search query on an index database. See :meth:`SearchIndex.search`.
+	"""
+	(tokens, nick) = parse_query(query)
+	if not tokens and nick == None:
+		return []
+
+	arguments = []
+	if tokens:
+		# Walk the postings of one token, newest line first, and probe the others by primary key,
+		# so the query stops as soon as it has enough results. Longer tokens tend to be rarer.
+		tokens = sorted(tokens, key=len, reverse=True)
+		sql = "SELECT lines.date, lines.offset FROM postings JOIN lines ON lines.id = postings.line WHERE postings.token = ?"
+		arguments.append(tokens[0])
+		for token in tokens[1:]:
+			sql += " AND EXISTS (SELECT 1 FROM postings AS other WHERE other.token = ? AND other.line = postings.line)"
+			arguments.append(token)
+		if nick != None:
+			sql += " AND lines.nick = ?"
+			arguments.append(irc.strings.lower(nick))
+		sql += " ORDER BY postings.line DESC LIMIT ?"
+	else:
+		sql = "SELECT date, offset FROM lines WHERE nick = ? ORDER BY id DESC LIMIT ?"
+		arguments.append(irc.strings.lower(nick))
+	arguments.append(limit)
+
+	results = []
+	for (date, offset) in db.execute(sql, arguments).fetchall():
+		line = archive.read_line_at(os.path.join(log_dir, date + ".log"), offset)
+		if line != None:
+			# Lines that haven't reached the disk yet (see eunomialog.LogWriter) are left out.
+			results.append(SearchResult(date, offset, line))
+
+	return results
+
+def search_log_dir(log_dir, query, limit=3):
+	""" Searches a channel's index through a connection of its own, so it can run on any thread,
+		alongside the :class:`SearchIndex` that is adding lines. Only sees lines that were committed.
+
+		:param log_dir: The channel's log directory.
+		:param query: The query. See :func:`parse_query`.
+		:param limit: The maximum number of results.
+		:returns: A list of :class:`SearchResult`, newest first.
+	"""
+	db = sqlite3.connect(os.path.join(log_dir, index_filename))
+	try:
+		return run_query(db, log_dir, query, limit)
+	finally:
+		db.close()
+
+def main(args=None):
+	# Not at the top: the bot imports this module from open_search_index(), and never parses arguments with it.
+	import argparse
+
+	parser = argparse.ArgumentParser(description="Index and search a channel's logs.")
+	parser.add_argument("channel", help="The channel, e.g. \"#osdev-offtopic\".")
+	parser.add_argument("query", nargs="*", help="Tokens to search for, and optionally nick:<nick>.")
+	parser.add_argument("--catch-up", action="store_true", help="Index every logged line that isn't indexed yet first.")
+	parser.add_argument("--limit", type=int, default=20, help="Maximum number of results.")
+	parser.add_argument("--network", metavar="NAME", help="Read the logs of this network (an [irc:NAME] section) instead of the default network's.")
+	options = parser.parse_args(args)
+
+	index = SearchIndex(eunomialog.ChannelLogger(options.channel, root=eunomialog.network_log_root(options.network)).log_dir)
+	try:
+		if options.catch_up:
+			print("Indexed {} line(s).".format(index.catch_up()))
+
+		if options.query:
+			for result in index.search(" ".join(options.query), options.limit):
+				print("{} {}".format(result.date, result.line))
+	finally:
+		index.close()
+
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
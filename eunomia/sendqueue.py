@@ -0,0 +1,171 @@
+"""
+.. module:: sendqueue
+	:platform: Unix
+	:synopsis: Paced output to the server, so bursts of replies don't get the bot disconnected for flooding.
+
+Everything the bot sends on its own account goes through a :class:`SendQueue` instead of straight to the connection.
+Lines are sent right away as long as a token bucket allows it: the bucket holds up to ``burst`` tokens, refills at
+``rate`` tokens per second, and every line takes one. When it is empty, lines wait in the queue, and a timer on
+``reactor.scheduler`` sends them once there are tokens again. Nothing ever waits in a handler.
+
+Waiting lines are sent by priority, and in order within a priority:
+
+* :data:`AUTH`: joins and identifying to NickServ,
+* :data:`REPLY`: the first line of a reply to a command,
+* :data:`BULK`: the rest of multi-line output (e.g. search results).
+
+A line that is already waiting (same command, target and text) is not queued again.
+Waiting lines are dropped on disconnect: joins and identifying are redone on the next welcome anyway,
+and replies would be stale by then. A line the irc library refuses to send (longer than :data:`max_line_bytes`,
+or with a line break in it) is logged and dropped, so it can't take the timer that sends the lines after it
+(and with it, the bot) down.
+
+"""
+
+import collections
+import time
+
+import irc.client
+
+import logsetup
+
+# Priorities, highest first.
+AUTH = 0
+REPLY = 1
+BULK = 2
+
+priority_names = ("auth", "reply", "bulk")
+
+# The longest line a client may send, including the trailing CR/LF (RFC 2812, 2.3).
+max_line_bytes = 512
+
+def truncate(text, max_bytes):
+	""" Cuts a text to at most ``max_bytes`` bytes of UTF-8, on a character boundary. Text that is cut ends in ``...``.
+
+		:type text: str
+		:type max_bytes: int
+	"""
+	encoded = text.encode("utf-8")
+	if len(encoded) <= max_bytes:
+		return text
+	return encoded[:max(0, max_bytes - 3)].decode("utf-8", "ignore") + "..."
+
+class SendQueue:
+	""" A token bucket paced output queue for one connection. See the module description.
+
+		:param connection: The connection to send on.
+		:param scheduler: Runs the timer that sends waiting lines, e.g. ``reactor.scheduler``.
+		:param rate: Lines per second, once the burst is used up.
+		:param burst: Lines that can be sent at once after being idle.
+		:param time_function: A monotonic clock, in seconds.
+		:type connection: irc.client.ServerConnection
+		:type scheduler: irc.schedule.IScheduler
+		:type rate: float
+		:type burst: int
+		:type time_function: function
+	"""
+	def __init__(self, connection, scheduler, rate=0.5, burst=5, time_function=time.monotonic):
+		if rate <= 0 or burst < 1:
+			raise ValueError("A send queue needs a positive rate and a burst of at least one line.")
+
+		self.logger = logsetup.get_pipeline().get_logger("SendQueue")
+
+		self.connection = connection
+		self.scheduler = scheduler
+		self.rate = rate
+		self.burst = burst
+		self.time_function = time_function
+
+		self.tokens = float(burst)
+		self.updated = time_function()
+
+		# One ordered "set" of (method name, arguments) per priority.
+		self.queues = [collections.OrderedDict() for name in priority_names]
+		# Whether a timer to send waiting lines is pending.
+		self.timer_pending = False
+
+		# Totals, for metrics.
+		self.sent = 0
+		self.merged = 0
+		self.dropped = 0
+		self.invalid = 0
+
+	def privmsg(self, target, text, priority=REPLY):
+		self.put(priority, "privmsg", target, text)
+
+	def join(self, channel):
+		self.put(AUTH, "join", channel)
+
+	def put(self, priority, method_name, *arguments):
+		""" Sends a line, or queues it if the bucket is empty.
+
+			:param priority: :data:`AUTH`, :data:`REPLY` or :data:`BULK`.
+			:param method_name: The connection method that sends the line, e.g. ``"privmsg"``.
+			:param arguments: Its arguments.
+			:type priority: int
+			:type method_name: str
+		"""
+		line = (method_name, arguments)
+		for queue in self.queues:
+			if line in queue:
+				self.merged += 1
+				return
+
+		self.queues[priority][line] = None
+		self.drain()
+
+	def depth(self, priority=None):
+		""" Gets the number of waiting lines, of one priority or in total.
+		"""
+		if priority == None:
+			return sum(len(queue) for queue in self.queues)
+		return len(self.queues[priority])
+
+	def refill(self):
+		now = self.time_function()
+		self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+		self.updated = now
+
+	def drain(self):
+		""" Sends as many waiting lines as there are tokens for, and sets a timer for the rest.
+		"""
+		self.refill()
+
+		while self.tokens >= 1:
+			line = self.pop()
+			if line == None:
+				return
+			self.tokens -= 1
+			self.send(line)
+
+		if not self.timer_pending and self.depth() > 0:
+			self.timer_pending = True
+			self.scheduler.execute_after((1 - self.tokens) / self.rate, self.on_timer)
+
+	def on_timer(self):
+		self.timer_pending = False
+		self.drain()
+
+	def pop(self):
+		for queue in self.queues:
+			if queue:
+				return queue.popitem(last=False)[0]
+		return None
+
+	def send(self, line):
+		(method_name, arguments) = line
+		try:
+			getattr(self.connection, method_name)(*arguments)
+			self.sent += 1
+		except irc.client.ServerNotConnectedError:
+			self.dropped += 1
+		except (irc.client.MessageTooLong, irc.client.InvalidCharacters) as error:
+			self.invalid += 1
+			self.logger.error("Dropped a %s to %s: %s", method_name, arguments[0], error)
+
+	def clear(self):
+		""" Drops every waiting line. Called on disconnect.
+		"""
+		self.dropped += self.depth()
+		for queue in self.queues:
+			queue.clear()
@@ -0,0 +1,238 @@
+"""
+.. module:: soak
+	:platform: Unix
+	:synopsis: A memory soak test: days of simulated traffic, checked for memory that keeps growing.
+
+The bot runs for weeks, so anything that grows with traffic (a backlog that isn't trimmed, state kept per nick,
+handlers added again on every ``reload-legislation``, ...) will eventually hurt. This drives :class:`bot.EunomiaBot`
+through a :class:`stubirc.StubConnection` with a number of simulated days of traffic, on a :class:`clock.FakeClock`
+that moves a whole day in a few seconds, so day rollovers happen as they would live.
+
+Every simulated day brings a new crowd: its users join, talk (see :mod:`traffic`), send the bot a
+``reload-legislation`` (and ``stats``, with ``--metrics``), and quit again. So per-nick state that isn't cleaned up,
+and whatever a reload leaves behind, grows day by day.
+
+Memory is traced with :mod:`tracemalloc`. Every ``--interval`` simulated hours, the retained memory and the number of
+objects the garbage collector tracks are sampled. The first ``--warmup`` days are not checked: that is where the
+backlogs fill up and the log files are opened. After that, memory has to reach a steady state: the samples of the
+second half of the rest of the run may not exceed the highest sample of its first half by more than ``--tolerance``
+(a fraction), or by ``--slack-kib`` KiB / ``--slack-objects`` objects, whichever is more. Comparing halves rather than
+the first and the last sample lets one-off steps through (e.g. a dict that is resized once), while a leak grows in
+both halves. The allocation sites that grew the most since the end of the warm-up are always reported.
+
+Run it from the repository root::
+
+	python eunomia/soak.py
+	python eunomia/soak.py --days 14 --events-per-day 50000 --metrics
+
+It exits with status 1 if memory or the object count kept growing.
+All logs are written to a temporary directory, which is removed afterwards.
+
+"""
+
+import argparse
+import gc
+import itertools
+import os
+import random
+import shutil
+import sys
+import tempfile
+import tracemalloc
+
+import eunomialog
+import metrics
+import sendqueue
+import stubirc
+import traffic
+from clock import FakeClock
+
+channel = "#soak"
+nickname = "eunomia"
+
+def simulated_days(days, events_per_day, users, pattern="mixed", seed=0, with_metrics=False):
+	""" Generates the soak's traffic, one simulated day after the other. See the module description.
+
+		:param days: Number of days.
+		:param events_per_day: Number of traffic events per day, not counting the joins, quits and commands.
+		:param users: Number of users per day.
+		:param pattern: The traffic pattern, a key of :data:`traffic.generators`.
+		:param seed: Random seed, so runs are repeatable.
+		:param with_metrics: Also send ``stats`` every day.
+		:type days: int
+		:type events_per_day: int
+		:type users: int
+		:type pattern: str
+		:type seed: int
+		:type with_metrics: bool
+		:returns: A generator of ``(day, kind, nick, arguments)`` tuples.
+	"""
+	rng = random.Random(seed)
+	commands = ["reload-legislation"] + (["stats"] if with_metrics else [])
+
+	for day in range(days):
+		nicks = traffic.make_nicks(users, "d{}u".format(day))
+
+		for nick in nicks:
+			yield (day, "join", nick, [])
+		for (kind, nick, arguments) in itertools.islice(traffic.generators[pattern](rng, nicks), events_per_day):
+			yield (day, kind, nick, arguments)
+		for command in commands:
+			yield (day, "pubmsg", nicks[0], ["{}: {}".format(nickname, command)])
+		for nick in nicks:
+			yield (day, "quit", nick, ["Quit: see you tomorrow"])
+
+def take_sample(bot_inst, day):
+	""" Samples the memory that is still retained after a full garbage collection.
+
+		:returns: A tuple of ``(day, retained KiB, objects tracked by the gc)``.
+	"""
+	# What the stub connection recorded is the harness', not the bot's.
+	bot_inst.connection.sent.clear()
+
+	gc.collect()
+	(current, peak) = tracemalloc.get_traced_memory()
+	return (day, current / 1024, len(gc.get_objects()))
+
+def slope_per_day(samples, column):
+	""" Least-squares slope of one sample column, per simulated day.
+	"""
+	if len(samples) < 2:
+		return 0.0
+
+	days = [sample[0] for sample in samples]
+	values = [sample[column] for sample in samples]
+	mean_day = sum(days) / len(days)
+	mean_value = sum(values) / len(values)
+
+	spread = sum((day - mean_day) ** 2 for day in days)
+	if spread == 0:
+		return 0.0
+	return sum((day - mean_day) * (value - mean_value) for (day, value) in zip(days, values)) / spread
+
+def find_growth(samples, warmup, tolerance, slack_kib, slack_objects):
+	""" Checks that memory and object counts reached a steady state after the warm-up.
+
+		:param samples: Samples taken with :func:`take_sample`, in order.
+		:returns: A list of descriptions of what kept growing. Empty if nothing did.
+	"""
+	checked = [sample for sample in samples if sample[0] >= warmup]
+	middle = (checked[0][0] + checked[-1][0]) / 2
+	first_half = [sample for sample in checked if sample[0] < middle]
+	second_half = [sample for sample in checked if sample[0] >= middle]
+
+	growth = []
+	for (column, name, unit, slack) in ((1, "Retained memory", "KiB", slack_kib), (2, "Object count", "objects", slack_objects)):
+		steady = max(sample[column] for sample in first_half)
+		grown = max(sample[column] for sample in second_half) - steady
+		allowed = max(slack, steady * tolerance)
+		if grown > allowed:
+			growth.append("{} kept growing after the warm-up: by {:.0f} {} in the second half (allowed: {:.0f}), {:+.0f} {} per day.".format(
+				name, grown, unit, allowed, slope_per_day(checked, column), unit))
+
+	return growth
+
+def print_top_growth(baseline, final, count):
+	""" Prints the allocation sites that grew the most between two snapshots.
+	"""
+	filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+	differences = final.filter_traces(filters).compare_to(baseline.filter_traces(filters), "lineno")
+
+	print("Top growing allocation sites since the warm-up:")
+	growing = [difference for difference in differences if difference.size_diff > 0][:count]
+	if not growing:
+		print("  (none)")
+	for difference in growing:
+		frame = difference.traceback[0]
+		print("  {:>+10.1f} KiB {:>+8d} blocks  {}:{}".format(difference.size_diff / 1024, difference.count_diff, frame.filename, frame.lineno))
+
+def run_soak(options):
+	""" Runs the soak test.
+
+		:returns: The exit status: 0 if memory stayed flat after the warm-up, 1 if it kept growing.
+	"""
+	clock = FakeClock()
+	log_writer = eunomialog.LogWriter() if options.writer == "thread" else None
+	metrics_registry = metrics.Metrics() if options.metrics else None
+
+	tracemalloc.start()
+	bot_inst = stubirc.build_bot(channel, nickname, log_writer=log_writer, metrics=metrics_registry, clock=clock)
+	try:
+		# Pace replies on simulated time too, or the send queue would hold them back for real seconds.
+		bot_inst.send_queue = sendqueue.SendQueue(bot_inst.connection, bot_inst.reactor.scheduler, time_function=clock.time_function)
+
+		# Every event of a day (its traffic, the joins and quits, and up to two commands) fits in the day.
+		seconds_per_event = 86400 / (options.events_per_day + 2 * options.users + 2)
+		start = clock.fake_time
+		next_sample = start
+		samples = []
+		baseline = None
+
+		for (day, kind, nick, arguments) in simulated_days(options.days, options.events_per_day, options.users, options.pattern, options.seed, options.metrics):
+			clock.fake_time += seconds_per_event
+			if clock.fake_time >= next_sample:
+				samples.append(take_sample(bot_inst, (clock.fake_time - start) / 86400))
+				next_sample += options.interval * 3600
+
+				if baseline == None and samples[-1][0] >= options.warmup:
+					baseline = tracemalloc.take_snapshot()
+
+			stubirc.dispatch(bot_inst, stubirc.make_event(kind, nick, channel, arguments))
+
+		samples.append(take_sample(bot_inst, (clock.fake_time - start) / 86400))
+		final = tracemalloc.take_snapshot()
+	finally:
+		tracemalloc.stop()
+		stubirc.release_bot(bot_inst)
+
+	print("{:>8} {:>14} {:>10}".format("day", "retained KiB", "objects"))
+	for sample in samples:
+		print("{:>8.2f} {:>14.1f} {:>10d}".format(*sample))
+	print()
+
+	print_top_growth(baseline, final, options.top)
+	print()
+
+	growth = find_growth(samples, options.warmup, options.tolerance, options.slack_kib, options.slack_objects)
+	for description in growth:
+		print(description)
+	if growth:
+		return 1
+
+	print("Memory stayed flat after the warm-up.")
+	return 0
+
+def main(args=None):
+	parser = argparse.ArgumentParser(description="Soak test eunomia with days of simulated traffic, and check that its memory stops growing.")
+	parser.add_argument("--days", type=int, default=7, help="Simulated days of traffic.")
+	parser.add_argument("--events-per-day", type=int, default=20000, help="Traffic events per simulated day.")
+	parser.add_argument("--users", type=int, default=50, help="Number of simulated users per day. Every day brings new ones.")
+	parser.add_argument("--pattern", choices=sorted(traffic.generators), default="mixed", help="Traffic pattern.")
+	parser.add_argument("--seed", type=int, default=0, help="Random seed.")
+	parser.add_argument("--writer", choices=("sync", "thread"), default="sync", help="How channel logs are written.")
+	parser.add_argument("--metrics", action="store_true", help="Run with metrics enabled.")
+	parser.add_argument("--interval", type=float, default=6, help="Simulated hours between memory samples.")
+	parser.add_argument("--warmup", type=float, default=1, help="Simulated days before memory has to be steady.")
+	parser.add_argument("--tolerance", type=float, default=0.05, help="Growth after the warm-up (fraction) that fails the test.")
+	parser.add_argument("--slack-kib", type=float, default=256, help="Growth in KiB that is always allowed.")
+	parser.add_argument("--slack-objects", type=int, default=2000, help="Growth in objects that is always allowed.")
+	parser.add_argument("--top", type=int, default=10, help="Number of growing allocation sites to report.")
+	options = parser.parse_args(args)
+
+	if options.days < options.warmup + 2:
+		parser.error("--days has to be at least two more than --warmup.")
+
+	# Each simulated day is a day of channel logs, so a week's soak would fill the real log tree with them.
+	work_dir = tempfile.mkdtemp(prefix="eunomia-soak-")
+	old_cwd = os.getcwd()
+	eunomialog.log_root = work_dir + "/logs"
+	os.chdir(work_dir)
+
+	try:
+		return run_soak(options)
+	finally:
+		os.chdir(old_cwd)
+		shutil.rmtree(work_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+	sys.exit(main())
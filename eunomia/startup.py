@@ -0,0 +1,147 @@
+"""
+.. module:: startup
+	:platform: Unix
+	:synopsis: Measures how long eunomia takes from a cold start until it is connected.
+
+Starts the bot the way a supervisor would (``eunomia/__main__.py`` in a fresh interpreter) a number of times,
+each time against a new :class:`fakeserver.FakeIRCServer`, and reports for every phase how long it took from
+spawning the process:
+
+* ``registered``: the bot sent ``USER`` (the interpreter started, everything was imported and the config read),
+* ``joined``: the bot joined its channel (the server's welcome was handled),
+* ``exited``: the process exited after a SIGTERM, sent once it had joined (measured from the SIGTERM).
+
+Run it from the repository root::
+
+	python eunomia/startup.py
+	python eunomia/startup.py --runs 20 --config eunomia.ini
+	python eunomia/startup.py --git
+
+By default the bot runs with a minimal config. ``--config`` uses the sections of a real config instead
+(the IRC sections are replaced, so it connects to the fake server). ``--git`` hides the generated version module,
+so the version has to come from git, as it did on every start before :mod:`version`.
+
+Logs are written to a temporary directory, which is removed afterwards.
+
+"""
+
+import argparse
+import configparser
+import os
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from fakeserver import FakeIRCServer
+
+source_dir = os.path.dirname(os.path.realpath(__file__))
+
+# Runs eunomia/__main__.py with its logs in a directory of our own. Arguments: source dir, log root, hide version module.
+child_script = """import runpy, sys
+sys.path.insert(0, sys.argv[1])
+if sys.argv[3] == "yes":
+	sys.modules["_version"] = None
+import eunomialog
+eunomialog.log_root = sys.argv[2]
+runpy.run_path(sys.argv[1] + "/__main__.py", run_name="__main__")
+"""
+
+phases = ("registered", "joined", "exited")
+
+def write_config(path, server, channel, base_config=None, use_git=False):
+	""" Writes a config that connects to ``server``, optionally with every other section of an existing config.
+	"""
+	config = configparser.ConfigParser()
+	if base_config != None:
+		config.read(base_config)
+
+	for section in config.sections():
+		if section == "irc" or section.startswith("irc:") or section.startswith("ident"):
+			config.remove_section(section)
+
+	config["irc"] = {"server": server.host, "port": str(server.port), "channels": channel, "nick": "eunomia"}
+	config["ident"] = {"method": "none"}
+	config["version"] = {"git": "yes" if use_git else "no"}
+
+	with open(path, "w") as config_file:
+		config.write(config_file)
+
+def first_line_time(server, command):
+	for (received, line) in server.received:
+		if line.split(" ")[0].upper() == command:
+			return received
+	return None
+
+def run_once(work_dir, base_config, use_git, timeout):
+	""" Starts the bot once, and times its phases.
+
+		:returns: A dict of phase -> seconds, or ``None`` if the bot didn't join within ``timeout`` seconds.
+	"""
+	channel = "#startup"
+	server = FakeIRCServer()
+	write_config(os.path.join(work_dir, "eunomia.ini"), server, channel, base_config, use_git)
+
+	start = time.monotonic()
+	process = subprocess.Popen([sys.executable, "-c", child_script, source_dir, os.path.join(work_dir, "logs"), "yes" if use_git else "no"],
+		cwd=work_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+	try:
+		if not server.wait_for_join(channel, timeout):
+			return None
+		joined = time.monotonic()
+
+		stopping = time.monotonic()
+		process.send_signal(signal.SIGTERM)
+		process.wait(timeout)
+		exited = time.monotonic()
+	finally:
+		if process.poll() == None:
+			process.kill()
+			process.wait()
+		server.close()
+
+	return {
+		"registered": first_line_time(server, "USER") - start,
+		"joined": joined - start,
+		"exited": exited - stopping,
+	}
+
+def main(args=None):
+	parser = argparse.ArgumentParser(description="Measure eunomia's time from a cold start until it is connected, against a local fake IRC server.")
+	parser.add_argument("--runs", type=int, default=10, help="Number of starts.")
+	parser.add_argument("--config", metavar="FILE", help="Use the (non-IRC) sections of this config, e.g. to enable search.")
+	parser.add_argument("--git", action="store_true", help="Hide the generated version module, so the version comes from git.")
+	parser.add_argument("--timeout", type=float, default=30, help="Seconds to wait for a start before giving up.")
+	options = parser.parse_args(args)
+
+	base_config = os.path.realpath(options.config) if options.config != None else None
+
+	work_dir = tempfile.mkdtemp(prefix="eunomia-startup-")
+	try:
+		results = []
+		print("{:>4} {:>14} {:>14} {:>14}".format("run", *("{} ms".format(phase) for phase in phases)))
+
+		for run in range(options.runs):
+			timings = run_once(work_dir, base_config, options.git, options.timeout)
+			if timings == None:
+				print("The bot did not join within {} seconds.".format(options.timeout))
+				return 1
+
+			results.append(timings)
+			print("{:>4} {:>14.1f} {:>14.1f} {:>14.1f}".format(run, *(timings[phase] * 1000 for phase in phases)))
+
+		print()
+		for phase in phases:
+			values = [timings[phase] * 1000 for timings in results]
+			print("{:>10}: min {:.1f} ms, median {:.1f} ms, max {:.1f} ms".format(phase, min(values), statistics.median(values), max(values)))
+	finally:
+		shutil.rmtree(work_dir, ignore_errors=True)
+
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,133 @@
+"""
+.. module:: stubirc
+	:platform: Unix
+	:synopsis: Drives EunomiaBot's handlers without a network, for benchmarks and soak tests.
+
+"""
+
+import logging
+
+import irc.client
+
+import bot
+from backlog import Backlog
+
+class StubConnection:
+	""" Stands in for :class:`irc.client.ServerConnection`. Records everything the bot sends instead of using a socket.
+
+		:param nickname: The bot's nickname.
+		:type nickname: str
+	"""
+	def __init__(self, nickname):
+		self.nickname = nickname
+		self.sent = []
+
+	def get_nickname(self):
+		return self.nickname
+
+	def is_connected(self):
+		return True
+
+	def privmsg(self, target, text):
+		self.sent.append(("PRIVMSG", target, text))
+
+	def notice(self, target, text):
+		self.sent.append(("NOTICE", target, text))
+
+	def ctcp_reply(self, target, parameter):
+		self.sent.append(("NOTICE", target, parameter))
+
+	def join(self, channel, key=""):
+		self.sent.append(("JOIN", channel))
+
+	def part(self, channels, message=""):
+		self.sent.append(("PART", channels, message))
+
+	def nick(self, newnick):
+		self.nickname = newnick
+
+	def disconnect(self, message=""):
+		self.sent.append(("QUIT", message))
+
+def make_event(kind, nick, channel, arguments):
+	""" Builds an :class:`irc.client.Event`, as the reactor would for a line from ``nick``.
+
+		:param kind: The event type, e.g. ``"pubmsg"``.
+		:param nick: The nick that caused the event.
+		:param channel: The event target.
+		:param arguments: The event arguments.
+		:type kind: str
+		:type nick: str
+		:type channel: str
+		:type arguments: list
+	"""
+	source = irc.client.NickMask.from_params(nick, nick, "stub.invalid")
+	return irc.client.Event(kind, source, channel, arguments)
+
+def make_events(traffic, channel):
+	""" Turns ``(kind, nick, arguments)`` tuples (see :mod:`traffic`) into events.
+	"""
+	return [make_event(kind, nick, channel, arguments) for (kind, nick, arguments) in traffic]
+
+def build_bot(channels="#stub", nickname="eunomia", backlog_length=None, log_writer=None, quiet=True, metrics=None, clock=None):
+	""" Builds an :class:`bot.EunomiaBot` that is wired to a :class:`StubConnection` instead of a server.
+
+		Logs go wherever :data:`eunomialog.log_root` (and the working directory, for ``eunomia.log``) point,
+		so callers should point those somewhere disposable first.
+
+		:param channels: The channel the bot serves, or a list of channels.
+		:param nickname: The bot's nickname.
+		:param backlog_length: Backlog capacity, if it should differ from the bot's default.
+		:param log_writer: Passed through to the bot.
+		:param quiet: Only let warnings and errors through to the console.
+		:param metrics: Passed through to the bot.
+		:param clock: Passed through to the bot, e.g. a :class:`clock.FakeClock`.
+		:type channels: str/list
+		:type nickname: str
+		:type backlog_length: int
+		:type log_writer: eunomialog.LogWriter
+		:type quiet: bool
+		:type metrics: metrics.Metrics
+		:type clock: clock.Clock
+	"""
+	bot_inst = bot.EunomiaBot(channels, nickname, "stub.invalid", "eunomia stub", None, 6667, log_writer, metrics, clock=clock)
+	bot_inst.connection = StubConnection(nickname)
+	bot_inst.send_queue.connection = bot_inst.connection
+	# Nothing runs the reactor's timers here, so dispatch() drains the pipeline itself.
+	bot_inst.pipeline.scheduler = None
+
+	if quiet:
+		bot_inst.stream_log_handler.setLevel(logging.WARNING)
+
+	if backlog_length != None:
+		bot_inst.max_backlog_length = backlog_length
+		for state in bot_inst.channel_states.values():
+			state.backlog = Backlog(backlog_length, bot_inst.pipeline_batch_size)
+
+	# The bot's own joins, so irc.bot's channel tracking knows about the channels.
+	for state in bot_inst.channel_states.values():
+		dispatch(bot_inst, make_event("join", nickname, state.name, []))
+
+	return bot_inst
+
+def release_bot(bot_inst):
+	""" Closes a stub bot's log writer, if it has one.
+
+		The logging handlers are shared by every bot in the process (see :mod:`logsetup`), so they are left alone.
+	"""
+	if bot_inst.log_writer != None:
+		bot_inst.log_writer.close()
+
+def dispatch(bot_inst, event):
+	""" Delivers an event to the bot through its reactor's handlers, the same way a line from the server would be,
+		and drains the pipeline, as the end of a reactor tick would.
+	"""
+	bot_inst.reactor._handle_event(bot_inst.connection, event)
+	bot_inst.pipeline.drain()
+
+def dispatch_tick(bot_inst, events):
+	""" Delivers several events, then drains the pipeline once, as a reactor tick that read all of them would.
+	"""
+	for event in events:
+		bot_inst.reactor._handle_event(bot_inst.connection, event)
+	bot_inst.pipeline.drain()
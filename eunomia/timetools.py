@@ -4,3 +4,6 @@ class TimeTools:
 	@staticmethod
 	def truncate_ns(timestamp):
 		return datetime.time(timestamp.hour, timestamp.minute, timestamp.second)
+	@staticmethod
+	def seconds_of_day(timestamp):
+		return timestamp.hour * 3600 + timestamp.minute * 60 + timestamp.second
@@ -0,0 +1,170 @@
+"""
+.. module:: traffic
+	:platform: Unix
+	:synopsis: Generates synthetic channel traffic for benchmarks and load tests.
+
+Every generator yields ``(kind, nick, arguments)`` tuples, where ``kind`` is an IRC event type
+(``"pubmsg"``, ``"join"``, ...) and ``arguments`` is the event's argument list, as :class:`irc.client.Event` has it.
+The tuples are turned into events by :mod:`stubirc`, or into raw IRC lines by a fake server.
+
+"""
+
+import itertools
+import random
+
+import archive
+import backlog
+
+words = (
+	"kernel", "scheduler", "paging", "interrupt", "bootloader", "rust", "assembly", "linker",
+	"allocator", "driver", "syscall", "filesystem", "we", "should", "just", "rewrite", "the",
+	"it", "in", "why", "not", "maybe", "please", "no", "yes", "again", "tomorrow", "broken",
+)
+
+def make_nicks(count, prefix="user"):
+	""" Makes a list of ``count`` distinct nicks.
+	"""
+	return ["{}{}".format(prefix, i) for i in range(count)]
+
+def sentence(rng, length=None):
+	""" Makes a random sentence out of :data:`words`.
+	"""
+	if length == None:
+		length = rng.randint(3, 12)
+	return " ".join(rng.choice(words) for i in range(length))
+
+def chatter(rng, nicks):
+	""" Plain conversation: messages and the occasional action, no votes.
+	"""
+	while True:
+		nick = rng.choice(nicks)
+		if rng.random() < 0.05:
+			yield ("action", nick, [sentence(rng)])
+		else:
+			yield ("pubmsg", nick, [sentence(rng)])
+
+def vote_storm(rng, nicks):
+	""" Proposals, each followed by a run of basic ``:D`` votes (and the odd ``:D^``).
+	"""
+	while True:
+		yield ("pubmsg", rng.choice(nicks), [sentence(rng)])
+		for i in range(rng.randint(2, 8)):
+			vote = ":D^" if rng.random() < 0.1 else ":D"
+			yield ("pubmsg", rng.choice(nicks), [vote])
+
+def nick_vote_chains(rng, nicks):
+	""" Several people talk, then others vote on older messages with ``nick: :D`` and ``nick: :D~N``.
+	"""
+	while True:
+		speakers = rng.sample(nicks, min(len(nicks), 4))
+		for nick in speakers:
+			for i in range(rng.randint(1, 3)):
+				yield ("pubmsg", nick, [sentence(rng)])
+		for i in range(rng.randint(3, 6)):
+			target = rng.choice(speakers)
+			back_x = rng.randint(0, 2)
+			vote = "{}: :D".format(target) if back_x == 0 else "{}: :D~{}".format(target, back_x)
+			yield ("pubmsg", rng.choice(nicks), [vote])
+
+def join_part_flood(rng, nicks):
+	""" A join/part/quit storm, with hardly any talking.
+	"""
+	while True:
+		nick = rng.choice(nicks)
+		roll = rng.random()
+		if roll < 0.45:
+			yield ("join", nick, [])
+		elif roll < 0.8:
+			yield ("part", nick, [sentence(rng, 2)] if rng.random() < 0.5 else [])
+		elif roll < 0.97:
+			yield ("quit", nick, ["Ping timeout: 240 seconds"])
+		else:
+			yield ("pubmsg", nick, [sentence(rng)])
+
+def paste_flood(rng, nicks):
+	""" Someone pastes the same few lines over and over, while the others keep talking and voting.
+	"""
+	flooder = nicks[0]
+	others = nicks[1:] or nicks
+	paste = [sentence(rng) for i in range(3)]
+	while True:
+		for line in paste * rng.randint(2, 6):
+			yield ("pubmsg", flooder, [line])
+		yield ("pubmsg", rng.choice(others), [sentence(rng)])
+		for i in range(rng.randint(1, 4)):
+			yield ("pubmsg", rng.choice(others), [":D"])
+
+def mixed(rng, nicks):
+	""" A blend of everything above, roughly in the proportions of a busy channel.
+	"""
+	sources = [chatter(rng, nicks), vote_storm(rng, nicks), nick_vote_chains(rng, nicks), join_part_flood(rng, nicks)]
+	weights = [70, 10, 10, 10]
+	while True:
+		source = rng.choices(sources, weights)[0]
+		for event in itertools.islice(source, rng.randint(1, 10)):
+			yield event
+
+generators = {
+	"chatter": chatter,
+	"vote_storm": vote_storm,
+	"nick_vote_chains": nick_vote_chains,
+	"join_part_flood": join_part_flood,
+	"paste_flood": paste_flood,
+	"mixed": mixed,
+}
+
+def from_log(path, count=None):
+	""" Reads recorded traffic back from a channel log.
+
+		Messages, actions, joins, parts and quits are replayed; every other line is skipped.
+		Lines are parsed as :meth:`bot.EunomiaBot.restore_backlogs` parses them (see :func:`backlog.parse_log_line`).
+
+		:param path: Path of a daily channel log, or of its archive. If the log has been archived, the archive is read.
+		:param count: Maximum number of events to read, or ``None`` for all of them.
+		:type path: str
+		:type count: int
+		:returns: A list of ``(kind, nick, arguments)`` tuples.
+	"""
+	for (extension, compress, decompress) in archive.compressions.values():
+		if path.endswith(extension):
+			path = path[:-len(extension)]
+			break
+
+	events = []
+	for (offset, line) in archive.read_lines(path):
+		parsed = backlog.parse_log_line(line)
+		if parsed == None:
+			continue
+
+		(kind, nick, text, timestamp) = parsed
+		if kind in backlog.AUTHORED_KINDS:
+			arguments = [text]
+		elif kind == backlog.JOIN:
+			arguments = []
+		elif kind in (backlog.PART, backlog.QUIT):
+			# Their text is the whole line, "*** Parts: nick (reason)".
+			arguments = [text[text.index("(") + 1:-1]]
+		else:
+			continue
+
+		events.append((kind, nick, arguments))
+		if count != None and len(events) >= count:
+			break
+
+	return events
+
+def generate(name, count, users=50, seed=0):
+	""" Generates ``count`` events of the named traffic pattern.
+
+		:param name: The traffic pattern, a key of :data:`generators`.
+		:param count: Number of events.
+		:param users: Number of simulated users.
+		:param seed: Random seed, so runs are repeatable.
+		:type name: str
+		:type count: int
+		:type users: int
+		:type seed: int
+		:returns: A list of ``(kind, nick, arguments)`` tuples.
+	"""
+	rng = random.Random(seed)
+	return list(itertools.islice(generators[name](rng, make_nicks(users)), count))
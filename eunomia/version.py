@@ -0,0 +1,93 @@
+"""
+.. module:: version
+	:platform: Unix
+	:synopsis: Resolves eunomia's version string (e.g. for CTCP VERSION replies) without running git on every start.
+
+The version is read from the ``_version`` module next to this one, which is generated when eunomia is built
+(``setup.py build``/``install``), or in a checkout with::
+
+	python eunomia/version.py
+
+Git is only run when there is no generated module and the caller asks for it (``[version] git = yes``),
+since two git processes add noticeably to the time it takes to start, and fail outside a checkout.
+
+"""
+
+import os
+import subprocess
+import sys
+
+source_dir = os.path.dirname(os.path.realpath(__file__))
+version_module_path = os.path.join(source_dir, "_version.py")
+
+# What the version is when it can't be found out.
+unknown_version = "eunomia (unknown version)"
+
+def git_version(repo_dir=source_dir):
+	""" Asks git for the branch and description of the checkout eunomia runs from.
+
+		:raises OSError: If git can't be run.
+		:raises subprocess.CalledProcessError: If ``repo_dir`` is not in a git checkout.
+	"""
+	git_describe = subprocess.check_output(["git", "describe", "--always"], cwd=repo_dir, stderr=subprocess.DEVNULL).decode("UTF-8").replace('\n', '')
+	current_branch = subprocess.check_output(["git", "rev-parse", "--abbrev-ref", "HEAD"], cwd=repo_dir, stderr=subprocess.DEVNULL).decode("UTF-8").replace('\n', '')
+	return "eunomia {}-{}".format(current_branch, git_describe)
+
+def cached_version():
+	""" Reads the version from the generated ``_version`` module.
+
+		:returns: The version, or ``None`` if the module hasn't been generated.
+	"""
+	try:
+		import _version
+	except ImportError:
+		return None
+	return _version.pretty_version
+
+def get_pretty_version(use_git=False):
+	""" Gets the version string.
+
+		:param use_git: Ask git if there is no generated version module.
+		:type use_git: bool
+		:returns: The version, or :data:`unknown_version`.
+	"""
+	pretty_version = cached_version()
+	if pretty_version != None:
+		return pretty_version
+
+	if use_git:
+		try:
+			return git_version()
+		except (OSError, subprocess.CalledProcessError):
+			pass
+
+	return unknown_version
+
+def write_version_module(pretty_version, path=version_module_path):
+	""" Generates a version module, for :func:`cached_version`.
+	"""
+	with open(path + ".tmp", "w") as version_module:
+		version_module.write("# Generated by eunomia/version.py. Do not edit.\n")
+		version_module.write("pretty_version = {!r}\n".format(pretty_version))
+	os.replace(path + ".tmp", path)
+
+def main(args=None):
+	# __main__ imports this module on startup, for the bot's version, which shouldn't pay for argparse.
+	import argparse
+
+	parser = argparse.ArgumentParser(description="Generate the version module from git, so eunomia doesn't have to run git on startup.")
+	parser.add_argument("--output", metavar="FILE", default=version_module_path, help="Where to write the module.")
+	options = parser.parse_args(args)
+
+	try:
+		pretty_version = git_version()
+	except (OSError, subprocess.CalledProcessError):
+		print("Could not get the version from git.")
+		return 1
+
+	write_version_module(pretty_version, options.output)
+	print("{} ({})".format(pretty_version, options.output))
+	return 0
+
+if __name__ == "__main__":
+	sys.exit(main())
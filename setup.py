@@ -1,8 +1,34 @@
+import os
+import subprocess
+import sys
+
 from setuptools import setup
+from setuptools.command.build_py import build_py
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), "eunomia"))
+import version
+
+class build_py_with_version(build_py):
+	""" Also generates eunomia/_version.py in the build, so the installed bot never has to run git on startup.
+	"""
+	def run(self):
+		super().run()
+
+		try:
+			pretty_version = version.git_version()
+		except (OSError, subprocess.CalledProcessError):
+			# Not building from a checkout. Keep the version module of the source tree, if it has one.
+			return
+
+		version.write_version_module(pretty_version, os.path.join(self.build_lib, "eunomia", "_version.py"))
 
 setup(name="eunomia",
 	version="0.1.0",
 	packages=["eunomia"],
+	cmdclass={"build_py": build_py_with_version},
+	extras_require={
+		"analytics": ["numpy"]
+	},
 	entry_points={
 		"console_scripts": [
 			"eunomia = eunomia.__main__:main"
@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+# The modules use flat imports (they are run as scripts from eunomia/), so the tests import them the same way.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "eunomia"))
+
+@pytest.fixture
+def work_dir(tmp_path, monkeypatch):
+	""" Runs a test in a temporary directory, with every log written below it.
+	"""
+	import eunomialog
+
+	monkeypatch.chdir(tmp_path)
+	monkeypatch.setattr(eunomialog, "log_root", str(tmp_path / "logs"))
+	return tmp_path
+
+@pytest.fixture
+def stub_bot(work_dir):
+	""" An :class:`bot.EunomiaBot` in ``#test``, on a :class:`stubirc.StubConnection` and a :class:`clock.FakeClock`.
+	"""
+	import stubirc
+	from clock import FakeClock
+
+	bot_inst = stubirc.build_bot("#test", clock=FakeClock())
+	yield bot_inst
+	stubirc.release_bot(bot_inst)
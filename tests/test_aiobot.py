@@ -0,0 +1,60 @@
+import asyncio
+import threading
+
+import pytest
+
+import aiobot
+import stubirc
+
+@pytest.fixture
+def loop():
+	loop = asyncio.new_event_loop()
+	yield loop
+	loop.close()
+
+def test_repeating_timer_can_be_cancelled(loop):
+	scheduler = aiobot.LoopScheduler(loop)
+	runs = []
+	repeating = scheduler.execute_every(0.01, lambda: runs.append(1))
+
+	loop.run_until_complete(asyncio.sleep(0.035))
+	repeating.cancel()
+	ran = len(runs)
+	loop.run_until_complete(asyncio.sleep(0.03))
+
+	assert ran >= 2
+	assert len(runs) == ran
+
+def test_search_index_is_written_on_the_executor(work_dir, loop):
+	bot_inst = aiobot.AioEunomiaBot(["#test"], "eunomia", "stub.invalid", "eunomia stub", loop=loop)
+	bot_inst.connection = stubirc.StubConnection("eunomia")
+	bot_inst.send_queue.connection = bot_inst.connection
+	bot_inst.enable_search()
+
+	search_index = bot_inst.channel_states["#test"].channel_logger.search_index
+	assert isinstance(search_index, aiobot.DeferredSearchIndex)
+	threads = []
+	add = search_index.search_index.add
+
+	def add_and_record_thread(*args):
+		threads.append(threading.get_ident())
+		add(*args)
+
+	search_index.search_index.add = add_and_record_thread
+
+	async def talk():
+		for (nick, text) in (("alice", "zebra crossing"), ("bob", "eunomia: search zebra")):
+			bot_inst.reactor._handle_event(bot_inst.connection, stubirc.make_event("pubmsg", nick, "#test", [text]))
+			await asyncio.sleep(0)
+		await asyncio.sleep(0.7)
+
+	try:
+		loop.run_until_complete(talk())
+		assert bot_inst.log_writer.pending() == 0
+	finally:
+		bot_inst.close_channels()
+		bot_inst.log_writer.close()
+
+	assert len(threads) == 2
+	assert threading.get_ident() not in threads
+	assert [sent[2] for sent in bot_inst.connection.sent if sent[0] == "PRIVMSG"][0].endswith("<alice> zebra crossing")
@@ -0,0 +1,84 @@
+import os
+
+import pytest
+
+import archive
+
+def write_log(path, count=200):
+	""" Writes a daily log of lines of varying (byte) lengths, and returns ``(offset, line)`` for each of them.
+	"""
+	lines = []
+	offset = 0
+	with open(path, "wb") as logfile:
+		for i in range(count):
+			line = "00:00:{:02d} <nick{}> {}".format(i % 60, i, "é漢x" * (i % 17))
+			data = (line + "\n").encode("utf-8")
+			logfile.write(data)
+			lines.append((offset, line))
+			offset += len(data)
+	return lines
+
+@pytest.mark.parametrize("compression", sorted(archive.compressions))
+def test_archived_log_reads_back_at_the_same_offsets(tmp_path, compression):
+	path = str(tmp_path / "2016-01-01.log")
+	lines = write_log(path)
+	archive.archive_log(path, compression, block_size=256)
+
+	assert not os.path.exists(path)
+	(compressed_path, found) = archive.archive_path(path)
+	assert found == compression
+	# Small blocks, so the reads below have to seek through the index.
+	assert len(archive.read_index(compressed_path + ".idx")) > 10
+
+	assert list(archive.read_lines(path)) == lines
+	for (offset, line) in lines:
+		assert archive.read_line_at(path, offset) == line
+	middle = len(lines) // 2
+	assert list(archive.read_lines(path, lines[middle][0])) == lines[middle:]
+	assert archive.read_tail_lines(path, 3) == [line for (offset, line) in lines[-3:]]
+	assert archive.log_days(str(tmp_path)) == [("2016-01-01", path)]
+
+def test_plain_log_offsets_match_the_archived_ones(tmp_path):
+	path = str(tmp_path / "2016-01-01.log")
+	lines = write_log(path)
+
+	assert list(archive.read_lines(path)) == lines
+	assert archive.read_line_at(path, lines[7][0]) == lines[7][1]
+	assert archive.read_line_at(path, os.path.getsize(path)) == None
+
+def test_archiver_only_archives_days_before_today(work_dir):
+	for date in ("2016-01-01", "2016-01-02", "2016-01-03"):
+		write_log(str(work_dir / "{}.log".format(date)), 5)
+
+	archiver = archive.Archiver(delay=0)
+	try:
+		archiver.archive_dir(str(work_dir), "2016-01-03")
+	finally:
+		archiver.close()
+
+	assert sorted(name for name in os.listdir(work_dir) if name.endswith(".log") or name.endswith(".gz")) == ["2016-01-01.log.gz", "2016-01-02.log.gz", "2016-01-03.log"]
+
+def test_traffic_replays_an_archived_day(tmp_path):
+	import traffic
+
+	path = str(tmp_path / "2016-01-01.log")
+	with open(path, "w") as logfile:
+		logfile.write("--- log begin ---\n")
+		logfile.write("00:00:01 *** Joins: alice\n")
+		logfile.write("00:00:02 <alice> we should have cake\n")
+		logfile.write("00:00:03 * bob agrees (mostly)\n")
+		logfile.write("00:00:04 *** Topic: \"cake\" by alice\n")
+		logfile.write("00:00:05 *** Parts: bob (off to bake)\n")
+		logfile.write("00:00:06 *** Quits: alice ()\n")
+	expected = [
+		("join", "alice", []),
+		("pubmsg", "alice", ["we should have cake"]),
+		("action", "bob", ["agrees (mostly)"]),
+		("part", "bob", ["off to bake"]),
+		("quit", "alice", [""]),
+	]
+	assert traffic.from_log(path) == expected
+
+	archive.archive_log(path)
+	assert traffic.from_log(path) == expected
+	assert traffic.from_log(archive.archive_path(path)[0], count=2) == expected[:2]
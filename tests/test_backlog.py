@@ -0,0 +1,64 @@
+import datetime
+
+import pytest
+
+import stubirc
+from backlog import Backlog, BacklogItem, PUBMSG
+from clock import FakeClock
+
+def say(bot_inst, nick, text):
+	stubirc.dispatch(bot_inst, stubirc.make_event("pubmsg", nick, "#test", [text]))
+
+def passed(bot_inst):
+	return [passed.proposal.message for passed in bot_inst.channel_states["#test"].legislator.pending]
+
+def pubmsg(nick, text):
+	return BacklogItem(PUBMSG, nick, text, datetime.time(12, 0))
+
+@pytest.mark.parametrize(("vote", "proposal"), [
+	("ALICE{M}: :D", "<alice[m]> second"),
+	("Alice[M]: :D~1", "<alice[m]> first"),
+])
+def test_nick_votes_find_the_nick_case_insensitively(stub_bot, vote, proposal):
+	say(stub_bot, "alice[m]", "first")
+	say(stub_bot, "alice[m]", "second")
+	for voter in ("bob", "carol", "dave"):
+		say(stub_bot, voter, vote)
+
+	assert passed(stub_bot) == [proposal]
+
+def test_nick_vote_for_an_evicted_message_is_ignored(work_dir):
+	bot_inst = stubirc.build_bot("#test", backlog_length=5, clock=FakeClock())
+	try:
+		say(bot_inst, "alice", "we should have cake")
+		for i in range(10):
+			say(bot_inst, "bob", "chatter {}".format(i))
+		for voter in ("carol", "dave", "erin"):
+			say(bot_inst, voter, "alice: :D")
+
+		assert passed(bot_inst) == []
+	finally:
+		stubirc.release_bot(bot_inst)
+
+def test_nick_message_counts_back_from_the_newest():
+	backlog = Backlog(10)
+	for item in (pubmsg("alice", "one"), pubmsg("bob", "two"), pubmsg("Alice", "three")):
+		backlog.append(item)
+
+	assert backlog.nick_message("ALICE", 0) == 2
+	assert backlog.nick_message("alice", 1) == 0
+	assert backlog.nick_message("alice", 2) == None
+	assert backlog.nick_message("carol") == None
+
+def test_nick_index_forgets_evicted_messages():
+	backlog = Backlog(2, slack=1)
+	backlog.append(pubmsg("alice", "one"))
+	backlog.append(pubmsg("bob", "two"))
+	backlog.append(pubmsg("bob", "three"))
+
+	# Evicted, but still known as of a line from before the eviction (for another `slack` appends).
+	assert backlog.nick_message("alice") == None
+	assert backlog.nick_message("alice", as_of=1) == 0
+
+	backlog.append(pubmsg("bob", "four"))
+	assert "alice" not in backlog.nick_index
@@ -0,0 +1,98 @@
+import pytest
+
+import sendqueue
+import stubirc
+
+def say(bot_inst, nick, text):
+	stubirc.dispatch(bot_inst, stubirc.make_event("pubmsg", nick, "#test", [text]))
+
+def privmsgs(bot_inst):
+	return [sent for sent in bot_inst.connection.sent if sent[0] == "PRIVMSG"]
+
+def line_bytes(sent):
+	""" The length of a recorded PRIVMSG, as irc.client.ServerConnection would send it.
+	"""
+	(command, target, text) = sent
+	return len("{} {} :{}\r\n".format(command, target, text).encode("utf-8"))
+
+@pytest.mark.parametrize("filler", ["x" * 480, "é" * 300, "漢" * 200], ids=["ascii", "latin", "cjk"])
+def test_search_reply_to_an_overlong_line_fits_an_irc_line(stub_bot, filler):
+	stub_bot.enable_search()
+	say(stub_bot, "alice", "zebra " + filler)
+	say(stub_bot, "bob", "eunomia: search zebra")
+
+	replies = privmsgs(stub_bot)
+	assert len(replies) == 1
+	assert replies[0][2].startswith("bob: [")
+	assert "<alice> zebra " + filler[:10] in replies[0][2]
+	assert replies[0][2].endswith("...")
+	assert line_bytes(replies[0]) <= sendqueue.max_line_bytes
+
+def test_search_reply_to_a_short_line_is_not_cut(stub_bot):
+	stub_bot.enable_search()
+	say(stub_bot, "alice", "zebra crossing")
+	say(stub_bot, "bob", "eunomia: search zebra")
+
+	replies = privmsgs(stub_bot)
+	assert len(replies) == 1
+	assert replies[0][2].endswith("<alice> zebra crossing")
+
+def test_truncate_cuts_on_a_character_boundary():
+	assert sendqueue.truncate("abc", 3) == "abc"
+	assert sendqueue.truncate("abcdef", 5) == "ab..."
+	assert sendqueue.truncate("ééé", 5) == "é..."
+
+def test_stats_reply_fits_an_irc_line(work_dir):
+	import eunomialog
+	import metrics
+	from clock import FakeClock
+
+	channels = ["#osdev-offtopic", "#a-rather-long-channel-name-for-a-test"]
+	bot_inst = stubirc.build_bot(channels, log_writer=eunomialog.LogWriter(), metrics=metrics.Metrics(), clock=FakeClock())
+	try:
+		bot_inst.enable_flood_filter()
+		for i in range(20):
+			stubirc.dispatch(bot_inst, stubirc.make_event("pubmsg", "alice", channels[0], ["line {}".format(i)]))
+		stubirc.dispatch(bot_inst, stubirc.make_event("pubmsg", "somebody_with_a_long_nick", channels[0], ["eunomia: stats"]))
+	finally:
+		stubirc.release_bot(bot_inst)
+
+	replies = privmsgs(bot_inst)
+	assert len(replies) == 1
+	assert "pipeline.legislate" in replies[0][2]
+	assert "backlog.size" not in replies[0][2]
+	assert line_bytes(replies[0]) <= sendqueue.max_line_bytes
+
+def test_restored_backlog_keeps_counting_votes(work_dir):
+	import journal
+	from clock import FakeClock
+
+	clock = FakeClock()
+	def say_at(bot_inst, nick, text):
+		clock.advance(1)
+		say(bot_inst, nick, text)
+
+	before = stubirc.build_bot("#test", clock=clock)
+	try:
+		say_at(before, "alice", "we should have cake")
+		for nick in ("bob", "carol", "dave"):
+			say_at(before, nick, ":D")
+		say_at(before, "erin", "we should have pie")
+		say_at(before, "bob", ":D")
+		say_at(before, "carol", ":D")
+		before.close_channels()
+	finally:
+		stubirc.release_bot(before)
+	assert [record["proposal"] for record in journal.ProposalJournal("#test", read_only=True)] == ["<alice> we should have cake"]
+
+	clock.advance(60)
+	after = stubirc.build_bot("#test", clock=clock)
+	try:
+		after.restore_backlogs()
+		say_at(after, "dave", ":D")
+		after.close_channels()
+	finally:
+		stubirc.release_bot(after)
+
+	# The cake passed before the restart, and isn't journaled again.
+	assert [record["proposal"] for record in journal.ProposalJournal("#test", read_only=True)] == ["<alice> we should have cake", "<erin> we should have pie"]
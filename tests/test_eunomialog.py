@@ -0,0 +1,21 @@
+import eunomialog
+
+def test_writer_writes_everything_before_close_returns(work_dir):
+	# Long enough that nothing would be written by the time close() is called, if it didn't flush.
+	writer = eunomialog.LogWriter(batch_size=1000, flush_interval=60)
+	logger = eunomialog.ChannelLogger("#test", writer)
+	lines = ["00:00:00 <alice> line {}".format(i) for i in range(2500)]
+	for line in lines:
+		logger.append(line)
+	logger.append(["00:00:01 <bob> last", "00:00:01 <bob> lines"])
+
+	writer.close()
+
+	with open(logger.log_filename, encoding="utf-8") as logfile:
+		assert logfile.read().splitlines() == lines + ["00:00:01 <bob> last", "00:00:01 <bob> lines"]
+	assert writer.pending() == 0
+
+def test_close_is_safe_to_call_twice(work_dir):
+	writer = eunomialog.LogWriter()
+	writer.close()
+	writer.close()
@@ -0,0 +1,104 @@
+import datetime
+
+import legislation
+from backlog import BacklogItem, ACTION, JOIN, PART, PUBMSG, QUIT, TOPIC
+from floodfilter import FloodFilter, ADMIT, SHED, COALESCE
+
+def line(kind, nick, text, when):
+	vote = legislation.parse_vote(text) if kind == PUBMSG else None
+	return BacklogItem(kind, nick, text, datetime.time(0, 0, 0), vote=vote, when=when)
+
+def presence(kind, nick, when):
+	return line(kind, nick, "*** {}: {}".format(kind, nick), when)
+
+def test_repeats_past_the_limit_are_shed():
+	flood_filter = FloodFilter(repeat_limit=3)
+	verdicts = [flood_filter.admit(line(PUBMSG, "nick{}".format(i), "buy now", 100 + i)) for i in range(5)]
+
+	assert verdicts == [ADMIT, ADMIT, ADMIT, SHED, SHED]
+	assert flood_filter.shed == 2
+
+def test_a_nick_past_its_limit_is_shed():
+	flood_filter = FloodFilter(nick_limit=4)
+	verdicts = [flood_filter.admit(line(PUBMSG, "alice", "line {}".format(i), 100 + i * 0.1)) for i in range(5)]
+
+	assert verdicts == [ADMIT] * 4 + [SHED]
+	# Other nicks aren't affected.
+	assert flood_filter.admit(line(ACTION, "bob", "waves", 101)) == ADMIT
+
+def test_an_overloaded_channel_sheds_everything_but_votes():
+	flood_filter = FloodFilter(overload_limit=5)
+	for i in range(5):
+		assert flood_filter.admit(line(PUBMSG, "nick{}".format(i), "line {}".format(i), 100)) == ADMIT
+
+	assert flood_filter.admit(line(PUBMSG, "carol", "something new", 100)) == SHED
+	assert flood_filter.admit(line(PUBMSG, "dave", ":D", 100)) == ADMIT
+
+def test_votes_are_admitted_past_every_limit():
+	flood_filter = FloodFilter(repeat_limit=1, nick_limit=1)
+	verdicts = [flood_filter.admit(line(PUBMSG, "alice", ":D", 100 + i)) for i in range(4)]
+
+	assert verdicts == [ADMIT] * 4
+	assert flood_filter.shed == 0
+
+def test_unauthored_lines_are_never_counted():
+	flood_filter = FloodFilter(overload_limit=1)
+	for i in range(5):
+		assert flood_filter.admit(line(TOPIC, "op", "*** op changes topic to 'x'", 100)) == ADMIT
+	assert flood_filter.admit(line(PUBMSG, "alice", "hi", 100)) == ADMIT
+
+def test_the_window_slides():
+	flood_filter = FloodFilter(window=10.0, repeat_limit=1)
+	assert flood_filter.admit(line(PUBMSG, "alice", "hello", 100)) == ADMIT
+	assert flood_filter.admit(line(PUBMSG, "bob", "hello", 105)) == SHED
+
+	# Exactly a window after the first, it is forgotten, but the second one still counts.
+	assert flood_filter.admit(line(PUBMSG, "carol", "hello", 110)) == SHED
+	# Shed lines count too, so the window has to slide past the last of them.
+	assert flood_filter.admit(line(PUBMSG, "dave", "hello", 119)) == SHED
+	assert flood_filter.admit(line(PUBMSG, "erin", "hello", 129.5)) == ADMIT
+	assert flood_filter.nick_counts == {"erin": 1}
+	assert flood_filter.text_counts == {"hello": 1}
+
+def test_presence_past_the_limit_is_coalesced():
+	flood_filter = FloodFilter(presence_limit=3)
+	kinds = [JOIN, JOIN, PART, JOIN, PART, QUIT, JOIN]
+	verdicts = [flood_filter.admit(presence(kind, "nick{}".format(i), 100 + i)) for (i, kind) in enumerate(kinds)]
+
+	assert verdicts == [ADMIT] * 3 + [COALESCE] * 4
+	assert flood_filter.coalesced == 4
+	assert flood_filter.coalesced_counts == {JOIN: 2, PART: 1, QUIT: 1}
+	assert flood_filter.flood_start == 103
+
+	# Presence doesn't count against the other limits.
+	assert flood_filter.admit(line(PUBMSG, "alice", "what is going on", 106)) == ADMIT
+
+def test_presence_is_admitted_again_once_the_window_slides():
+	flood_filter = FloodFilter(window=10.0, presence_limit=2)
+	for when in (100, 101, 102):
+		flood_filter.admit(presence(JOIN, "nick", when))
+
+	assert flood_filter.admit(presence(JOIN, "nick", 111)) == ADMIT
+	assert flood_filter.presence_count == 2
+
+def test_summary_is_due_a_window_after_the_flood_started():
+	flood_filter = FloodFilter(window=10.0, presence_limit=1)
+	assert flood_filter.take_summary(100) == None
+
+	flood_filter.admit(presence(JOIN, "nick0", 100))
+	for (i, kind) in enumerate([JOIN, JOIN, PART, QUIT]):
+		assert flood_filter.admit(presence(kind, "nick{}".format(i + 1), 100.5 + i)) == COALESCE
+
+	assert flood_filter.take_summary(110.4) == None
+	assert flood_filter.take_summary(110.5) == "*** Flood: 2 joins, 1 parts, 1 quits in 3s"
+
+	# Taken once; the next flood starts counting from zero.
+	assert flood_filter.take_summary(120) == None
+	assert flood_filter.flood_start == None
+	assert flood_filter.coalesced_counts == {JOIN: 0, PART: 0, QUIT: 0}
+
+def test_summary_of_a_single_line_flood_says_one_second():
+	flood_filter = FloodFilter(window=10.0, presence_limit=0)
+	flood_filter.admit(presence(QUIT, "nick", 100))
+
+	assert flood_filter.take_summary(110) == "*** Flood: 0 joins, 0 parts, 1 quits in 1s"
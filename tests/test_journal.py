@@ -0,0 +1,82 @@
+import os
+
+import pytest
+
+import journal
+
+def test_read_only_journal_of_a_missing_channel_creates_nothing(work_dir):
+	proposal_journal = journal.ProposalJournal("#nowhere", read_only=True)
+
+	assert len(proposal_journal) == 0
+	assert list(proposal_journal) == []
+	with pytest.raises(IndexError):
+		proposal_journal.get(0)
+	with pytest.raises(ValueError):
+		proposal_journal.append({"proposal": "x"})
+	assert not os.path.exists(proposal_journal.log_dir)
+
+def test_read_only_journal_reads_what_was_appended(work_dir):
+	journal.ProposalJournal("#test").append({"proposal": "first"})
+
+	proposal_journal = journal.ProposalJournal("#test", read_only=True)
+	assert len(proposal_journal) == 1
+	assert [record["proposal"] for record in proposal_journal] == ["first"]
+
+def test_listing_a_mistyped_channel_creates_nothing(work_dir, capsys):
+	assert journal.main(["#typo"]) == 1
+	assert "No proposal journal" in capsys.readouterr().out
+	assert not os.path.exists(work_dir / "logs")
+
+def journal_with(count):
+	proposal_journal = journal.ProposalJournal("#test")
+	for i in range(count):
+		proposal_journal.append({"proposal": "proposal {}".format(i)})
+	return proposal_journal
+
+def proposals(proposal_journal):
+	return [record["proposal"] for record in proposal_journal]
+
+def test_recovery_cuts_off_a_torn_record(work_dir):
+	proposal_journal = journal_with(3)
+	size = os.path.getsize(proposal_journal.journal_path)
+	# The last record was only written partially, and never indexed.
+	with open(proposal_journal.journal_path, "r+b") as journal_file:
+		journal_file.truncate(size - 5)
+	with open(proposal_journal.index_path, "r+b") as index_file:
+		index_file.truncate(2 * journal.index_entry.size)
+
+	reopened = journal.ProposalJournal("#test")
+	assert len(reopened) == 2
+	assert proposals(reopened) == ["proposal 0", "proposal 1"]
+
+	assert reopened.append({"proposal": "proposal 2 again"}) == 2
+	assert proposals(journal.ProposalJournal("#test")) == ["proposal 0", "proposal 1", "proposal 2 again"]
+
+def test_recovery_indexes_records_missing_from_a_short_index(work_dir):
+	proposal_journal = journal_with(3)
+	# Died while writing the index entry of the last record: half an entry is left of it.
+	with open(proposal_journal.index_path, "r+b") as index_file:
+		index_file.truncate(2 * journal.index_entry.size + 3)
+
+	reopened = journal.ProposalJournal("#test")
+	assert len(reopened) == 3
+	assert reopened.get(-1)["proposal"] == "proposal 2"
+
+	assert reopened.append({"proposal": "proposal 3"}) == 3
+	assert proposals(journal.ProposalJournal("#test")) == ["proposal {}".format(i) for i in range(4)]
+
+def test_recovery_cuts_off_a_damaged_record(work_dir):
+	proposal_journal = journal_with(2)
+	# Flip the last byte of the last record, so its CRC doesn't match.
+	with open(proposal_journal.journal_path, "r+b") as journal_file:
+		journal_file.seek(-1, os.SEEK_END)
+		last = journal_file.read(1)
+		journal_file.seek(-1, os.SEEK_END)
+		journal_file.write(bytes([last[0] ^ 0xff]))
+	with open(proposal_journal.index_path, "r+b") as index_file:
+		index_file.truncate(journal.index_entry.size)
+
+	reopened = journal.ProposalJournal("#test")
+	assert proposals(reopened) == ["proposal 0"]
+	assert reopened.append({"proposal": "proposal 1 again"}) == 1
+	assert proposals(journal.ProposalJournal("#test")) == ["proposal 0", "proposal 1 again"]
@@ -0,0 +1,138 @@
+import legislation
+import replay
+import stubirc
+from backlog import Backlog, BacklogItem, PUBMSG
+from clock import FakeClock
+
+def say(bot_inst, nick, text):
+	stubirc.dispatch(bot_inst, stubirc.make_event("pubmsg", nick, "#test", [text]))
+
+def passed(bot_inst):
+	return [passed.proposal.message for passed in bot_inst.channel_states["#test"].legislator.pending]
+
+def test_three_basic_votes_pass_a_proposal(stub_bot):
+	say(stub_bot, "alice", "we should have cake")
+	say(stub_bot, "bob", ":D")
+	say(stub_bot, "carol", ":D")
+	assert passed(stub_bot) == []
+
+	say(stub_bot, "dave", ":D")
+	assert passed(stub_bot) == ["<alice> we should have cake"]
+
+def test_a_message_between_votes_starts_a_new_run(stub_bot):
+	say(stub_bot, "alice", "we should have cake")
+	say(stub_bot, "bob", ":D")
+	say(stub_bot, "carol", ":D")
+	say(stub_bot, "erin", "no pie")
+	say(stub_bot, "dave", ":D")
+
+	assert passed(stub_bot) == []
+
+def test_indexed_vote_without_an_active_proposal_is_ignored(stub_bot):
+	# Before the incremental tally, these counted anyway, and the third one legislated itself.
+	say(stub_bot, "alice", "we should have cake")
+	say(stub_bot, "bob", ":D~1")
+	say(stub_bot, "carol", ":D~1")
+	say(stub_bot, "dave", ":D~1")
+
+	assert passed(stub_bot) == []
+	assert stub_bot.channel_states["#test"].legislator.votecount == 0
+
+class Channel:
+	""" A backlog and its legislator, outside of any bot. Records go to a :class:`replay.ProposalCollector`.
+	"""
+	def __init__(self, capacity=100):
+		self.clock = FakeClock()
+		self.backlog = Backlog(capacity)
+		self.journal = replay.ProposalCollector()
+		self.legislator = legislation.Legislation("#test", self.journal, self.clock, replay.null_logger)
+
+	def say(self, nick, text, seconds=1):
+		self.clock.advance(seconds)
+		item = BacklogItem(PUBMSG, nick, text, self.clock.timestamp, legislation.parse_vote(text), self.clock.now)
+		self.backlog.append(item)
+		self.legislator.dereference_if_vote(item, self.backlog)
+
+	def pass_proposal(self, text="we should have cake"):
+		self.say("alice", text)
+		for voter in ("bob", "carol", "dave"):
+			self.say(voter, ":D")
+
+	@property
+	def records(self):
+		return self.journal.records
+
+def context_texts(record):
+	""" The context lines of a record, without their times.
+	"""
+	return [line.split(" ", 1)[1] for line in record["context"]]
+
+def test_record_waits_for_the_context_after_the_vote():
+	channel = Channel()
+	channel.pass_proposal()
+	channel.say("erin", ":D", 60)
+	channel.say("frank", "after")
+	assert channel.records == []
+
+	# More than context_minutes_after after the vote that passed it.
+	channel.say("erin", "much later", 120)
+
+	[record] = channel.records
+	assert record["proposal"] == "<alice> we should have cake"
+	assert record["legislated"] == "2016-01-01T00:00:04"
+	# Votes after it passed count too.
+	assert record["votes"] == 4
+	assert context_texts(record)[-2:] == ["<erin> :D", "<frank> after"]
+
+def test_context_starts_context_minutes_before_the_proposal():
+	channel = Channel()
+	channel.say("erin", "too old")
+	channel.say("erin", "recent", legislation.context_minutes_before * 60)
+	channel.pass_proposal()
+	channel.legislator.flush()
+
+	assert context_texts(channel.records[0])[:2] == ["<erin> recent", "<alice> we should have cake"]
+
+def test_context_before_the_proposal_is_half_the_cap():
+	channel = Channel()
+	for i in range(legislation.context_max_lines):
+		channel.say("erin", "line {}".format(i))
+	channel.pass_proposal()
+	channel.legislator.flush()
+
+	context = context_texts(channel.records[0])
+	assert context[0] == "<erin> line {}".format(legislation.context_max_lines // 2)
+	assert context.index("<alice> we should have cake") == legislation.context_max_lines // 2
+
+def test_record_is_written_once_it_has_the_maximum_context():
+	channel = Channel()
+	channel.pass_proposal()
+	for i in range(legislation.context_max_lines):
+		channel.say("erin", "line {}".format(i), 0)
+
+	[record] = channel.records
+	assert len(record["context"]) == legislation.context_max_lines
+	assert context_texts(record)[0] == "<alice> we should have cake"
+
+def test_context_survives_backlog_eviction():
+	channel = Channel(capacity=5)
+	channel.say("erin", "before")
+	channel.pass_proposal()
+	for i in range(10):
+		channel.say("erin", "line {}".format(i))
+	channel.say("erin", "much later", 120)
+
+	context = context_texts(channel.records[0])
+	assert context[:2] == ["<erin> before", "<alice> we should have cake"]
+	assert context[-1] == "<erin> line 9"
+	assert len(context) == 15
+
+def test_flush_writes_pending_records_with_the_context_so_far():
+	channel = Channel()
+	channel.pass_proposal()
+	channel.say("erin", "after")
+	channel.legislator.flush()
+
+	[record] = channel.records
+	assert context_texts(record)[-1] == "<erin> after"
+	assert channel.legislator.pending == []
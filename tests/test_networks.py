@@ -0,0 +1,35 @@
+import irc.client
+
+import networks
+
+class Owner:
+	""" Stands in for a bot: its bound methods are handlers of its connection.
+	"""
+	def __init__(self, reactor, calls):
+		self.connection = reactor.server()
+		self.calls = calls
+
+	def first(self, connection, event):
+		self.calls.append((self, "first"))
+
+	def second(self, connection, event):
+		self.calls.append((self, "second"))
+
+def test_handlers_are_routed_in_priority_order_and_see_changes():
+	reactor = networks.SharedReactor()
+	calls = []
+	(one, two) = (Owner(reactor, calls), Owner(reactor, calls))
+	reactor.add_global_handler("pubmsg", one.second, 5)
+	reactor.add_global_handler("pubmsg", two.first)
+	event = irc.client.Event("pubmsg", "alice!a@example.org", "#test", ["hi"])
+
+	reactor._handle_event(one.connection, event)
+	assert calls == [(one, "second")]
+
+	# Handlers added (or removed) after an event of the same type came in are used from then on.
+	reactor.add_global_handler("pubmsg", one.first, 1)
+	reactor.remove_global_handler("pubmsg", two.first)
+	del calls[:]
+	reactor._handle_event(one.connection, event)
+	reactor._handle_event(two.connection, event)
+	assert calls == [(one, "first"), (one, "second")]
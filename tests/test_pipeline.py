@@ -0,0 +1,35 @@
+import eunomialog
+import journal
+import stubirc
+import traffic
+from clock import FakeClock
+
+def journal_after(work_dir, monkeypatch, events, tick_events, backlog_length=50):
+	""" Delivers the events a second apart, drains the pipeline every ``tick_events`` events,
+		and returns what was journaled.
+	"""
+	root = str(work_dir / "tick{}".format(tick_events))
+	monkeypatch.setattr(eunomialog, "log_root", root)
+
+	clock = FakeClock()
+	bot_inst = stubirc.build_bot("#test", backlog_length=backlog_length, clock=clock)
+	try:
+		for (i, event) in enumerate(stubirc.make_events(events, "#test")):
+			clock.advance(1)
+			bot_inst.reactor._handle_event(bot_inst.connection, event)
+			if (i + 1) % tick_events == 0:
+				bot_inst.pipeline.drain()
+		bot_inst.close_channels()
+	finally:
+		stubirc.release_bot(bot_inst)
+
+	return list(journal.ProposalJournal("#test", root=root, read_only=True))
+
+def test_batched_drains_journal_the_same_records(work_dir, monkeypatch):
+	events = traffic.generate("vote_storm", 3000, users=20)
+
+	one_by_one = journal_after(work_dir, monkeypatch, events, 1)
+	batched = journal_after(work_dir, monkeypatch, events, 32)
+
+	assert len(one_by_one) > 100
+	assert batched == one_by_one
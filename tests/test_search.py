@@ -0,0 +1,15 @@
+import stubirc
+
+def test_flood_summaries_are_not_indexed(stub_bot):
+	stub_bot.enable_search()
+	stub_bot.enable_flood_filter(presence_limit=2)
+	for i in range(5):
+		stubirc.dispatch(stub_bot, stubirc.make_event("join", "user{}".format(i), "#test", []))
+	stub_bot.clock.advance(11)
+	stub_bot.flush_flood_summaries()
+	stubirc.dispatch(stub_bot, stubirc.make_event("pubmsg", "bob", "#test", ["eunomia: search nick:none"]))
+	stubirc.dispatch(stub_bot, stubirc.make_event("pubmsg", "bob", "#test", ["eunomia: search flood"]))
+
+	log_lines = open(stub_bot.channel_states["#test"].channel_logger.log_filename).read()
+	assert "*** Flood:" in log_lines
+	assert [sent[2] for sent in stub_bot.connection.sent if sent[0] == "PRIVMSG"] == ["bob: No matches."] * 2
@@ -0,0 +1,49 @@
+import irc.client
+import irc.schedule
+
+import sendqueue
+
+class FakeSocket:
+	def __init__(self):
+		self.sent = []
+
+	def send(self, data):
+		self.sent.append(data)
+
+def make_connection():
+	""" A real irc.client.ServerConnection, so lines are checked the way they would be live, on a fake socket.
+	"""
+	connection = irc.client.ServerConnection(irc.client.Reactor())
+	connection.socket = FakeSocket()
+	return connection
+
+def test_lines_irc_refuses_are_dropped_and_the_rest_still_sent(work_dir):
+	connection = make_connection()
+	queue = sendqueue.SendQueue(connection, irc.schedule.DefaultScheduler())
+
+	queue.privmsg("#test", "x" * 600)
+	queue.privmsg("#test", "two\nlines")
+	queue.privmsg("#test", "fine")
+
+	assert connection.socket.sent == [b"PRIVMSG #test :fine\r\n"]
+	assert queue.invalid == 2
+	assert queue.sent == 1
+
+def test_lines_refused_after_waiting_do_not_break_the_timer(work_dir):
+	connection = make_connection()
+	now = [0.0]
+	queue = sendqueue.SendQueue(connection, irc.schedule.DefaultScheduler(), rate=1, burst=1, time_function=lambda: now[0])
+
+	queue.privmsg("#test", "first")
+	queue.privmsg("#test", "x" * 600)
+	queue.privmsg("#test", "last")
+	assert queue.depth() == 2
+
+	now[0] += 1
+	queue.on_timer()
+	now[0] += 1
+	queue.on_timer()
+
+	assert connection.socket.sent == [b"PRIVMSG #test :first\r\n", b"PRIVMSG #test :last\r\n"]
+	assert queue.invalid == 1
+	assert queue.depth() == 0